@@ -1,9 +1,16 @@
-from util import run_search_function
+from bitboard import BOTTOM_MASK, COLUMN_MASKS, SearchBoard, center_distance, get_bitboards, longest_run
+from connectfour import ZOBRIST_CELL_KEYS, ZOBRIST_SIDE_TO_MOVE_KEY
+from profiling import profiled
+from util import is_quiet, run_search_function
 
 
+@profiled
 def basic_evaluate(board):
     """
     The original focused-evaluate function.
+
+    This computes the same scores as basic_evaluate_by_cells, using bitboard
+    operations instead of walking the board cell by cell.
     """
     if board.is_game_over():
         # If the game has been won, we know that it must have been
@@ -12,6 +19,23 @@ def basic_evaluate(board):
         # Therefore, we can't have won, so return -1000.
         # (note that this causes a tie to be treated like a loss)
         score = -1000
+    else:
+        current, mask = get_bitboards(board)
+        score = longest_run(current) * 10
+        # Prefer having your pieces in the center of the board.
+        score -= center_distance(current)
+        score += center_distance(current ^ mask)
+
+    return score
+
+
+def basic_evaluate_by_cells(board):
+    """
+    The original focused-evaluate function, as originally written, cell by cell.
+    It is kept as the reference implementation for basic_evaluate.
+    """
+    if board.is_game_over():
+        score = -1000
     else:
         score = board.longest_chain(board.get_current_player_id()) * 10
         # Prefer having your pieces in the center of the board.
@@ -38,6 +62,151 @@ def get_all_next_moves(board):
             pass
 
 
+class LazyChild(object):
+    """
+    A cheap description of a move that hasn't been played yet.
+
+    Building a new board for every move, only to have the search prune most
+    of them, is a waste.  A LazyChild only builds the board it stands for
+    when materialize() is called.  Its Zobrist key and bitboards (and so its
+    transposition table keys) are known without building anything.
+    """
+    __slots__ = ('parent', 'column', '_board')
+
+    def __init__(self, parent, column):
+        self.parent = parent
+        self.column = column
+        self._board = None
+
+    def get_zobrist_key(self):
+        """
+        Return the Zobrist key of the board that this move leads to
+        """
+        if self._board is not None:
+            return self._board.get_zobrist_key()
+
+        parent = self.parent
+        # An empty column reports a height of board_height; its token lands on the bottom row
+        row = min(parent.get_height_of_column(self.column), parent.board_height - 1)
+        return (parent.get_zobrist_key() ^ ZOBRIST_CELL_KEYS[parent.get_current_player_id()][row][self.column]
+                ^ ZOBRIST_SIDE_TO_MOVE_KEY)
+
+    def get_bitboards(self):
+        """
+        Return the (current, mask) bitboards of the board that this move leads to
+        """
+        if self._board is not None:
+            return get_bitboards(self._board)
+
+        current, mask = get_bitboards(self.parent)
+        return current ^ mask, mask | ((mask + BOTTOM_MASK) & COLUMN_MASKS[self.column])
+
+    def materialize(self):
+        """
+        Return the board that this move leads to, building it if necessary
+        """
+        if self._board is None:
+            self._board = self.parent.do_move(self.column)
+            # Don't keep the whole chain of parent boards alive
+            self.parent = None
+
+        return self._board
+
+    def release(self):
+        """
+        Tell the move that the search is done with its board
+        """
+        pass
+
+
+class InPlaceChild(LazyChild):
+    """
+    A LazyChild of a bitboard.SearchBoard.  Rather than building a new board,
+    materialize() plays the move on the parent board itself, and release()
+    takes it back.
+    """
+    __slots__ = ('_played',)
+
+    def __init__(self, parent, column):
+        LazyChild.__init__(self, parent, column)
+        self._played = False
+
+    def get_zobrist_key(self):
+        """
+        Return the Zobrist key of the board that this move leads to
+        """
+        if self._played:
+            return self.parent.get_zobrist_key()
+
+        return LazyChild.get_zobrist_key(self)
+
+    def get_bitboards(self):
+        """
+        Return the (current, mask) bitboards of the board that this move leads to
+        """
+        if self._played:
+            return self.parent.get_bitboards()
+
+        return LazyChild.get_bitboards(self)
+
+    def materialize(self):
+        """
+        Play this move on the parent board, and return it
+        """
+        if not self._played:
+            self.parent.play(self.column)
+            self._played = True
+
+        return self.parent
+
+    def release(self):
+        """
+        Take this move back, if it was played
+        """
+        if self._played:
+            self.parent.undo()
+            self._played = False
+
+
+def lazy_child(board, column):
+    """
+    Return a LazyChild for the specified move: an InPlaceChild if the board is a SearchBoard
+    """
+    if isinstance(board, SearchBoard):
+        return InPlaceChild(board, column)
+
+    return LazyChild(board, column)
+
+
+def materialize(board):
+    """
+    Return the board itself, or the board that a LazyChild stands for
+    """
+    if isinstance(board, LazyChild):
+        return board.materialize()
+
+    return board
+
+
+def release(board):
+    """
+    Tell a LazyChild that the search is done with it; searches call this
+    after searching each move.  Other boards are left alone.
+    """
+    if isinstance(board, LazyChild):
+        board.release()
+
+
+def get_lazy_next_moves(board):
+    """
+    Return a generator of all moves that the current player could take from this position,
+    as (move, LazyChild) tuples.  Moves on a SearchBoard are played in place.
+    """
+    for i in range(board.board_width):
+        if board.get_height_of_column(i) >= 0:
+            yield (i, lazy_child(board, i))
+
+
 def is_terminal(depth, board):
     """
     Generic terminal state check, true when maximum depth is reached or
@@ -48,19 +217,32 @@ def is_terminal(depth, board):
 
 def minimax_find_board_value(board, depth, eval_fn,
                              get_next_moves_fn=get_all_next_moves,
-                             is_terminal_fn=is_terminal):
+                             is_terminal_fn=is_terminal,
+                             cancel_token=None,
+                             stats=None):
     """
     Minimax helper function: Return the minimax value of a particular board,
     given a particular depth to estimate to
     """
+    if cancel_token is not None:
+        cancel_token.check()
+    if stats is not None:
+        stats.nodes += 1
+
+    board = materialize(board)
+
     if is_terminal_fn(depth, board):
+        if stats is not None:
+            stats.evaluations += 1
         return eval_fn(board)
 
     best_val = None
     
     for move, new_board in get_next_moves_fn(board):
         val = -1 * minimax_find_board_value(new_board, depth-1, eval_fn,
-                                            get_next_moves_fn, is_terminal_fn)
+                                            get_next_moves_fn, is_terminal_fn,
+                                            cancel_token, stats)
+        release(new_board)
         if best_val is None or val > best_val:
             best_val = val
 
@@ -70,27 +252,47 @@ def minimax_find_board_value(board, depth, eval_fn,
 def minimax(board, depth, eval_fn=basic_evaluate,
             get_next_moves_fn=get_all_next_moves,
             is_terminal_fn=is_terminal,
-            verbose=True):
+            verbose=True,
+            cancel_token=None,
+            inplace=False,
+            stats=None):
     """
     Do a minimax search to the specified depth on the specified board.
 
     board -- the ConnectFourBoard instance to evaluate
     depth -- the depth of the search tree (measured in maximum distance from a leaf to the root)
     eval_fn -- (optional) the evaluation function to use to give a value to a leaf of the tree; see "focused_evaluate" in the lab for an example
+    cancel_token -- (optional) a util.CancellationToken; once it is cancelled, the search raises util.SearchCancelled
+    inplace -- (optional) if True, search on a mutable bitboard.SearchBoard copy of the board; with a
+               get_next_moves_fn that generates LazyChild's (eg. get_lazy_next_moves), moves are
+               then played and undone in place instead of building a board per node
+    stats -- (optional) a util.SearchStats to record the search in
 
     Returns an integer, the column number of the column that the search determines you should add a token to
     """
     
+    if inplace:
+        board = SearchBoard.from_board(board)
+
+    if stats is not None:
+        stats.start_iteration(depth)
+        stats.nodes += 1
+
     best_val = None
     
     for move, new_board in get_next_moves_fn(board):
         val = -1 * minimax_find_board_value(new_board, depth-1, eval_fn,
                                             get_next_moves_fn,
-                                            is_terminal_fn)
+                                            is_terminal_fn,
+                                            cancel_token, stats)
+        release(new_board)
         if best_val is None or val > best_val[0]:
             best_val = (val, move, new_board)
+
+    if stats is not None:
+        stats.end_iteration(best_val[1], best_val[0])
             
-    if verbose:
+    if verbose and not is_quiet():
         print("MINIMAX: Decided on column {} with rating {}".format(best_val[1], best_val[0]))
 
     return best_val[1]
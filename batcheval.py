@@ -0,0 +1,101 @@
+"""
+Batched evaluation of many boards at once, using NumPy.
+
+The boards are stacked into an (N, 6, 7) int8 array, in which the tokens of
+each board's current player are 1, their opponent's are -1 and empty cells
+are 0; every evaluation is then a handful of whole-array operations.
+
+NumPy is optional.  Without it, the batch evaluators fall back to
+evaluating the boards one by one.
+"""
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from basicplayer import basic_evaluate
+from bitboard import BOARD_HEIGHT, BOARD_WIDTH, COLUMN_BITS, get_bitboards
+
+
+# The four line directions, as (row step, column step)
+LINE_DIRECTIONS = ((1, 0), (0, 1), (1, 1), (1, -1))
+
+if np is not None:
+    # Bitboard bit index of every (row, col) cell
+    CELL_BITS = np.array([[col * COLUMN_BITS + BOARD_HEIGHT - 1 - row for col in range(BOARD_WIDTH)]
+                          for row in range(BOARD_HEIGHT)], dtype=np.uint64)
+    # Distance of every cell from the center column
+    CENTER_DISTANCES = np.array([[abs(BOARD_WIDTH // 2 - col) for col in range(BOARD_WIDTH)]
+                                 for row in range(BOARD_HEIGHT)], dtype=np.int32)
+
+
+def boards_to_array(boards):
+    """
+    Stack the given boards into an (N, 6, 7) int8 array: 1 for the current
+    player's tokens, -1 for the opponent's, and 0 for empty cells
+    """
+    bitboards = [get_bitboards(board) for board in boards]
+    current = np.array([cur for cur, _ in bitboards], dtype=np.uint64)
+    other = np.array([cur ^ mask for cur, mask in bitboards], dtype=np.uint64)
+
+    current_cells = (current[:, None, None] >> CELL_BITS) & np.uint64(1)
+    other_cells = (other[:, None, None] >> CELL_BITS) & np.uint64(1)
+    return current_cells.astype(np.int8) - other_cells.astype(np.int8)
+
+
+def _shift(cells, row_step, col_step):
+    """
+    Shift a stack of boolean boards by (row_step, col_step), filling with False
+    """
+    shifted = np.zeros_like(cells)
+    rows, cols = cells.shape[1:]
+    shifted[:, max(row_step, 0):rows + min(row_step, 0), max(col_step, 0):cols + min(col_step, 0)] = \
+        cells[:, max(-row_step, 0):rows + min(-row_step, 0), max(-col_step, 0):cols + min(-col_step, 0)]
+    return shifted
+
+
+def longest_runs(cells):
+    """
+    Return, for each board in an (N, 6, 7) boolean array, the length of its
+    longest line of True cells in any of the four line directions
+    """
+    longest = np.zeros(len(cells), dtype=np.int32)
+
+    for row_step, col_step in LINE_DIRECTIONS:
+        # After n rounds, the cells left are the ends of lines of more than n cells
+        line = cells
+        length = 0
+        while True:
+            present = line.any(axis=(1, 2))
+            if not present.any():
+                break
+            length += 1
+            longest = np.maximum(longest, np.where(present, length, 0))
+            line = line & _shift(line, row_step, col_step)
+
+    return longest
+
+
+def basic_evaluate_array(board_array, game_over):
+    """
+    Return the basic_evaluate() scores of an (N, 6, 7) array of boards (see
+    boards_to_array()), given a boolean array of which boards are over
+    """
+    current = board_array == 1
+    other = board_array == -1
+
+    scores = longest_runs(current) * 10
+    scores -= (current * CENTER_DISTANCES).sum(axis=(1, 2))
+    scores += (other * CENTER_DISTANCES).sum(axis=(1, 2))
+    return np.where(game_over, -1000, scores)
+
+
+def basic_evaluate_batch(boards):
+    """
+    Return the basic_evaluate() scores of a list of boards, in order
+    """
+    if np is None:
+        return [basic_evaluate(board) for board in boards]
+
+    game_over = np.array([board.is_game_over() for board in boards], dtype=bool)
+    return basic_evaluate_array(boards_to_array(boards), game_over).tolist()
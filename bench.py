@@ -0,0 +1,518 @@
+"""
+Benchmarks for the Connect Four engine.
+
+Run from the command line, eg.:
+
+    python bench.py do_move
+
+The 'suite' benchmark runs a fixed corpus of positions through every part of
+the engine, and can write its results as JSON, to compare them across commits:
+
+    python bench.py suite --json before.json
+    python bench.py suite --json after.json --compare before.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+from functools import partial
+from time import perf_counter
+
+from basicplayer import basic_evaluate, basic_evaluate_by_cells, get_all_next_moves, minimax
+from bitboard import BitboardConnectFourBoard
+from connectfour import ConnectFourBoard
+from batcheval import basic_evaluate_batch
+from implementation import alpha_beta_search, focused_evaluate, focused_evaluate_batch
+from moveordering import MoveOrderer, center_first_next_moves
+from parallel import LazySMPSearch, RootParallelSearch
+from transposition import TranspositionTable, board_key, symmetric_board_key
+from util import SearchStats, memoize, quiet, run_search_function
+
+
+# Positions to search, as the sequence of columns played from the empty board
+POSITIONS = {
+    'opening': '3',
+    'early': '3324',
+    'midgame': '332415423',
+    'late': '261154156301321063214525',
+}
+
+# The positions of the benchmark suite, by name: (category, sequence of columns played)
+CORPUS = {
+    'empty': ('opening', ''),
+    'center': ('opening', '3'),
+    'early': ('opening', '3324'),
+    'midgame': ('midgame', '332415423'),
+    'midgame_open': ('midgame', '62343221615610'),
+    'win_in_one': ('tactical', '104612314042'),
+    'must_block': ('tactical', '21350064024041'),
+    'late': ('endgame', '261154156301321063214525'),
+    'near_full': ('endgame', '3446035265065036561313652053'),
+}
+
+# The fixed positions of tests.py, as (board array, current player)
+TEST_POSITIONS = {
+    'winning': (((0, 0, 0, 0, 0, 0, 0),
+                 (0, 0, 0, 0, 0, 0, 0),
+                 (0, 0, 0, 0, 0, 0, 0),
+                 (0, 1, 0, 0, 0, 0, 0),
+                 (0, 1, 0, 0, 0, 2, 0),
+                 (0, 1, 0, 0, 2, 2, 0)), 1),
+    'barely_winning': (((0, 0, 0, 0, 0, 0, 0),
+                        (0, 0, 0, 0, 0, 0, 0),
+                        (0, 0, 0, 0, 0, 0, 0),
+                        (0, 2, 2, 1, 1, 2, 0),
+                        (0, 2, 1, 2, 1, 2, 0),
+                        (2, 1, 2, 1, 1, 1, 0)), 2),
+    'basic_start_1': (((0, 0, 0, 0, 0, 0, 0),
+                       (0, 0, 0, 0, 0, 0, 0),
+                       (0, 0, 0, 0, 0, 0, 0),
+                       (0, 0, 0, 0, 0, 0, 0),
+                       (0, 0, 0, 0, 0, 0, 0),
+                       (0, 0, 1, 0, 2, 0, 0)), 1),
+    'basic_start_2': (((0, 0, 0, 0, 0, 0, 0),
+                       (0, 0, 0, 0, 0, 0, 0),
+                       (0, 0, 0, 0, 0, 0, 0),
+                       (0, 0, 0, 0, 0, 0, 0),
+                       (0, 0, 2, 0, 0, 0, 0),
+                       (0, 0, 1, 0, 0, 0, 0)), 1),
+}
+
+
+def board_from_moves(moves, board_class=ConnectFourBoard):
+    """
+    Return the board reached by playing the given sequence of columns from the empty board
+    """
+    board = board_class()
+    for column in moves:
+        board = board.do_move(int(column))
+    return board
+
+
+def random_games(num_games, seed=0):
+    """
+    Return a list of move sequences, one per randomly-played game.
+    Each game is played until it is won or the board fills up.
+    """
+    rng = random.Random(seed)
+    games = []
+
+    for _ in range(num_games):
+        board = BitboardConnectFourBoard()
+        moves = []
+        while not board.is_game_over():
+            column = rng.choice([col for col in range(board.board_width)
+                                 if board.get_height_of_column(col) >= 0])
+            board = board.do_move(column)
+            moves.append(column)
+        games.append(moves)
+
+    return games
+
+
+def bench_do_move(board_class, games):
+    """
+    Replay the given games on boards of the given class.
+    Return the number of moves per second.
+    """
+    num_moves = 0
+    start = perf_counter()
+
+    for moves in games:
+        board = board_class()
+        for column in moves:
+            board = board.do_move(column)
+        num_moves += len(moves)
+
+    return num_moves / (perf_counter() - start)
+
+
+def run_do_move(args):
+    games = random_games(args.games, seed=args.seed)
+    for board_class in (ConnectFourBoard, BitboardConnectFourBoard):
+        print("{:<28} {:>12,.0f} moves/sec".format(board_class.__name__,
+                                                   bench_do_move(board_class, games)))
+
+
+def random_positions(games):
+    """
+    Return every position (on both kinds of boards) reached in the given games
+    """
+    positions = []
+
+    for moves in games:
+        for board_class in (ConnectFourBoard, BitboardConnectFourBoard):
+            board = board_class()
+            for column in moves:
+                board = board.do_move(column)
+                positions.append(board)
+
+    return positions
+
+
+def bench_evaluate(eval_fn, boards):
+    """
+    Evaluate each of the given boards.  Return the number of evaluations per second.
+    """
+    start = perf_counter()
+
+    for board in boards:
+        eval_fn(board)
+
+    return len(boards) / (perf_counter() - start)
+
+
+def run_evaluate(args):
+    positions = random_positions(random_games(args.games, seed=args.seed))
+    for eval_fn in (basic_evaluate_by_cells, basic_evaluate):
+        for board_class in (ConnectFourBoard, BitboardConnectFourBoard):
+            boards = [board for board in positions if type(board) is board_class]
+            print("{:<24} {:<26} {:>12,.0f} evals/sec".format(eval_fn.__name__, board_class.__name__,
+                                                              bench_evaluate(eval_fn, boards)))
+
+
+class CountingEvaluator(object):
+    """
+    Wrap an evaluation function, counting how many times it is called
+    """
+    def __init__(self, eval_fn):
+        self.eval_fn = eval_fn
+        self.count = 0
+
+    def __call__(self, board):
+        self.count += 1
+        return self.eval_fn(board)
+
+
+def ordering_strategies():
+    """
+    Return (name, search kwargs factory) pairs for the move orderings to compare
+    """
+    def move_orderer(lazy, inplace=False):
+        tt = TranspositionTable()
+        return {'get_next_moves_fn': MoveOrderer(tt=tt, lazy=lazy), 'tt': tt, 'inplace': inplace}
+
+    return [('natural', lambda: {'get_next_moves_fn': get_all_next_moves}),
+            ('center_first', lambda: {'get_next_moves_fn': center_first_next_moves}),
+            ('killers_history', lambda: {'get_next_moves_fn': MoveOrderer()}),
+            ('killers_history_tt', lambda: move_orderer(lazy=False)),
+            ('killers_history_tt_lazy', lambda: move_orderer(lazy=True)),
+            ('killers_history_tt_inplace', lambda: move_orderer(lazy=True, inplace=True))]
+
+
+def run_ordering(args):
+    print("{:<10} {:<28} {:>10} {:>8}".format('position', 'ordering', 'evals', 'secs'))
+    for name, moves in sorted(POSITIONS.items()):
+        board = board_from_moves(moves, BitboardConnectFourBoard)
+        for strategy, make_kwargs in ordering_strategies():
+            kwargs = make_kwargs()
+            eval_fn = CountingEvaluator(focused_evaluate)
+            start = perf_counter()
+            # Iterative deepening, so that the orderers have something to learn from
+            for depth in range(1, args.depth + 1):
+                alpha_beta_search(board, depth, eval_fn, verbose=False, **kwargs)
+            print("{:<10} {:<28} {:>10} {:>8.2f}".format(name, strategy, eval_fn.count, perf_counter() - start))
+
+
+def run_batch(args):
+    positions = random_positions(random_games(args.games, seed=args.seed))
+    for size in (7, 49, 343):
+        batches = [positions[i:i + size] for i in range(0, len(positions) - size + 1, size)]
+        for name, eval_batch_fn in (('scalar', lambda boards: [basic_evaluate(board) for board in boards]),
+                                    ('batch', basic_evaluate_batch)):
+            start = perf_counter()
+            for boards in batches:
+                eval_batch_fn(boards)
+            print("{:<8} batches of {:<5} {:>12,.0f} evals/sec".format(
+                name, size, len(batches) * size / (perf_counter() - start)))
+
+    print("{:<10} {:<8} {:>8}".format('position', 'leaves', 'secs'))
+    for name, moves in sorted(POSITIONS.items()):
+        board = board_from_moves(moves, BitboardConnectFourBoard)
+        for leaves, eval_batch_fn in (('scalar', None), ('batch', focused_evaluate_batch)):
+            start = perf_counter()
+            alpha_beta_search(board, args.depth, focused_evaluate, get_next_moves_fn=center_first_next_moves,
+                              eval_batch_fn=eval_batch_fn, verbose=False)
+            print("{:<10} {:<8} {:>8.2f}".format(name, leaves, perf_counter() - start))
+
+
+def run_parallel(args):
+    print("{:<10} {:<10} {:>6} {:>8}".format('position', 'search', 'move', 'secs'))
+    with RootParallelSearch(workers=args.workers) as parallel_search:
+        # Start the worker processes before timing anything
+        parallel_search(ConnectFourBoard(), 1, focused_evaluate, verbose=False)
+        for name, moves in sorted(POSITIONS.items()):
+            board = board_from_moves(moves, BitboardConnectFourBoard)
+            for search_name, search_fn in (('serial', alpha_beta_search), ('parallel', parallel_search)):
+                start = perf_counter()
+                move = search_fn(board, args.depth, focused_evaluate, get_next_moves_fn=center_first_next_moves,
+                                 verbose=False)
+                print("{:<10} {:<10} {:>6} {:>8.2f}".format(name, search_name, move, perf_counter() - start))
+
+    # Iterative deepening, with a table shared by all the iterations
+    helpers = args.workers - 1 if args.workers else None
+    for name, moves in sorted(POSITIONS.items()):
+        board = board_from_moves(moves, BitboardConnectFourBoard)
+        tt = TranspositionTable()
+        serial = partial(alpha_beta_search, tt=tt, get_next_moves_fn=MoveOrderer(tt=tt, lazy=True))
+        with LazySMPSearch(helpers=helpers) as smp_search:
+            smp_search(ConnectFourBoard(), 1, focused_evaluate, verbose=False)
+            smp = partial(smp_search, get_next_moves_fn=MoveOrderer(tt=smp_search.tt, lazy=True))
+            for search_name, search_fn in (('serial_id', serial), ('lazy_smp', smp)):
+                start = perf_counter()
+                for depth in range(1, args.depth + 1):
+                    move = search_fn(board, depth, focused_evaluate, inplace=True, verbose=False)
+                print("{:<10} {:<10} {:>6} {:>8.2f}".format(name, search_name, move, perf_counter() - start))
+
+
+def run_symmetry(args):
+    print("{:<10} {:<10} {:>8} {:>8} {:>9} {:>9} {:>8}".format('position', 'keys', 'evals', 'cached', 'tt_hits',
+                                                                 'tt_size', 'secs'))
+    for name, moves in sorted(POSITIONS.items()):
+        board = board_from_moves(moves, BitboardConnectFourBoard)
+        for keys, key_fn, symmetric in (('plain', board_key, False), ('symmetric', symmetric_board_key, True)):
+            tt = TranspositionTable(symmetric=symmetric)
+            orderer = MoveOrderer(tt=tt, lazy=True)
+            eval_fn = memoize(CountingEvaluator(focused_evaluate), key_fn=key_fn)
+            start = perf_counter()
+            for depth in range(1, args.depth + 1):
+                alpha_beta_search(board, depth, eval_fn, get_next_moves_fn=orderer, tt=tt, inplace=True,
+                                  verbose=False)
+            print("{:<10} {:<10} {:>8} {:>8} {:>9.3f} {:>9} {:>8.2f}".format(
+                name, keys, eval_fn.fn.count, len(eval_fn.memocache), tt.stats()['hit_rate'], len(tt),
+                perf_counter() - start))
+
+
+def run_pvs(args):
+    print("{:<15} {:<14} {:>6} {:>8} {:>8}".format('position', 'search', 'move', 'evals', 'secs'))
+    searches = (('alpha_beta', {}),
+                ('pvs', {'pvs': True}),
+                ('aspiration', {'aspiration_window': args.window}),
+                ('pvs_aspiration', {'pvs': True, 'aspiration_window': args.window}))
+    for name, (board_array, player) in sorted(TEST_POSITIONS.items()):
+        board = BitboardConnectFourBoard(board_array, current_player=player)
+        for search_name, kwargs in searches:
+            tt = TranspositionTable()
+            orderer = MoveOrderer(tt=tt, lazy=True)
+            eval_fn = CountingEvaluator(focused_evaluate)
+            start = perf_counter()
+            # Iterative deepening, so that the aspiration windows have a previous value to go by
+            for depth in range(1, args.depth + 1):
+                move = alpha_beta_search(board, depth, eval_fn, get_next_moves_fn=orderer, tt=tt, inplace=True,
+                                         verbose=False, **kwargs)
+            print("{:<15} {:<14} {:>6} {:>8} {:>8.2f}".format(name, search_name, move, eval_fn.count,
+                                                                perf_counter() - start))
+
+
+def git_revision():
+    """
+    Return the current git commit of the engine, or None if it isn't known
+    """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def corpus_boards(board_class=BitboardConnectFourBoard, copies=1):
+    """
+    Return a list of (name, board) pairs, 'copies' separate boards for every
+    position of the corpus, so that no board is ever evaluated twice
+    """
+    return [(name, board_from_moves(moves, board_class))
+            for name, (_, moves) in CORPUS.items() for _ in range(copies)]
+
+
+def bench_corpus_do_move(board_class, repeat):
+    """
+    Play every legal move of every position of the corpus, 'repeat' times.
+    Return the number of moves per second.
+    """
+    boards = [board for _, board in corpus_boards(board_class)]
+    moves = [(board, col) for board in boards for col in range(board.board_width)
+             if board.get_height_of_column(col) >= 0]
+
+    start = perf_counter()
+    for _ in range(repeat):
+        for board, col in moves:
+            board.do_move(col)
+
+    return repeat * len(moves) / (perf_counter() - start)
+
+
+def bench_search(search_fn, board, depth, **kwargs):
+    """
+    Search the board to the specified depth.
+    Return a dictionary of the move found, the nodes and evaluations it took, and the time.
+    """
+    stats = SearchStats()
+    start = perf_counter()
+    move = search_fn(board, depth, focused_evaluate, verbose=False, stats=stats, **kwargs)
+    return {'depth': depth,
+            'move': move,
+            'nodes': stats.nodes,
+            'evaluations': stats.evaluations,
+            'seconds': perf_counter() - start}
+
+
+def bench_fixed_time(board, seconds):
+    """
+    Search the board by iterative deepening, for the specified time.
+    Return a dictionary of the move found and the deepest depth completed.
+    """
+    stats = SearchStats()
+    tt = TranspositionTable()
+    search_fn = partial(alpha_beta_search, get_next_moves_fn=MoveOrderer(tt=tt, lazy=True), tt=tt, inplace=True)
+    with quiet():
+        move = run_search_function(board, search_fn=search_fn, eval_fn=focused_evaluate, timeout=seconds,
+                                   stats=stats)
+    # The search cut short by the timeout may still add to stats for a moment
+    iterations = list(stats.iterations)
+    return {'seconds': seconds,
+            'move': move,
+            'depth': max([iteration['depth'] for iteration in iterations] or [0]),
+            'nodes': sum(iteration['nodes'] for iteration in iterations)}
+
+
+def run_suite_benchmarks(repeat=200, minimax_depth=4, depth=6, seconds=1.0):
+    """
+    Run the benchmark suite over the corpus, and return its results as a
+    dictionary of JSON-serializable values.
+
+    Node and evaluation counts are the same from one run to the next, as
+    long as the engine searches the same way; throughputs and times depend
+    on the machine, and so does the depth reached in a fixed time.
+    """
+    results = {'revision': git_revision(),
+               'python': platform.python_version(),
+               'settings': {'repeat': repeat, 'minimax_depth': minimax_depth, 'depth': depth,
+                            'seconds': seconds},
+               'corpus': {name: {'category': category, 'moves': moves}
+                          for name, (category, moves) in CORPUS.items()},
+               'do_move': {}, 'evaluate': {}, 'minimax': {}, 'alpha_beta': {}, 'fixed_time': {}}
+
+    for board_class in (ConnectFourBoard, BitboardConnectFourBoard):
+        results['do_move'][board_class.__name__] = {
+            'moves_per_second': bench_corpus_do_move(board_class, repeat)}
+
+    for eval_fn in (basic_evaluate, focused_evaluate):
+        results['evaluate'][eval_fn.__name__] = {}
+        for board_class in (ConnectFourBoard, BitboardConnectFourBoard):
+            boards = [board for _, board in corpus_boards(board_class, copies=repeat)]
+            results['evaluate'][eval_fn.__name__][board_class.__name__] = {
+                'evals_per_second': bench_evaluate(eval_fn, boards)}
+
+    for name, board in corpus_boards():
+        results['minimax'][name] = bench_search(minimax, board, minimax_depth)
+        results['alpha_beta'][name] = bench_search(alpha_beta_search, board, depth)
+        results['fixed_time'][name] = bench_fixed_time(board, seconds)
+
+    return results
+
+
+def flatten_results(results, prefix=''):
+    """
+    Return a dictionary mapping the dotted path of every number in the results to it
+    """
+    flat = {}
+    for key, value in results.items():
+        path = prefix + str(key)
+        if isinstance(value, dict):
+            flat.update(flatten_results(value, path + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+
+    return flat
+
+
+def compare_results(baseline, results):
+    """
+    Return a list of (path, baseline value, new value) for the measurements
+    that differ between two suite results, skipping the settings
+    """
+    before, after = flatten_results(baseline), flatten_results(results)
+    return [(path, before[path], after[path]) for path in sorted(after)
+            if path in before and not path.startswith('settings.') and before[path] != after[path]]
+
+
+def print_suite(results):
+    for board_class, counts in results['do_move'].items():
+        print("do_move   {:<43} {:>12,.0f} moves/sec".format(board_class, counts['moves_per_second']))
+    for eval_fn, by_class in results['evaluate'].items():
+        for board_class, counts in by_class.items():
+            print("evaluate  {:<18} {:<24} {:>12,.0f} evals/sec".format(eval_fn, board_class,
+                                                                       counts['evals_per_second']))
+
+    print("{:<13} {:<9} {:<11} {:>5} {:>9} {:>8} {:>5} {:>9} {:>8} {:>6}".format(
+        'position', 'category', 'search', 'move', 'nodes', 'secs', 'move', 'nodes', 'secs', 'depth'))
+    for name, (category, _) in CORPUS.items():
+        for search in ('minimax', 'alpha_beta'):
+            fixed = results['fixed_time'][name]
+            counts = results[search][name]
+            print("{:<13} {:<9} {:<11} {:>5} {:>9} {:>8.3f}".format(name, category, search, counts['move'],
+                                                                   counts['nodes'], counts['seconds']), end='')
+            # The fixed-time search goes on the alpha-beta line
+            print(" {:>5} {:>9} {:>8.1f} {:>6}".format(fixed['move'], fixed['nodes'], fixed['seconds'],
+                                                       fixed['depth']) if search == 'alpha_beta' else '')
+
+
+def run_suite(args):
+    results = run_suite_benchmarks(repeat=args.repeat, minimax_depth=args.minimax_depth, depth=args.depth,
+                                   seconds=args.seconds)
+    print_suite(results)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print("-- changes since {} --".format(baseline.get('revision') or args.compare))
+        for path, before, after in compare_results(baseline, results):
+            change = '' if path.endswith('.move') or not before else '{:+.1%}'.format((after - before) / before)
+            print("{:<64} {:>12.6g} {:>12.6g} {:>8}".format(path, before, after, change))
+
+
+BENCHMARKS = {
+    'batch': run_batch,
+    'do_move': run_do_move,
+    'evaluate': run_evaluate,
+    'ordering': run_ordering,
+    'parallel': run_parallel,
+    'pvs': run_pvs,
+    'suite': run_suite,
+    'symmetry': run_symmetry,
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks for the Connect Four engine")
+    parser.add_argument('benchmarks', nargs='*', default=sorted(BENCHMARKS),
+                        help='Benchmarks to run, from: {} (all of them by default)'.format(', '.join(sorted(BENCHMARKS))))
+    parser.add_argument('--games', type=int, default=200, help='Number of random games to replay')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for the generated games')
+    parser.add_argument('--depth', type=int, default=6, help='Search depth for the search benchmarks')
+    parser.add_argument('--window', type=int, default=20, help='Half-width of the aspiration windows')
+    parser.add_argument('--minimax-depth', type=int, default=4, help='Search depth for the minimax searches of the suite')
+    parser.add_argument('--seconds', type=float, default=1.0,
+                        help='Time for each fixed-time search of the suite, in seconds')
+    parser.add_argument('--repeat', type=int, default=200,
+                        help='Number of times the suite replays the corpus for its throughputs')
+    parser.add_argument('--json', help="Write the results of the suite to this JSON file")
+    parser.add_argument('--compare', help="Print the differences with the results of the suite in this JSON file")
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Number of worker processes for the parallel searches (the number of CPUs by default)')
+
+    args = parser.parse_args()
+
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark: {}".format(name))
+
+    for name in args.benchmarks:
+        print("== {} ==".format(name))
+        BENCHMARKS[name](args)
@@ -0,0 +1,445 @@
+from connectfour import ConnectFourBoard, InvalidMoveException, ZOBRIST_CELL_KEYS, ZOBRIST_SIDE_TO_MOVE_KEY, compute_zobrist_key
+from profiling import profiled
+
+
+# Bitboard geometry.  Each column takes (board_height + 1) bits; the extra
+# bit on top of every column is a sentinel that is always 0, so that shifting
+# a bitboard never carries a line over from one column into the next.
+#
+#   .  6 13 20 27 34 41 48      <- sentinel row
+#   5  5 12 19 26 33 40 47      <- row 0 of the board array
+#   4  4 11 18 25 32 39 46
+#   3  3 10 17 24 31 38 45
+#   2  2  9 16 23 30 37 44
+#   1  1  8 15 22 29 36 43
+#   0  0  7 14 21 28 35 42      <- row 5 of the board array
+#
+BOARD_WIDTH = ConnectFourBoard.board_width
+BOARD_HEIGHT = ConnectFourBoard.board_height
+COLUMN_BITS = BOARD_HEIGHT + 1
+
+# Shift amounts for the four line directions: vertical, horizontal,
+# and the two diagonals.
+LINE_SHIFTS = (1, COLUMN_BITS, COLUMN_BITS - 1, COLUMN_BITS + 1)
+
+# The lowest bit of every column
+BOTTOM_MASK = sum(1 << (col * COLUMN_BITS) for col in range(BOARD_WIDTH))
+# The highest playable bit of every column (ie., row 0 of the board array)
+TOP_MASK = BOTTOM_MASK << (BOARD_HEIGHT - 1)
+# Every playable cell
+BOARD_MASK = BOTTOM_MASK * ((1 << BOARD_HEIGHT) - 1)
+# Every playable cell of each column
+COLUMN_MASKS = tuple(((1 << BOARD_HEIGHT) - 1) << (col * COLUMN_BITS) for col in range(BOARD_WIDTH))
+
+# Every bit of each column, including the sentinel
+COLUMN_FIELDS = tuple(((1 << COLUMN_BITS) - 1) << (col * COLUMN_BITS) for col in range(BOARD_WIDTH))
+
+# Cells grouped by their distance from the center column, as (distance, mask) pairs
+CENTER_DISTANCE_MASKS = tuple((distance, COLUMN_MASKS[BOARD_WIDTH // 2 - distance] | COLUMN_MASKS[BOARD_WIDTH // 2 + distance])
+                              for distance in range(1, BOARD_WIDTH // 2 + 1))
+
+
+def cell_bit(row, col):
+    """
+    Return the bit corresponding to the specified (row, col) board array cell
+    """
+    return 1 << (col * COLUMN_BITS + BOARD_HEIGHT - 1 - row)
+
+
+def popcount(bitboard):
+    """
+    Return the number of set bits in a bitboard
+    """
+    return bin(bitboard).count("1")
+
+
+def bitboards_from_array(board_array, current_player):
+    """
+    Return the (current, mask) bitboards of a board array: the tokens of the
+    specified current player, and every occupied cell
+    """
+    current = 0
+    mask = 0
+
+    for row, cells in enumerate(board_array):
+        for col, cell in enumerate(cells):
+            if cell != 0:
+                bit = cell_bit(row, col)
+                mask |= bit
+                if cell == current_player:
+                    current |= bit
+
+    return current, mask
+
+
+def get_bitboards(board):
+    """
+    Return the (current, mask) bitboards of any kind of board
+    """
+    try:
+        return board.get_bitboards()
+    except AttributeError:
+        return bitboards_from_array(board.get_board_array(), board.get_current_player_id())
+
+
+def longest_run(bitboard):
+    """
+    Return the length of the longest line of tokens in the bitboard, in any of
+    the four line directions; 0 if the bitboard is empty
+    """
+    longest = 0
+
+    for shift in LINE_SHIFTS:
+        # After n rounds, the bits left are the ends of lines of more than n tokens
+        line = bitboard
+        length = 0
+        while line:
+            length += 1
+            line &= line >> shift
+        longest = max(longest, length)
+
+    return longest
+
+
+def center_distance(bitboard):
+    """
+    Return the sum, over every token in the bitboard, of its distance (in columns) from the center column
+    """
+    return sum(distance * popcount(bitboard & mask) for distance, mask in CENTER_DISTANCE_MASKS)
+
+
+def has_four(bitboard):
+    """
+    Return True iff the bitboard contains four aligned tokens
+    in any of the four line directions
+    """
+    for shift in LINE_SHIFTS:
+        pairs = bitboard & (bitboard >> shift)
+        if pairs & (pairs >> (2 * shift)):
+            return True
+
+    return False
+
+
+def mirror_bitboard(bitboard):
+    """
+    Return the bitboard reflected left to right
+    """
+    # Swap the columns pairwise, from the outside in
+    mirrored = bitboard & COLUMN_FIELDS[BOARD_WIDTH // 2] if BOARD_WIDTH % 2 else 0
+    for col in range(BOARD_WIDTH // 2):
+        shift = (BOARD_WIDTH - 1 - 2 * col) * COLUMN_BITS
+        mirrored |= ((bitboard & COLUMN_FIELDS[col]) << shift) | ((bitboard >> shift) & COLUMN_FIELDS[col])
+
+    return mirrored
+
+
+def position_key(current, mask):
+    """
+    Return a number that identifies the position with the given bitboards,
+    from the point of view of the player to move.  Unlike a Zobrist key, it
+    is exact: different positions never have the same key.  It fits in 64 bits.
+    """
+    # Each column of the mask is a run of bits from the bottom up, so adding
+    # it sets the bit above the column's top token; 'current' adds the rest.
+    return current + mask
+
+
+def canonical_position_key(current, mask):
+    """
+    Return (key, mirrored): the smaller of the position keys of the position and
+    of its mirror image, and whether it is the mirror image's.  A position and
+    its mirror image have the same canonical key; the best move in one is the
+    mirror image of the best move in the other (see mirror_column()).
+    """
+    key = position_key(current, mask)
+    # Columns don't carry into each other, so this is the mirror image's key
+    mirrored_key = mirror_bitboard(key)
+    if mirrored_key < key:
+        return mirrored_key, True
+
+    return key, False
+
+
+def mirror_column(column):
+    """
+    Return the column that is the mirror image of the specified column
+    """
+    return BOARD_WIDTH - 1 - column
+
+
+def canonical_board_key(board):
+    """
+    Return (key, mirrored): the canonical position key of any kind of board
+    (see canonical_position_key()), and whether it is its mirror image's
+    """
+    return canonical_position_key(*get_bitboards(board))
+
+
+class BitboardConnectFourBoard(ConnectFourBoard):
+    """
+    A ConnectFourBoard stored as a pair of integer bitboards.
+
+    The position is described by two integers: the tokens belonging to the
+    player who is about to move ('current'), and every occupied cell ('mask').
+    Per-column height counters make do_move() a couple of integer operations
+    instead of rebuilding the whole board array.
+
+    This class has the same public API as ConnectFourBoard, and can be used
+    anywhere a ConnectFourBoard is expected.  The board array is only built
+    (and then cached) if someone asks for it.
+    """
+
+    def __init__(self, board_array = None, board_already_won=None, modified_column=None, current_player=1, previous_move=-1,
+                 zobrist_key=None):
+        """
+        Create a new BitboardConnectFourBoard.  The arguments have the same
+        meaning as for ConnectFourBoard.
+        """
+        current = 0
+        mask = 0
+        heights = [0] * self.board_width
+
+        if board_array is not None:
+            current, mask = bitboards_from_array(board_array, current_player)
+            for col in range(self.board_width):
+                column_bits = (mask >> (col * COLUMN_BITS)) & ((1 << BOARD_HEIGHT) - 1)
+                heights[col] = column_bits.bit_length()
+
+        if zobrist_key is None:
+            zobrist_key = compute_zobrist_key(board_array or (), current_player)
+
+        self._init_bitboards(current, mask, tuple(heights), current_player, zobrist_key)
+        self._is_win = self._find_win()
+
+    def _init_bitboards(self, current, mask, heights, current_player, zobrist_key):
+        """
+        Set up the internal state of this board from its bitboards
+        """
+        self._current = current
+        self._mask = mask
+        self._heights = heights
+        self._board_array = None
+        self.current_player = current_player
+        self._zobrist_key = zobrist_key
+
+    @classmethod
+    def _from_bitboards(cls, current, mask, heights, current_player, winner, zobrist_key):
+        """
+        Build a board straight from its bitboards, skipping the board array entirely.
+        'winner' must be the id# of the player who has won the board, or 0.
+        """
+        board = cls.__new__(cls)
+        board._init_bitboards(current, mask, heights, current_player, zobrist_key)
+        board._is_win = winner
+        return board
+
+    @classmethod
+    def from_board(cls, board):
+        """
+        Return a BitboardConnectFourBoard with the same position as the given board
+        """
+        return cls(board.get_board_array(), current_player=board.get_current_player_id())
+
+    def get_bitboards(self):
+        """
+        Return a (current, mask) tuple: the tokens of the player who should
+        be moving now, and every occupied cell
+        """
+        return self._current, self._mask
+
+    def get_board_array(self):
+        """
+        Return the board array representing this board (as a tuple of tuples)
+        """
+        if self._board_array is None:
+            self._board_array = tuple( tuple( self.get_cell(row, col) for col in range(self.board_width) )
+                                       for row in range(self.board_height) )
+
+        return self._board_array
+
+    def get_top_elt_in_column(self, column):
+        """
+        Get the id# of the player who put the topmost token in the specified column.
+        Return 0 if the column is empty.
+        """
+        height = self._heights[column]
+        if height == 0:
+            return 0
+
+        return self.get_cell(self.board_height - height, column)
+
+    def get_height_of_column(self, column):
+        """
+        Return the index of the first cell in the specified column that is filled.
+        Return ConnectFourBoard.board_height if the column is empty.
+        """
+        height = self._heights[column]
+        if height == 0:
+            return self.board_height
+
+        return self.board_height - height - 1
+
+    def get_cell(self, row, col):
+        """
+        Get the id# of the player owning the token in the specified cell.
+        Return 0 if it is unclaimed.
+        """
+        bit = cell_bit(row, col)
+        if not self._mask & bit:
+            return 0
+        elif self._current & bit:
+            return self.current_player
+        else:
+            return self.get_other_player_id()
+
+    @profiled
+    def do_move(self, column):
+        """
+        Execute the specified move as the specified player.
+        Return a new board with the result.
+        Raise 'InvalidMoveException' if the specified move is invalid.
+        """
+        if not 0 <= column < self.board_width or self._heights[column] >= self.board_height:
+            raise InvalidMoveException(column, self)
+
+        move_bit = 1 << (column * COLUMN_BITS + self._heights[column])
+        heights = self._heights[:column] + (self._heights[column] + 1,) + self._heights[column+1:]
+        row = self.board_height - heights[column]
+        zobrist_key = self._zobrist_key ^ ZOBRIST_CELL_KEYS[self.current_player][row][column] ^ ZOBRIST_SIDE_TO_MOVE_KEY
+
+        # Only the player who just moved can have completed a new line
+        winner = self._is_win
+        if not winner and has_four(self._current | move_bit):
+            winner = self.current_player
+
+        # The opponent's tokens become the 'current' tokens of the new board
+        return self._from_bitboards(self._current ^ self._mask, self._mask | move_bit, heights,
+                                    self.get_other_player_id(), winner, zobrist_key)
+
+    def _find_win(self):
+        """
+        Return the id# of the player who has four aligned tokens, or 0 if there is none.
+        """
+        if has_four(self._current):
+            return self.current_player
+        elif has_four(self._current ^ self._mask):
+            return self.get_other_player_id()
+
+        return 0
+
+    def is_tie(self):
+        """
+        Return true iff the game has reached a stalemate
+        """
+        return self._mask & TOP_MASK == TOP_MASK
+
+    def clone(self):
+        """
+        Return a duplicate of this board object
+        """
+        return self._from_bitboards(self._current, self._mask, self._heights, self.current_player, self._is_win,
+                                    self._zobrist_key)
+
+    def num_tokens_on_board(self):
+        """
+        Returns the total number of tokens (for either player)
+        currently on the board
+        """
+        return popcount(self._mask)
+
+
+class SearchBoard(BitboardConnectFourBoard):
+    """
+    A mutable board, for use inside a search only.
+
+    Rather than building a new board for every move, a search can play(column)
+    a move on a SearchBoard and undo() it when it is done with the position.
+    This saves allocating a board per node in deep searches.
+
+    Since it changes under their feet, a SearchBoard must not be kept by anyone:
+    don't store it in caches (it isn't hashable; key caches with
+    transposition.board_key instead), and hand snapshot()s to anything else.
+    """
+
+    # Mutable objects can't be hashed
+    __hash__ = None
+
+    def __init__(self, *args, **kwargs):
+        """
+        Create a new SearchBoard.  The arguments have the same meaning as for ConnectFourBoard.
+        """
+        BitboardConnectFourBoard.__init__(self, *args, **kwargs)
+        self._heights = list(self._heights)
+        self._move_stack = []
+
+    @profiled
+    def play(self, column):
+        """
+        Drop a token for the current player into the specified column.
+        Raise 'InvalidMoveException' if the specified move is invalid.
+        """
+        heights = self._heights
+        if not 0 <= column < self.board_width or heights[column] >= self.board_height:
+            raise InvalidMoveException(column, self)
+
+        player = self.current_player
+        self._move_stack.append((column, self._is_win))
+
+        move_bit = 1 << (column * COLUMN_BITS + heights[column])
+        heights[column] += 1
+
+        if not self._is_win and has_four(self._current | move_bit):
+            self._is_win = player
+
+        self._zobrist_key ^= (ZOBRIST_CELL_KEYS[player][self.board_height - heights[column]][column]
+                              ^ ZOBRIST_SIDE_TO_MOVE_KEY)
+        self._current ^= self._mask
+        self._mask |= move_bit
+        self.current_player = self.get_other_player_id()
+        self._board_array = None
+        self._chains_by_player = None
+
+    def undo(self):
+        """
+        Take back the most recent play()
+        """
+        column, self._is_win = self._move_stack.pop()
+
+        heights = self._heights
+        row = self.board_height - heights[column]
+        heights[column] -= 1
+        move_bit = 1 << (column * COLUMN_BITS + heights[column])
+
+        self._mask ^= move_bit
+        self._current ^= self._mask
+        self.current_player = self.get_other_player_id()
+        self._zobrist_key ^= ZOBRIST_CELL_KEYS[self.current_player][row][column] ^ ZOBRIST_SIDE_TO_MOVE_KEY
+        self._board_array = None
+        self._chains_by_player = None
+
+    def get_move_stack(self):
+        """
+        Return the columns played on this board (and not undone yet), oldest first
+        """
+        return [column for column, _ in self._move_stack]
+
+    def snapshot(self):
+        """
+        Return an immutable BitboardConnectFourBoard with the current position
+        """
+        return BitboardConnectFourBoard._from_bitboards(self._current, self._mask, tuple(self._heights),
+                                                        self.current_player, self._is_win, self._zobrist_key)
+
+    def do_move(self, column):
+        """
+        Return a new, immutable board with the result of the specified move.
+        This board is left unchanged.
+        """
+        return self.snapshot().do_move(column)
+
+    def clone(self):
+        """
+        Return an immutable duplicate of this board
+        """
+        return self.snapshot()
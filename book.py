@@ -0,0 +1,225 @@
+"""
+An opening book: the best moves of the first few plies of the game,
+searched deeply ahead of time.
+
+The search is at its least effective (and most expensive) near the empty
+board, so the players look their first moves up in the book instead.
+
+A book file is a short header followed by fixed-size entries sorted by key:
+
+    header: b'C4BK', format version (uint16), number of entries (uint32)
+    entry:  canonical position key (uint64), best move (int8), value (int16)
+
+Positions are keyed by bitboard.canonical_position_key(), so a position and
+its mirror image share one entry.  Books are memory-mapped and looked up
+by binary search, so loading one costs nothing however big it is.
+
+Build a book from the command line, eg.:
+
+    python book.py --plies 6 --depth 8 --output opening.book
+"""
+import argparse
+import mmap
+import os
+import struct
+
+from bitboard import BitboardConnectFourBoard, canonical_board_key, mirror_column
+
+
+MAGIC = b'C4BK'
+VERSION = 1
+HEADER = struct.Struct('<4sHI')
+ENTRY = struct.Struct('<Qbh')
+
+# The book shipped with the players
+DEFAULT_BOOK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'opening.book')
+
+
+class BookFormatError(Exception):
+    """
+    Raised when a file is not a valid opening book
+    """
+    pass
+
+
+def board_book_key(board):
+    """
+    Return (key, mirrored): the canonical book key of a board, and whether the
+    book's entry is for its mirror image
+    """
+    return canonical_board_key(board)
+
+
+class OpeningBook(object):
+    """
+    A read-only, memory-mapped opening book file
+    """
+
+    def __init__(self, path):
+        """
+        Open the book file at 'path'.
+        Raise BookFormatError if it isn't a valid opening book.
+        """
+        self.path = path
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < HEADER.size:
+                raise BookFormatError("{} is too short to be an opening book".format(path))
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, count = HEADER.unpack_from(self._data, 0)
+        if magic != MAGIC or version != VERSION or size != HEADER.size + count * ENTRY.size:
+            self._data.close()
+            raise BookFormatError("{} is not a version {} opening book".format(path, VERSION))
+        self._count = count
+
+    def close(self):
+        self._data.close()
+
+    def __len__(self):
+        return self._count
+
+    def _entry(self, index):
+        return ENTRY.unpack_from(self._data, HEADER.size + index * ENTRY.size)
+
+    def probe(self, board):
+        """
+        Return (move, value) for the board, or None if it isn't in the book
+        """
+        key, mirrored = board_book_key(board)
+
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._entry(middle)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        if low == self._count:
+            return None
+
+        entry_key, move, value = self._entry(low)
+        if entry_key != key:
+            return None
+
+        return (mirror_column(move) if mirrored else move), value
+
+    def get_move(self, board):
+        """
+        Return the book move for the board, or None if it isn't in the book
+        """
+        entry = self.probe(board)
+        return entry[0] if entry is not None else None
+
+
+def write_book(entries, path):
+    """
+    Write a book file from a dictionary mapping canonical keys to (move, value)
+    pairs, with moves given for the canonical orientation
+    """
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(entries)))
+        for key in sorted(entries):
+            move, value = entries[key]
+            f.write(ENTRY.pack(key, move, max(-2**15, min(2**15 - 1, int(value)))))
+
+
+def book_positions(plies):
+    """
+    Return a dictionary mapping canonical keys to one board for every position,
+    up to the specified number of plies from the empty board, that isn't over
+    """
+    positions = {}
+    frontier = [BitboardConnectFourBoard()]
+
+    for _ in range(plies + 1):
+        next_frontier = []
+        for board in frontier:
+            key, _ = board_book_key(board)
+            if key in positions or board.is_game_over():
+                continue
+            positions[key] = board
+            next_frontier.extend(board.do_move(col) for col in range(board.board_width)
+                                 if board.get_height_of_column(col) >= 0)
+        frontier = next_frontier
+
+    return positions
+
+
+def build_book(plies, search_fn, progress=None):
+    """
+    Search every position up to 'plies' plies from the empty board, and return
+    the book entries (see write_book()).
+
+    search_fn(board) must return (move, value): the best move and its value
+    for the player to move.  progress, if specified, is called with the number of
+    positions searched so far and the total after every position.
+    """
+    positions = book_positions(plies)
+    entries = {}
+
+    for key, board in positions.items():
+        move, value = search_fn(board)
+        _, mirrored = board_book_key(board)
+        entries[key] = (mirror_column(move) if mirrored else move), value
+        if progress is not None:
+            progress(len(entries), len(positions))
+
+    return entries
+
+
+_default_book = None
+
+
+def get_default_book():
+    """
+    Return the book shipped with the players, opening it on first use,
+    or None if there is no book file
+    """
+    global _default_book
+    if _default_book is None and os.path.exists(DEFAULT_BOOK_PATH):
+        _default_book = OpeningBook(DEFAULT_BOOK_PATH)
+
+    return _default_book
+
+
+def book_move(board):
+    """
+    Return the move for the board from the default book, or None if it isn't in the book
+    """
+    book = get_default_book()
+    return book.get_move(board) if book is not None else None
+
+
+if __name__ == '__main__':
+    import sys
+    from functools import partial
+
+    from implementation import alpha_beta_search, focused_evaluate
+    from moveordering import MoveOrderer
+    from transposition import TranspositionTable
+
+    parser = argparse.ArgumentParser(description="Build an opening book")
+    parser.add_argument('--plies', type=int, default=4, help='Number of plies from the empty board to cover')
+    parser.add_argument('--depth', type=int, default=8, help='Search depth for every book position')
+    parser.add_argument('--output', default=DEFAULT_BOOK_PATH, help='Book file to write')
+
+    args = parser.parse_args()
+
+    def search(board, depth):
+        tt = TranspositionTable()
+        orderer = MoveOrderer(tt=tt, lazy=True)
+        # Iterative deepening, so that the move ordering is good at full depth
+        for d in range(1, depth + 1):
+            move = alpha_beta_search(board, d, focused_evaluate, get_next_moves_fn=orderer, tt=tt,
+                                     inplace=True, verbose=False)
+        return move, tt.probe(tt.key_for(board)[0]).value
+
+    def progress(done, total):
+        sys.stderr.write("\r{}/{} positions".format(done, total))
+
+    entries = build_book(args.plies, partial(search, depth=args.depth), progress)
+    sys.stderr.write("\n")
+    write_book(entries, args.output)
+    print("Wrote {} positions to {}".format(len(entries), args.output))
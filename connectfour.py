@@ -1,3 +1,10 @@
+import random
+from time import perf_counter
+
+from profiling import profiled
+from util import KillableWorker, TimeLimitExceeded, clear_per_game_caches, quiet
+
+
 def transpose(matrix):
     """
     Transpose a matrix (defined as a list of lists, where each sub-list is a row in the matrix)
@@ -63,7 +70,8 @@ class ConnectFourBoard(object):
                                    1: 'X',
                                    2: 'O' }
     
-    def __init__(self, board_array = None, board_already_won=None, modified_column=None, current_player=1, previous_move=-1):
+    def __init__(self, board_array = None, board_already_won=None, modified_column=None, current_player=1, previous_move=-1,
+                 zobrist_key=None):
         """
         Create a new ConnectFourBoard
 
@@ -77,8 +85,13 @@ class ConnectFourBoard(object):
         If modified_column is specified, it should be the index of the last column
         that had a token dropped into it.
         Both board_already_won and modified_column are used as hints to the
-        'is_win_for_player()' function.  It is fine to not specify them, but if they
-        are specified, they must be correct.
+        win detection: a board that is already won stays won, and otherwise only
+        the lines through the token dropped into modified_column need checking.
+        It is fine to not specify them, but if they are specified, they must be correct.
+
+        zobrist_key can optionally be set to the Zobrist key of the new board
+        (see get_zobrist_key()), if it is already known.  Again, if it is specified,
+        it must be correct.
         """
         if board_array is None:
             self._board_array = ( ( 0, ) * self.board_width , ) * self.board_height
@@ -86,10 +99,19 @@ class ConnectFourBoard(object):
             # Make sure we're storing tuples, so that they're immutable
             self._board_array = tuple( map(tuple, board_array) )
 
-        self._is_win = self.is_win()
-            
+        if board_already_won:
+            self._is_win = board_already_won
+        elif modified_column is not None:
+            self._is_win = self._is_win_from_column(modified_column)
+        else:
+            self._is_win = self._find_win()
+
         self.current_player = current_player
 
+        if zobrist_key is None:
+            zobrist_key = compute_zobrist_key(self._board_array, current_player)
+        self._zobrist_key = zobrist_key
+
     def get_current_player_id(self):
         """
         Return the id of the player who should be moving now
@@ -137,6 +159,7 @@ class ConnectFourBoard(object):
         """
         return self._board_array[row][col]
     
+    @profiled
     def do_move(self, column):
         """
         Execute the specified move as the specified player.
@@ -145,8 +168,11 @@ class ConnectFourBoard(object):
         """
         player_id = self.get_current_player_id()
 
-        if self.get_height_of_column(column) < 0:
+        row = self.get_height_of_column(column)
+        if row < 0:
             raise InvalidMoveException(column, self)
+        # An empty column reports a height of board_height; its token lands on the bottom row
+        row = min(row, self.board_height - 1)
 
         new_board = list( transpose( self.get_board_array() ) )
         target_col = [ x for x in new_board[column] if x != 0 ]
@@ -158,7 +184,10 @@ class ConnectFourBoard(object):
         # Re-immutablize the board
         new_board = tuple( map(tuple, new_board) )
 
-        return ConnectFourBoard(new_board, board_already_won=self.is_win(), modified_column=column, current_player=self.get_other_player_id())
+        zobrist_key = self._zobrist_key ^ ZOBRIST_CELL_KEYS[player_id][row][column] ^ ZOBRIST_SIDE_TO_MOVE_KEY
+
+        return ConnectFourBoard(new_board, board_already_won=self.is_win(), modified_column=column, current_player=self.get_other_player_id(),
+                                zobrist_key=zobrist_key)
 
     def _is_win_from_cell(self, row, col):
         """
@@ -175,6 +204,7 @@ class ConnectFourBoard(object):
                     self._contig_vector_length(row, col, (0,1)) + self._contig_vector_length(row, col, (0,-1)) + 1,
                     self._contig_vector_length(row, col, (-1,1)) + self._contig_vector_length(row, col, (1,-1)) + 1 )
 
+    @profiled
     def _contig_vector_length(self, row, col, direction):
         """
         Starting in the specified cell and going a step of direction = (row_step, col_step),
@@ -190,46 +220,61 @@ class ConnectFourBoard(object):
 
         return count - 1
 
-    def longest_chain(self, playerid):
-        """
-        Returns the length of the longest chain of tokens controlled by this player,
-        0 if the player has no tokens on the board
-        """
-        longest = 0
-        for i in range(self.board_height):
-            for j in range(self.board_width):
-                if self.get_cell(i,j) == playerid:
-                    longest = max( longest, self._max_length_from_cell(i,j) )
+    # The four line directions, as (row_step, col_step).  A chain runs from its
+    # far end in the direction's step to its far end in the opposite step.
+    _chain_directions = ((1,1), (1,0), (0,1), (-1,1))
 
-        return longest
+    # The chains of each player, computed on first use: {playerid: (chains, longest)}
+    _chains_by_player = None
 
-    def _contig_vector_cells(self, row, col, direction):
+    def _chains(self, playerid):
         """
-        Starting in the specified cell and going a step of direction = (row_step, col_step),
-        count how many consecutive cells are owned by the same player as the starting cell.
-        """
-        ret_val = []
-        playerid = self.get_cell(row, col)
+        Return (chains, longest): the frozenset of every chain of tokens controlled
+        by the specified player (see chain_cells()), and the length of the longest one.
 
-        while 0 <= row < self.board_height and 0 <= col < self.board_width and playerid == self.get_cell(row, col):
-            ret_val.append((row, col))
-            row += direction[0]
-            col += direction[1]
+        Each line direction is scanned once, and each chain is walked once, from
+        the token that starts it.  The result is cached, since the board doesn't change.
+        """
+        if self._chains_by_player is None:
+            self._chains_by_player = {}
+        elif playerid in self._chains_by_player:
+            return self._chains_by_player[playerid]
 
-        return ret_val[1:]
+        board_array = self.get_board_array()
+        cells = [ (i,j) for i in range(self.board_height) for j in range(self.board_width)
+                  if board_array[i][j] == playerid ]
+        owned = set(cells)
 
-    def _chain_sets_from_cell(self, row, col):
+        chains = set()
+        longest = 0
+        for row_step, col_step in self._chain_directions:
+            for i, j in cells:
+                # Only start from the end of the chain
+                if (i + row_step, j + col_step) in owned:
+                    continue
+
+                chain = [(i, j)]
+                cell = (i - row_step, j - col_step)
+                while cell in owned:
+                    chain.append(cell)
+                    cell = (cell[0] - row_step, cell[1] - col_step)
+
+                chains.add(tuple(chain))
+                if len(chain) > longest:
+                    longest = len(chain)
+
+        self._chains_by_player[playerid] = (frozenset(chains), longest)
+        return self._chains_by_player[playerid]
+
+    @profiled
+    def longest_chain(self, playerid):
         """
-        Return the max-length chain containing this cell
+        Returns the length of the longest chain of tokens controlled by this player,
+        0 if the player has no tokens on the board
         """
-        return [ tuple(x) for x in [
-                    list(reversed(self._contig_vector_cells(row, col, (1,1)))) + [(row, col)] + self._contig_vector_cells(row, col, (-1,-1)),
-                    list(reversed(self._contig_vector_cells(row, col, (1,0)))) + [(row, col)] + self._contig_vector_cells(row, col, (-1,0)),
-                    list(reversed(self._contig_vector_cells(row, col, (0,1)))) + [(row, col)] + self._contig_vector_cells(row, col, (0,-1)),
-                    list(reversed(self._contig_vector_cells(row, col, (-1,1)))) + [(row, col)] + self._contig_vector_cells(row, col, (1,-1))
-                 ]
-               ]
+        return self._chains(playerid)[1]
 
+    @profiled
     def chain_cells(self, playerid):
         """
         Returns a set of all cells on the board that are part of a chain controlled
@@ -259,31 +304,49 @@ class ConnectFourBoard(object):
         The return value is provided as a set because sets are unique and unordered,
         as is this collection of chains.
         """
-        ret_val = set()
-        for i in range(self.board_height):
-            for j in range(self.board_width):
-                if self.get_cell(i,j) == playerid:
-                    ret_val.update( self._chain_sets_from_cell(i,j) )
-                    
-        return ret_val
+        return set( self._chains(playerid)[0] )
                     
         
-    def is_win(self):
+    def _find_win(self):
         """
-        Return the id# of the player who has won this game.
-        Return 0 if it has not yet been won.
+        Scan the whole board for a winning chain.
+        Return the id# of the player who owns it, or 0 if there is none.
         """
         for i in range(self.board_height):
             for j in range(self.board_width):
                 cell_player = self.get_cell(i,j)
                 if cell_player != 0:
-                    win = self._is_win_from_cell(i,j)
-                    if win:
-                        self._is_win = win
+                    if self._is_win_from_cell(i,j):
                         return cell_player
 
         return 0
 
+    def _is_win_from_column(self, column):
+        """
+        Check only the lines through the topmost token of the specified column.
+        Return the id# of the player who owns that token if it is part of a
+        winning chain, or 0 otherwise.
+        """
+        row = self.get_height_of_column(column) + 1
+        if row >= self.board_height:
+            # The column is empty
+            return 0
+
+        if self._is_win_from_cell(row, column):
+            return self.get_cell(row, column)
+
+        return 0
+
+    @profiled
+    def is_win(self):
+        """
+        Return the id# of the player who has won this game.
+        Return 0 if it has not yet been won.
+
+        The result is computed once, when the board is created, so this is cheap to call.
+        """
+        return self._is_win
+
     def is_game_over(self):
         """
         Return True if the game has been won, False otherwise
@@ -300,7 +363,8 @@ class ConnectFourBoard(object):
         """
         Return a duplicate of this board object
         """
-        return ConnectFourBoard(self._board_array, board_already_won=self._is_win, current_player = self.get_current_player_id())
+        return ConnectFourBoard(self._board_array, board_already_won=self._is_win, current_player = self.get_current_player_id(),
+                                zobrist_key=self._zobrist_key)
 
     def num_tokens_on_board(self):
         """
@@ -321,7 +385,7 @@ class ConnectFourBoard(object):
         Return a string representation of this board
         """
         retVal = [ "  " + ' '.join([str(x) for x in range(self.board_width)]) ]
-        retVal += [ str(i) + ' ' + ' '.join([self.board_symbol_mapping[x] for x in row]) for i, row in enumerate(self._board_array) ]
+        retVal += [ str(i) + ' ' + ' '.join([self.board_symbol_mapping[x] for x in row]) for i, row in enumerate(self.get_board_array()) ]
         return '\n' + '\n'.join(retVal) + '\n'
         
     def __repr__(self):
@@ -330,19 +394,103 @@ class ConnectFourBoard(object):
         """
         return self.__str__()
 
+    def get_zobrist_key(self):
+        """
+        Return the Zobrist key of this board: a 64-bit integer that depends on the
+        tokens on the board and on the player to move.  It is updated incrementally
+        by do_move(), so it is free to ask for, and is meant to be used by
+        caches and transposition tables.
+        """
+        return self._zobrist_key
+
     def __hash__(self):
         """
         Determine the hash key of a board.  The hash key must be the same on any two identical boards.
         """
-        return self._board_array.__hash__()
+        return self._zobrist_key
 
     def __eq__(self, other):
         """
-        Determine whether two boards are equal.
+        Determine whether two boards are equal: they must have the same tokens,
+        and the same player to move.
         """
-        return self.get_board_array() == other.get_board_array()
+        return (self.get_zobrist_key() == other.get_zobrist_key()
+                and self.get_current_player_id() == other.get_current_player_id()
+                and self.get_board_array() == other.get_board_array())
+
+
+# Zobrist keys: one random 64-bit number per (player, row, column) cell, and one
+# for "player 2 is to move".  A board's key is the XOR of the keys of its tokens
+# (and of the side-to-move key, if it applies), so a move updates it with two XORs.
+# The keys come from a fixed seed so that they are the same from run to run.
+_zobrist_rng = random.Random(0xC0FFEE)
+
+ZOBRIST_CELL_KEYS = dict( (player, tuple( tuple( _zobrist_rng.getrandbits(64) for _ in range(ConnectFourBoard.board_width) )
+                                          for _ in range(ConnectFourBoard.board_height) ))
+                          for player in (1, 2) )
+ZOBRIST_SIDE_TO_MOVE_KEY = _zobrist_rng.getrandbits(64)
+
+
+def compute_zobrist_key(board_array, current_player):
+    """
+    Compute the Zobrist key of a board array from scratch
+    """
+    key = ZOBRIST_SIDE_TO_MOVE_KEY if current_player == 2 else 0
+
+    for row, cells in enumerate(board_array):
+        for col, cell in enumerate(cells):
+            if cell != 0:
+                key ^= ZOBRIST_CELL_KEYS[cell][row][col]
+
+    return key
 
     
+# What happens to a player who runs out of time (see ConnectFourRunner)
+TIMEOUT_FORFEIT = 'forfeit'
+TIMEOUT_RANDOM_MOVE = 'random'
+
+# What happens to a player who attempts an illegal move (see ConnectFourRunner)
+ILLEGAL_MOVE_RETRY = 'retry'
+ILLEGAL_MOVE_FORFEIT = 'forfeit'
+
+
+class GameRecord(object):
+    """
+    The record of a game played by a ConnectFourRunner
+    """
+
+    def __init__(self, initial_board):
+        # The board the game started from
+        self.initial_board = initial_board
+        # The columns played, in order
+        self.moves = []
+        # The time (in seconds) each move took the player to decide on
+        self.move_times = []
+        # The number of illegal moves that were attempted
+        self.illegal_moves = 0
+        # The number of moves on which a player ran out of time
+        self.timeouts = 0
+        # The id# of the player who forfeited the game, if any
+        self.forfeit = None
+        # The id# of the winning player, or 0 for a tie; None until the game is over
+        self.winner = None
+        # The board at the end of the game
+        self.final_board = None
+
+    def to_dict(self):
+        """
+        Return the record as a dictionary, eg. to save as JSON
+        """
+        return {'initial_board': [list(row) for row in self.initial_board.get_board_array()],
+                'first_player': self.initial_board.get_current_player_id(),
+                'moves': list(self.moves),
+                'move_times': list(self.move_times),
+                'illegal_moves': self.illegal_moves,
+                'timeouts': self.timeouts,
+                'forfeit': self.forfeit,
+                'winner': self.winner}
+
+
 class ConnectFourRunner(object):
     """
     Runs a game of Connect Four.
@@ -364,20 +512,53 @@ class ConnectFourRunner(object):
 
     The callback functions must return integers corresponding to the columns they want
     to drop a token into.
+
+    player1_callback always plays the tokens of player 1, and player2_callback those of
+    player 2.  If the initial board has player 2 to move, player2_callback moves first.
+
+    The time limit is only enforced if enforce_time_limit is True: each player's
+    callback then runs in a process of its own (see util.KillableWorker), which
+    is killed if the callback runs out of time, and timeout_policy decides what
+    happens to the player:
+
+    TIMEOUT_FORFEIT -- the player loses the game;
+    TIMEOUT_RANDOM_MOVE -- a random legal move is played for them;
+    or a callback -- it is called (in this process) to pick the move instead.
+
+    Similarly, illegal_move_policy decides what happens to a player who attempts
+    an illegal move: ILLEGAL_MOVE_RETRY asks them again, ILLEGAL_MOVE_FORFEIT
+    makes them lose the game.
+
+    For batch play, play_game() runs a game without any output, and returns a GameRecord.
     """
 
-    def __init__(self, player1_callback, player2_callback, board = ConnectFourBoard(), time_limit = 10):
+    def __init__(self, player1_callback, player2_callback, board = ConnectFourBoard(), time_limit = 10,
+                 trusted_callbacks=False, enforce_time_limit=False, timeout_policy=TIMEOUT_FORFEIT,
+                 illegal_move_policy=ILLEGAL_MOVE_RETRY):
         """
         Create a new ConnectFourRunner.
 
         player1_callback and player2_callback are the callback functions for the two players.
         board is the initial board to start with, a generic ConnectFourBoard() by default.
         time_limit is the time (in seconds) allocated per player, 10 seconds by default.
+        trusted_callbacks -- if True, the callbacks are given the game board itself
+                             rather than a clone of it; only use this for callbacks
+                             that never modify the board.
+        enforce_time_limit -- if True, callbacks that take more than time_limit
+                              seconds to move are stopped, and timeout_policy applies.
+                              The callbacks then run in other processes, so they
+                              can't interact with the user.
+        timeout_policy -- what to do when a player runs out of time (see above)
+        illegal_move_policy -- what to do when a player attempts an illegal move (see above)
         """
         self._board = board
         self._time_limit = time_limit     # timeout in seconds
         self.player1_callback = player1_callback
         self.player2_callback = player2_callback
+        self.trusted_callbacks = trusted_callbacks
+        self.enforce_time_limit = enforce_time_limit
+        self.timeout_policy = timeout_policy
+        self.illegal_move_policy = illegal_move_policy
 
     def get_board(self):
         """
@@ -395,41 +576,99 @@ class ConnectFourRunner(object):
         """
         Run the test defined by this test runner.  Print and return the id of the winning player.
         """
-        player1 = (self.player1_callback, 1, self._board.board_symbol_mapping[1])
-        player2 = (self.player2_callback, 2, self._board.board_symbol_mapping[2])
-        
-        win_for_player = []
+        return self._play(verbose, show_moves=True).winner
 
-        while not win_for_player and not self._board.is_tie():            
-            for callback, id, symbol in ( player1, player2 ):
+    def play_game(self):
+        """
+        Run the game without printing anything (the players' searches are
+        silenced too; see util.quiet()).  Return its GameRecord.
+        """
+        with quiet():
+            return self._play(verbose=False, show_moves=False)
+
+    def _play(self, verbose, show_moves):
+        """
+        Play the game, printing the board before every move if verbose is true,
+        and the moves and the result if show_moves is true.  Return its GameRecord.
+        """
+        clear_per_game_caches()
+
+        record = GameRecord(self._board)
+        callbacks = {1: self.player1_callback, 2: self.player2_callback}
+        workers = {}
+        if self.enforce_time_limit:
+            workers = dict((id, KillableWorker(callback)) for id, callback in callbacks.items())
+
+        try:
+            while not self._board.is_game_over() and record.forfeit is None:
                 if verbose:
                     print(str(self._board))
 
-                has_moved = False
+                id = self._board.get_current_player_id()
+                symbol = self._board.board_symbol_mapping[id]
+
+                while True:
+                    board = self._board if self.trusted_callbacks else self._board.clone()
+                    start = perf_counter()
+                    try:
+                        if workers:
+                            new_column = workers[id].call(board, timeout=self._time_limit)
+                        else:
+                            new_column = callbacks[id](board)
+                    except TimeLimitExceeded:
+                        record.timeouts += 1
+                        if show_moves:
+                            print("Player %s (%s) ran out of time." % (id, symbol))
+                        if self.timeout_policy == TIMEOUT_FORFEIT:
+                            record.forfeit = id
+                            break
+                        elif self.timeout_policy == TIMEOUT_RANDOM_MOVE:
+                            new_column = random.choice([col for col in range(board.board_width)
+                                                        if board.get_height_of_column(col) >= 0])
+                        else:
+                            new_column = self.timeout_policy(board)
+                    elapsed = perf_counter() - start
 
-                while not has_moved:
                     try:
-                        new_column = callback(self._board.clone())
-                        print("Player %s (%s) puts a token in column %s" % (id, symbol, new_column))
+                        if show_moves:
+                            print("Player %s (%s) puts a token in column %s" % (id, symbol, new_column))
                         self._board = self._board.do_move(new_column)
-                        has_moved = True
                     except InvalidMoveException as e:
-                        print(str(e))
-                        print("Illegal move attempted.  Please try again.")
+                        record.illegal_moves += 1
+                        if show_moves:
+                            print(str(e))
+                        if self.illegal_move_policy == ILLEGAL_MOVE_FORFEIT:
+                            record.forfeit = id
+                            break
+                        if show_moves:
+                            print("Illegal move attempted.  Please try again.")
                         continue
 
-                if self._board.is_game_over():
-                    win_for_player = self._board.is_win()
+                    record.moves.append(new_column)
+                    record.move_times.append(elapsed)
                     break
+        finally:
+            for worker in workers.values():
+                worker.close()
 
         win_for_player = self._board.is_win()
-                
-        if win_for_player != 0 and self._board.is_tie():
-            print("It's a tie!  No winner is declared.")
-            return 0
+        record.final_board = self._board
+
+        if record.forfeit is not None:
+            record.winner = 3 - record.forfeit
+            if show_moves:
+                print("Player %s forfeits the game." % record.forfeit)
+                self._do_gameend(record.winner)
+        elif win_for_player == 0 and self._board.is_tie():
+            record.winner = 0
+            if show_moves:
+                print("It's a tie!  No winner is declared.")
         else:
-            self._do_gameend(win_for_player)
-            return win_for_player
+            record.winner = win_for_player
+            if show_moves:
+                self._do_gameend(win_for_player)
+
+        return record
 
     def _do_gameend(self, winner):
         """
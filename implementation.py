@@ -1,8 +1,19 @@
 """
 This is the only file you should change in your submission!
 """
-from basicplayer import basic_evaluate, minimax, get_all_next_moves, is_terminal
-from util import memoize, run_search_function, INFINITY, NEG_INFINITY
+from basicplayer import basic_evaluate, minimax, get_all_next_moves, is_terminal, materialize, release
+from batcheval import basic_evaluate_batch
+from book import book_move
+from bitboard import SearchBoard
+from moveordering import MoveOrderer
+from profiling import profiled
+from solver import DRAW, WIN, EndgameSolver
+from transposition import TranspositionTable, board_key, EXACT, LOWER_BOUND, UPPER_BOUND
+from util import CancellationToken, SearchCancelled, is_quiet, memoize, run_search_function, INFINITY, NEG_INFINITY
+from functools import partial
+from time import time
+import atexit
+import math
 import random
 
 # TODO Uncomment and fill in your information here. Think of a creative name that's relatively unique.
@@ -17,6 +28,7 @@ COMPETE = True
 # or lose as late as possible, when it decides that one side is certain to win.
 # You don't have to change how it evaluates non-winning positions.
 
+@profiled
 def focused_evaluate(board):
     """
     Given a board, return a numeric rating of how good
@@ -35,6 +47,19 @@ def focused_evaluate(board):
     #raise NotImplementedError
 
 
+def focused_evaluate_batch(boards):
+    """
+    Return the focused_evaluate() scores of a list of boards, in order
+    """
+    scores = basic_evaluate_batch(boards)
+
+    for i, board in enumerate(boards):
+      if board.is_game_over():
+        scores[i] = -1042 + board.num_tokens_on_board()
+
+    return scores
+
+
 # Create a "player" function that uses the focused_evaluate function
 # You can test this player by choosing 'quick' in the main program.
 quick_to_win_player = lambda board: minimax(board, depth=4,
@@ -44,23 +69,183 @@ def alpha_beta_search_value(board, depth, eval_fn,
                       alpha, beta,
                       get_next_moves_fn,
                       is_terminal_fn,
-                      verbose=True):
+                      verbose=True,
+                      tt=None,
+                      cancel_token=None,
+                      eval_batch_fn=None,
+                      pvs=False,
+                      stats=None):
+    """
+     Return the negamax value of board, searched to the specified depth.
+
+     alpha is the best value the current player is already assured of, and beta is
+     the best value the opponent is already assured of (from their own point of view).
+
+     tt is an optional TranspositionTable used to look up and store search results.
+     cancel_token is an optional util.CancellationToken, checked at every node.
+
+     board may be a basicplayer.LazyChild; its board is only built if the
+     transposition table can't settle its value.
 
+     eval_batch_fn is an optional function that takes a list of boards and
+     returns their eval_fn scores.  If it is specified, the children of nodes
+     at depth 1 are all scored with one eval_batch_fn call.
+
+     If pvs is True, the search is a principal variation search: only the first
+     move is searched with the full window.  The others are searched with a null
+     window, which only proves that they are no better than the best move so
+     far, and are searched again with the full window if they turn out to be better.
+
+     stats is an optional util.SearchStats, to count nodes, evaluations,
+     cutoffs and transposition table hits in.
+    """
+
+    if cancel_token is not None:
+      cancel_token.check()
+    if stats is not None:
+      stats.nodes += 1
+
+    use_tt = tt is not None and depth > 0
+    if use_tt:
+      key, mirrored = tt.key_for(board)
+      entry = tt.probe(key)
+      if entry is not None and stats is not None:
+        stats.tt_hits += 1
+      if entry is not None and entry.depth >= depth:
+        if entry.flag == EXACT:
+          tt.cutoffs += 1
+          if stats is not None:
+            stats.tt_cutoffs += 1
+          return entry.value
+        elif entry.flag == LOWER_BOUND:
+          alpha = max(alpha, entry.value)
+        elif entry.flag == UPPER_BOUND:
+          beta = max(beta, -entry.value)
+        if alpha >= -beta:
+          tt.cutoffs += 1
+          if stats is not None:
+            stats.tt_cutoffs += 1
+          return entry.value
+      alpha_orig, beta_orig = alpha, beta
+
+    board = materialize(board)
     if is_terminal_fn(depth, board):
+        if stats is not None:
+          stats.evaluations += 1
         return eval_fn(board)
+
+    if eval_batch_fn is not None and depth == 1:
+      next_moves, leaf_values = evaluate_leaves(board, get_next_moves_fn, eval_batch_fn)
+      if stats is not None:
+        stats.nodes += len(leaf_values)
+        stats.evaluations += len(leaf_values)
+    else:
+      next_moves, leaf_values = get_next_moves_fn(board), None
+
     val = NEG_INFINITY
-    for move, new_board in get_next_moves_fn(board):
-      temp_val = -1 * alpha_beta_search_value(new_board, depth - 1, eval_fn, beta, alpha, get_next_moves_fn, is_terminal_fn)
+    best_move = None
+    for i, (move, new_board) in enumerate(next_moves):
+      if leaf_values is not None:
+        temp_val = -1 * leaf_values[i]
+      else:
+        temp_val = None
+        if pvs and val != NEG_INFINITY:
+          # Null window: is this move any better than alpha?
+          temp_val = -1 * alpha_beta_search_value(new_board, depth - 1, eval_fn, -null_window_bound(alpha), alpha,
+                                                  get_next_moves_fn, is_terminal_fn, tt=tt, cancel_token=cancel_token,
+                                                  eval_batch_fn=eval_batch_fn, pvs=pvs, stats=stats)
+          if alpha < temp_val < -beta:
+            temp_val = None
+        if temp_val is None:
+          temp_val = -1 * alpha_beta_search_value(new_board, depth - 1, eval_fn, beta, alpha, get_next_moves_fn, is_terminal_fn,
+                                                  tt=tt, cancel_token=cancel_token, eval_batch_fn=eval_batch_fn, pvs=pvs,
+                                                  stats=stats)
+        release(new_board)
       if temp_val > val:
         val = temp_val
+        best_move = move
       if val > alpha:
         alpha = val
       if alpha >= -beta:
+        if stats is not None:
+          stats.record_cutoff(depth)
+        record_cutoff = getattr(get_next_moves_fn, 'record_cutoff', None)
+        if record_cutoff is not None:
+          record_cutoff(board, move, depth)
         break
+
+    if use_tt:
+      if val <= alpha_orig:
+        flag = UPPER_BOUND
+      elif val >= -beta_orig:
+        flag = LOWER_BOUND
+      else:
+        flag = EXACT
+      tt.store(key, depth, val, flag, best_move, mirrored)
+
     return val
 
     #return minimax(board, depth, eval_fn, get_next_moves_fn, is_terminal_fn, verbose=True)
 
+
+def alpha_beta_search_root(next_moves, depth, eval_fn, alpha, upper, get_next_moves_fn, is_terminal_fn, **kwargs):
+    """
+     Search the root moves, given as a list of (move, new_board) tuples, with
+     the window (alpha, upper).  The other arguments are passed on to
+     alpha_beta_search_value.
+
+     Return (value, move) for the first of the best moves, if its value is
+     within the window.  If it is above the window, return the first move
+     that was found to be above it, with a lower bound on its value.  If no
+     move is better than alpha, return None.
+    """
+    pvs = kwargs.get('pvs')
+    best = None
+    for move, new_board in next_moves:
+      val = None
+      if pvs and best is not None:
+        val = -1 * alpha_beta_search_value(new_board, depth - 1, eval_fn, -null_window_bound(alpha), alpha,
+                                           get_next_moves_fn, is_terminal_fn, **kwargs)
+        if alpha < val < upper:
+          val = None
+      if val is None:
+        val = -1 * alpha_beta_search_value(new_board, depth - 1, eval_fn, -upper, alpha, get_next_moves_fn,
+                                           is_terminal_fn, **kwargs)
+      release(new_board)
+      if alpha < val:
+        alpha = val
+        best = (val, move)
+        if alpha >= upper:
+          break
+
+    return best
+
+
+def null_window_bound(alpha):
+    """
+     Return the upper bound of a null window above alpha: the smallest value
+     greater than alpha, so that searching with the window (alpha, bound) only
+     tells whether a move's value is greater than alpha or not
+    """
+    return math.nextafter(alpha, INFINITY)
+
+
+def evaluate_leaves(board, get_next_moves_fn, eval_batch_fn):
+    """
+     Generate every child of board, and score them all with one call to eval_batch_fn.
+     Return the list of (move, child) tuples and the list of their scores.
+    """
+    next_moves = []
+    leaves = []
+    for move, new_board in get_next_moves_fn(board):
+      leaf = materialize(new_board)
+      # A SearchBoard is about to change; score a copy of it
+      leaves.append(leaf.snapshot() if isinstance(leaf, SearchBoard) else leaf)
+      release(new_board)
+      next_moves.append((move, None))
+
+    return next_moves, eval_batch_fn(leaves)
+
 # TODO Write an alpha-beta-search procedure that acts like the minimax-search
 # procedure, but uses alpha-beta pruning to avoid searching bad ideas
 # that can't improve the result. The tester will check your pruning by
@@ -74,7 +259,16 @@ def alpha_beta_search_value(board, depth, eval_fn,
 def alpha_beta_search(board, depth,
                       eval_fn,
                       get_next_moves_fn=get_all_next_moves,
-                      is_terminal_fn=is_terminal):
+                      is_terminal_fn=is_terminal,
+                      tt=None,
+                      cancel_token=None,
+                      first_move=None,
+                      verbose=True,
+                      inplace=False,
+                      eval_batch_fn=None,
+                      pvs=False,
+                      aspiration_window=None,
+                      stats=None):
     """
      board is the current tree node.
 
@@ -86,32 +280,160 @@ def alpha_beta_search(board, depth,
     
      def get_next_moves(board):
        a function that takes a current node (board) and generates
-       all next (move, newboard) tuples.
+       all next (move, newboard) tuples.  newboard may be a basicplayer.LazyChild,
+       in which case the board is only built when the search needs it.  If it also has a
+       record_cutoff(board, move, depth) method (eg. a moveordering.MoveOrderer),
+       that is called whenever a move causes a cutoff, and its new_search()
+       method, if any, is called at the start of the search.
     
      def is_terminal_fn(depth, board):
        is a function that checks whether to statically evaluate
        a board/node (hence terminating a search branch).
+
+     tt is an optional TranspositionTable (see transposition.py) that is
+     shared by all the nodes of this search.  Pass the same table to successive
+     searches (eg., the depths of an iterative deepening search) to reuse
+     their results; it must only ever be used with the same eval_fn.
+
+     cancel_token is an optional util.CancellationToken.  Once it is cancelled,
+     the search stops and raises util.SearchCancelled.
+
+     first_move is an optional move to search first, eg. the best move found
+     by a shallower search; good moves searched early make for more pruning.
+
+     verbose controls whether the decision is printed.
+
+     If inplace is True, the search runs on a mutable bitboard.SearchBoard copy
+     of the board.  With a get_next_moves_fn that generates LazyChild's
+     (eg. basicplayer.get_lazy_next_moves, or a MoveOrderer with lazy=True),
+     moves are then played and undone in place instead of building a new
+     board per node.  eval_fn is then given the SearchBoard itself, so it
+     must not keep it (see bitboard.SearchBoard).
+
+     eval_batch_fn is an optional batch version of eval_fn: a function that
+     takes a list of boards and returns the list of their scores (eg.
+     focused_evaluate_batch).  Nodes one ply above the leaves then score all
+     their children with a single call, instead of one eval_fn call per leaf.
+
+     If pvs is True, the search is a principal variation search (see
+     alpha_beta_search_value).  It returns the same move, usually after
+     evaluating fewer leaves.
+
+     aspiration_window, if specified, is used with a tt that holds the value of
+     this board from a previous search, eg. the previous depth of an iterative
+     deepening search: the board is first searched with a window of
+     aspiration_window around that value, which prunes more.  If the value
+     turns out to be outside of the window, the board is searched again
+     with a full window.
+
+     stats is an optional util.SearchStats to record the search in.
     """
 
-    return_tuple = None
-    alpha = NEG_INFINITY
-    beta = NEG_INFINITY
-    for move, new_board in get_next_moves_fn(board):
-      val = -1 * alpha_beta_search_value(new_board, depth -1, eval_fn, beta, alpha, get_next_moves_fn, is_terminal_fn)
-      if alpha < val:
-        alpha = val
-        return_tuple = (val, move, new_board)
+    if inplace:
+      board = SearchBoard.from_board(board)
+
+    if stats is not None:
+      stats.start_iteration(depth)
+      stats.nodes += 1
 
-    print("ALPHA_BETA: Decided on column {} with rating {}".format(return_tuple[1], return_tuple[0]))
+    if tt is not None:
+      tt.new_search()
+    if hasattr(get_next_moves_fn, 'new_search'):
+      get_next_moves_fn.new_search()
+
+    next_moves = list(get_next_moves_fn(board))
+    if first_move is not None:
+      next_moves = sorted(next_moves, key=lambda move_and_board: move_and_board[0] != first_move)
+
+    search_kwargs = {'tt': tt, 'cancel_token': cancel_token, 'eval_batch_fn': eval_batch_fn, 'pvs': pvs,
+                     'stats': stats}
+    return_tuple = None
+    if aspiration_window is not None and tt is not None:
+      entry = tt.probe(tt.key_for(board)[0])
+      if entry is not None and entry.flag == EXACT:
+        low, high = entry.value - aspiration_window, entry.value + aspiration_window
+        return_tuple = alpha_beta_search_root(next_moves, depth, eval_fn, low, high, get_next_moves_fn,
+                                              is_terminal_fn, **search_kwargs)
+        # The best move is only known for sure if its value is within the window
+        if return_tuple is not None and return_tuple[0] >= high:
+          return_tuple = None
+
+    if return_tuple is None:
+      return_tuple = alpha_beta_search_root(next_moves, depth, eval_fn, NEG_INFINITY, INFINITY, get_next_moves_fn,
+                                            is_terminal_fn, **search_kwargs)
+
+    if tt is not None:
+      key, mirrored = tt.key_for(board)
+      tt.store(key, depth, return_tuple[0], EXACT, return_tuple[1], mirrored)
+
+    if stats is not None:
+      stats.end_iteration(return_tuple[1], return_tuple[0])
+
+    if verbose and not is_quiet():
+      print("ALPHA_BETA: Decided on column {} with rating {}".format(return_tuple[1], return_tuple[0]))
 
     return return_tuple[1]
 
     #raise NotImplementedError
 
 
+# Whether the players below play their first moves from the opening book (see book.py)
+USE_OPENING_BOOK = True
+
+
+def opening_book_move(board):
+    """
+    Return the opening book's move for the board, or None if the book
+    is disabled or doesn't have the position
+    """
+    if not USE_OPENING_BOOK:
+        return None
+
+    return book_move(board)
+
+
+# Once this many cells or fewer are empty, the players below solve the position
+# exactly (see solver.py) instead of searching it with a heuristic evaluation
+ENDGAME_EMPTY_CELLS = 20
+# How long (in seconds) the solver may take before the player falls back to its search
+ENDGAME_TIME_LIMIT = 2
+# The players' endgame solver; its transposition table is kept from move to move
+ENDGAME_SOLVER = EndgameSolver()
+
+
+def endgame_solver_move(board):
+    """
+    Return the endgame solver's move for the board, or None if too many
+    cells are empty or the solver ran out of time
+    """
+    empty_cells = board.board_width * board.board_height - board.num_tokens_on_board()
+    if empty_cells > ENDGAME_EMPTY_CELLS:
+        return None
+
+    try:
+        result = ENDGAME_SOLVER.best_move(board, cancel_token=CancellationToken(time() + ENDGAME_TIME_LIMIT))
+    except SearchCancelled:
+        return None
+
+    if not is_quiet():
+        if result.outcome == DRAW:
+            outcome = "draw"
+        else:
+            outcome = "{} in {} plies".format("win" if result.outcome == WIN else "loss", result.plies)
+        print("SOLVER: Decided on column {} ({})".format(result.move, outcome))
+
+    return result.move
+
+
 # Now you should be able to search twice as deep in the same amount of time.
 # (Of course, this alpha-beta-player won't work until you've defined alpha_beta_search.)
 def alpha_beta_player(board):
+    move = opening_book_move(board)
+    if move is None:
+        move = endgame_solver_move(board)
+    if move is not None:
+        return move
+
     return alpha_beta_search(board, depth=5, eval_fn=focused_evaluate)
     #return run_search_function(board, search_fn=alpha_beta_search, eval_fn=focused_evaluate, timeout=5)
 
@@ -138,11 +460,62 @@ def better_evaluate(board):
 #better_evaluate = memoize(basic_evaluate)
 
 # Uncomment this line to make your better_evaluate run faster.
-better_evaluate = memoize(better_evaluate)
+# The cache is bounded and cleared between games, so that it doesn't grow forever.
+better_evaluate = memoize(better_evaluate, maxsize=2**18, per_game=True, key_fn=board_key)
+
+
+# Transposition table for my_player's searches.  It is kept from move to move,
+# so positions searched while thinking about the previous move are reused.
+MY_PLAYER_TT = TranspositionTable(max_bytes=64 * 2**20)
+# Orders my_player's moves using the transposition table, killer moves and history,
+# without building the boards of moves that get pruned.
+MY_PLAYER_MOVE_ORDERER = MoveOrderer(tt=MY_PLAYER_TT, lazy=True)
+
+# Number of helper processes for my_player.  If it is more than 0, my_player
+# runs a Lazy SMP search (see parallel.LazySMPSearch), which uses more cores
+# to search deeper in the same time.
+MY_PLAYER_HELPERS = 0
+# my_player's Lazy SMP search and move orderer, created on first use
+_my_player_smp = None
+
+
+def get_my_player_smp_search():
+    """
+    Return my_player's Lazy SMP search function, starting its helper processes if needed
+    """
+    global _my_player_smp
+    if _my_player_smp is None:
+        # parallel imports this module, so it can't be imported at the top
+        from parallel import LazySMPSearch
+        search = LazySMPSearch(helpers=MY_PLAYER_HELPERS, tt_bytes=64 * 2**20)
+        atexit.register(search.close)
+        _my_player_smp = partial(search, get_next_moves_fn=MoveOrderer(tt=search.tt, lazy=True), inplace=True)
+
+    return _my_player_smp
+
+
+# Seconds my_player takes for a whole move, the endgame solver's time included
+MY_PLAYER_MOVE_TIME = 5
 
 
 # A player that uses alpha-beta and better_evaluate:
 def my_player(board):
-    return run_search_function(board, search_fn=alpha_beta_search, eval_fn=better_evaluate, timeout=5)
+    deadline = time() + MY_PLAYER_MOVE_TIME
+    move = opening_book_move(board)
+    if move is None:
+        move = endgame_solver_move(board)
+    if move is not None:
+        return move
+
+    # The search gets what is left after the solver gave up
+    timeout = deadline - time()
+    if MY_PLAYER_HELPERS > 0:
+        return run_search_function(board, search_fn=get_my_player_smp_search(), eval_fn=better_evaluate,
+                                   timeout=timeout)
+
+    return run_search_function(board, search_fn=partial(alpha_beta_search, tt=MY_PLAYER_TT,
+                                                        get_next_moves_fn=MY_PLAYER_MOVE_ORDERER,
+                                                        inplace=True),
+                               eval_fn=better_evaluate, timeout=timeout)
 
 # my_player = lambda board: alpha_beta_search(board, depth=4, eval_fn=better_evaluate)
@@ -1,7 +1,9 @@
 import argparse
 
-from connectfour import ConnectFourBoard, human_player, run_game
+from connectfour import ConnectFourBoard, ConnectFourRunner, human_player, run_game
 from basicplayer import basic_player
+import implementation
+import profiling
 from implementation import quick_to_win_player, alpha_beta_player, better_evaluate, my_player
 
 if __name__ == '__main__':
@@ -15,13 +17,21 @@ if __name__ == '__main__':
     my_player: watch my_player play against my_player
     my_player_vs_basic: watch my_player play against basic player
     debug_evaluate: print better_evaluate function return value for board
+    profile: play basic player against alpha_beta_player silently, and print where the time went
+             (set CONNECTFOUR_PROFILE=1 to enable profiling; other modes then print the report too)
     """
     parser = argparse.ArgumentParser(description=DESCRIPTION, formatter_class=argparse.RawTextHelpFormatter)
     parser.add_argument('mode', type=str, help='Mode for playing Connect Four.',
-                        choices=['X', 'O', 'computer', 'quick', 'alphabeta', 'my_player', 'my_player_vs_basic', 'debug_evaluate'])
+                        choices=['X', 'O', 'computer', 'quick', 'alphabeta', 'my_player', 'my_player_vs_basic', 'debug_evaluate',
+                                 'profile'])
+
+    parser.add_argument('--helpers', type=int, default=0,
+                        help='Number of helper processes for my_player (0 to search in a single process).')
 
     args = parser.parse_args()
 
+    implementation.MY_PLAYER_HELPERS = args.helpers
+
     if args.mode == 'X':
         run_game(human_player, basic_player)
     elif args.mode == 'O':
@@ -53,3 +63,11 @@ if __name__ == '__main__':
         print("{} => {}".format(test_board_1, better_evaluate(test_board_1)))
         # better evaluate from player 2
         print("{} => {}".format(test_board_2, better_evaluate(test_board_2)))
+    elif args.mode == 'profile':
+        if not profiling.ENABLED:
+            parser.error("profiling is disabled; run with {}=1".format(profiling.ENV_VAR))
+        record = ConnectFourRunner(basic_player, alpha_beta_player).play_game()
+        print("Played {} moves; winner: {}".format(len(record.moves), record.winner))
+
+    if profiling.ENABLED:
+        profiling.print_report()
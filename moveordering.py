@@ -0,0 +1,128 @@
+"""
+Move ordering for the alpha-beta search.
+
+Alpha-beta prunes the most when the best move is searched first.  The
+functions and classes here are get_next_moves_fn's that generate the same
+(move, new_board) tuples as basicplayer.get_all_next_moves, in a better order.
+"""
+from basicplayer import lazy_child
+
+
+# Columns from the center outwards: central tokens take part in more lines
+CENTER_FIRST_COLUMNS = (3, 2, 4, 1, 5, 0, 6)
+
+
+def get_legal_columns(board):
+    """
+    Return the columns that the current player can drop a token into,
+    from the center outwards
+    """
+    return [col for col in CENTER_FIRST_COLUMNS if board.get_height_of_column(col) >= 0]
+
+
+def center_first_next_moves(board):
+    """
+    Return a generator of all moves that the current player could take from
+    this position, center columns first
+    """
+    for col in get_legal_columns(board):
+        yield (col, board.do_move(col))
+
+
+class MoveOrderer(object):
+    """
+    A get_next_moves_fn that orders moves using what the search has learned so far:
+
+    1. the best move stored in the transposition table for this position, if any;
+    2. the killer moves for this ply: moves that recently caused a cutoff in
+       sibling positions;
+    3. the history heuristic: moves that have caused cutoffs (weighted by the
+       depth of the subtree they pruned) anywhere in the search;
+
+    falling back to center-first order.
+
+    The search reports cutoffs by calling record_cutoff(); alpha_beta_search
+    does that for any get_next_moves_fn that has a record_cutoff method.
+    """
+
+    def __init__(self, tt=None, use_killers=True, use_history=True, num_killers=2, lazy=False):
+        """
+        tt -- an optional TranspositionTable to take best moves from
+        use_killers -- whether to try killer moves early
+        use_history -- whether to order the other moves by their history score
+        num_killers -- how many killer moves to remember per ply
+        lazy -- whether to generate basicplayer.LazyChild's instead of boards
+                (moves on a bitboard.SearchBoard are then played in place)
+        """
+        self.tt = tt
+        self.use_killers = use_killers
+        self.use_history = use_history
+        self.num_killers = num_killers
+        self.lazy = lazy
+        self.clear()
+
+    def clear(self):
+        """
+        Forget all killer moves and history scores
+        """
+        self._killers = {}
+        self._history = {}
+
+    def new_search(self):
+        """
+        Age the history scores, so that recent cutoffs count for more than old ones
+        """
+        for key in self._history:
+            self._history[key] //= 2
+
+    def record_cutoff(self, board, move, depth):
+        """
+        Tell the orderer that playing 'move' on 'board' caused a cutoff,
+        with 'depth' plies left to search
+        """
+        if self.use_killers:
+            ply = board.num_tokens_on_board()
+            killers = self._killers.get(ply, [])
+            if move not in killers:
+                self._killers[ply] = [move] + killers[:self.num_killers - 1]
+
+        if self.use_history:
+            key = (board.get_current_player_id(), move)
+            self._history[key] = self._history.get(key, 0) + depth * depth
+
+    def order_columns(self, board):
+        """
+        Return the legal columns of the board, best first
+        """
+        columns = get_legal_columns(board)
+
+        tt_move = None
+        if self.tt is not None:
+            tt_move = self.tt.get_best_move(*self.tt.key_for(board))
+
+        killers = self._killers.get(board.num_tokens_on_board(), []) if self.use_killers else []
+        player = board.get_current_player_id()
+
+        def priority(col):
+            if col == tt_move:
+                return (0, 0)
+            elif col in killers:
+                return (1, killers.index(col))
+            elif self.use_history:
+                return (2, -self._history.get((player, col), 0))
+            else:
+                return (2, 0)
+
+        # sorted() is stable, so ties stay in center-first order
+        return sorted(columns, key=priority)
+
+    def __call__(self, board):
+        """
+        Return a generator of all moves that the current player could take
+        from this position, best first
+        """
+        for col in self.order_columns(board):
+            if self.lazy:
+                yield (col, lazy_child(board, col))
+            else:
+                yield (col, board.do_move(col))
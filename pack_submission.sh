@@ -1,3 +1,3 @@
 #!/usr/bin/env bash
 
-zip a2-submission.zip basicplayer.py connectfour.py implementation.py main.py tests.py tree_searcher.py util.py LICENSE
+zip a2-submission.zip basicplayer.py batcheval.py bench.py bitboard.py book.py connectfour.py implementation.py main.py moveordering.py parallel.py profiling.py solver.py tests.py tournament.py transposition.py tree_searcher.py util.py opening.book LICENSE
@@ -0,0 +1,359 @@
+"""
+Parallel alpha-beta searches, using several processes.
+
+Python threads can't run searches on more than one core at a time, so the
+searches here run in a pool of worker processes instead.
+
+RootParallelSearch splits the search at the root: each of the (up to 7)
+root moves is searched by a worker.  The workers share the best value found
+so far through shared memory, so that a worker that starts on a root move
+after another one has finished can search it with a narrower window.
+
+LazySMPSearch runs the whole search in this process, while helper processes
+search the same position at the same or the next depth.  They only
+communicate through a shared transposition table, which the helpers fill
+with results that the main search can use.
+"""
+import math
+import os
+import random
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import Array, Value
+
+from basicplayer import get_all_next_moves, is_terminal, materialize, release
+from bitboard import SearchBoard
+from implementation import alpha_beta_search, alpha_beta_search_value
+from transposition import DEFAULT_MAX_BYTES, EXACT, SharedTranspositionTable, TranspositionTable
+from util import CancellationToken, SearchCancelled, is_quiet, NEG_INFINITY
+
+
+# Shared state of the current search, inherited by every worker process:
+# the best (value, root move index) found so far, and the flag that tells
+# the workers to stop.
+_best = None
+_stop = None
+# Each worker's own transposition table, if the search uses them
+_worker_tt = None
+
+
+def _init_worker(best, stop, tt_bytes):
+    """
+    Set up a worker process of a RootParallelSearch
+    """
+    global _best, _stop, _worker_tt
+    _best = best
+    _stop = stop
+    _worker_tt = TranspositionTable(max_bytes=tt_bytes) if tt_bytes else None
+
+
+class SharedFlagCancellationToken(CancellationToken):
+    """
+    A CancellationToken that is also cancelled when a shared flag
+    (a multiprocessing.Value) is set by another process
+    """
+
+    def __init__(self, flag, deadline=None):
+        CancellationToken.__init__(self, deadline)
+        self.flag = flag
+
+    def is_cancelled(self):
+        if self.flag.value:
+            self._cancelled = True
+
+        return CancellationToken.is_cancelled(self)
+
+
+def root_alpha(index, best_value, best_index):
+    """
+    Return the alpha bound to search the root move with the specified index
+    with, given the best value found so far and the index of the move it belongs to.
+
+    The serial search keeps the first of several equally good moves.  A value
+    found by a later move only rules out this move if this move is strictly
+    worse, so the bound is then lowered by the smallest possible amount.
+    """
+    if best_value == NEG_INFINITY or best_index < index:
+        return best_value
+
+    return math.nextafter(best_value, NEG_INFINITY)
+
+
+def search_root_move(index, new_board, depth, eval_fn, get_next_moves_fn, is_terminal_fn, deadline):
+    """
+    Search one root move in a worker process.
+
+    Return (value, exact): the root move's value, and whether it is exact;
+    if it isn't, the move is no better than the best move found before it was
+    searched.
+    """
+    with _best.get_lock():
+        alpha = root_alpha(index, _best[0], _best[1])
+
+    if _worker_tt is not None:
+        _worker_tt.new_search()
+
+    cancel_token = SharedFlagCancellationToken(_stop, deadline)
+    val = -1 * alpha_beta_search_value(new_board, depth - 1, eval_fn, NEG_INFINITY, alpha,
+                                       get_next_moves_fn, is_terminal_fn,
+                                       tt=_worker_tt, cancel_token=cancel_token)
+
+    exact = val > alpha
+    if exact:
+        with _best.get_lock():
+            if val > _best[0] or (val == _best[0] and index < _best[1]):
+                _best[0] = val
+                _best[1] = index
+
+    return val, exact
+
+
+class RootParallelSearch(object):
+    """
+    An alpha-beta search that searches the root moves in parallel, in a pool
+    of worker processes.  It returns the same move as
+    implementation.alpha_beta_search at the same depth.
+
+    Call it like alpha_beta_search; it can be passed to run_search_function
+    as a search_fn.  The board, the evaluation function, get_next_moves_fn
+    and is_terminal_fn are sent to the workers, so they must all be
+    picklable (eg. functions defined at the top level of a module).
+
+    The worker processes are started on the first search and kept until
+    close() is called.
+    """
+
+    # How often (in seconds) to check the cancel_token while waiting for the workers
+    POLL_INTERVAL = 0.02
+
+    def __init__(self, workers=None, tt_bytes=None):
+        """
+        workers -- the number of worker processes; the number of CPUs by default
+        tt_bytes -- if specified, each worker keeps a transposition table of
+                    about this size, from one search to the next.  Only use the
+                    same evaluation function for every search then.  As with
+                    alpha_beta_search's tt, results from deeper searches may
+                    then change the move chosen at a given depth.
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.tt_bytes = tt_bytes
+        self._executor = None
+        self._pending = ()
+        self._best = Array('d', 2)
+        self._stop = Value('b', 0)
+
+    def _get_executor(self):
+        """
+        Return the process pool, starting it if needed
+        """
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                                 initargs=(self._best, self._stop, self.tt_bytes))
+        return self._executor
+
+    def close(self):
+        """
+        Stop the worker processes
+        """
+        self._stop.value = 1
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __call__(self, board, depth, eval_fn,
+                 get_next_moves_fn=get_all_next_moves,
+                 is_terminal_fn=is_terminal,
+                 cancel_token=None,
+                 first_move=None,
+                 verbose=True):
+        """
+        Search the board to the specified depth, and return the best move.
+        The arguments have the same meaning as for alpha_beta_search.
+        """
+        executor = self._get_executor()
+
+        # Let the workers of a cancelled search wind down before reusing the shared state
+        wait(self._pending)
+        with self._best.get_lock():
+            self._best[0] = NEG_INFINITY
+            self._best[1] = -1
+        self._stop.value = 0
+
+        next_moves = get_next_moves_fn(board)
+        if first_move is not None:
+            next_moves = sorted(next_moves, key=lambda move_and_board: move_and_board[0] != first_move)
+
+        deadline = cancel_token.deadline if cancel_token is not None else None
+        moves = []
+        futures = []
+        for index, (move, new_board) in enumerate(next_moves):
+            child = materialize(new_board)
+            # A SearchBoard is about to change; send a copy of it
+            if isinstance(child, SearchBoard):
+                child = child.snapshot()
+            release(new_board)
+            moves.append(move)
+            futures.append(executor.submit(search_root_move, index, child, depth, eval_fn,
+                                           get_next_moves_fn, is_terminal_fn, deadline))
+        self._pending = futures
+
+        not_done = set(futures)
+        while not_done:
+            if cancel_token is not None and cancel_token.is_cancelled():
+                self._stop.value = 1
+                raise SearchCancelled()
+            _, not_done = wait(not_done, timeout=self.POLL_INTERVAL, return_when=FIRST_COMPLETED)
+
+        # Same as the serial search: the first of the best moves
+        best_index = None
+        best_val = NEG_INFINITY
+        for index, future in enumerate(futures):
+            val, exact = future.result()
+            if exact and val > best_val:
+                best_index, best_val = index, val
+
+        if verbose and not is_quiet():
+            print("ALPHA_BETA: Decided on column {} with rating {}".format(moves[best_index], best_val))
+
+        return moves[best_index]
+
+
+def lazy_smp_helper(board, depth, eval_fn, get_next_moves_fn, is_terminal_fn, tt, inplace, seed, deadline):
+    """
+    Search the board in a helper process of a LazySMPSearch, until the
+    search is done or the main search has finished.
+
+    The root moves are searched in a random order, so that the helpers
+    don't all search the same moves at the same time.
+    Return True if the search was completed.
+    """
+    if inplace:
+        board = SearchBoard.from_board(board)
+
+    next_moves = list(get_next_moves_fn(board))
+    random.Random(seed).shuffle(next_moves)
+    cancel_token = SharedFlagCancellationToken(_stop, deadline)
+
+    alpha = NEG_INFINITY
+    best_move = None
+    try:
+        for move, new_board in next_moves:
+            val = -1 * alpha_beta_search_value(new_board, depth - 1, eval_fn, NEG_INFINITY, alpha,
+                                               get_next_moves_fn, is_terminal_fn,
+                                               tt=tt, cancel_token=cancel_token)
+            release(new_board)
+            if alpha < val:
+                alpha = val
+                best_move = move
+    except SearchCancelled:
+        return False
+
+    key, mirrored = tt.key_for(board)
+    tt.store(key, depth, alpha, EXACT, best_move, mirrored)
+    return True
+
+
+class LazySMPSearch(object):
+    """
+    A "Lazy SMP" alpha-beta search: helper processes search the same position
+    as the main search, communicating only through a shared transposition table.
+
+    Each call runs alpha_beta_search, in this process, with the shared table.
+    Meanwhile, half of the helpers search the same depth and the other half
+    the next depth, each with its root moves in a different order.  Their
+    results in the table let the main search skip or narrow down parts of
+    its own search, and order its moves better.  The helpers are stopped
+    when the main search is done.
+
+    Call it like alpha_beta_search (without tt); it can be passed to
+    run_search_function as a search_fn.  The board, the evaluation function,
+    get_next_moves_fn and is_terminal_fn are sent to the helpers, so they
+    must be picklable.  A moveordering.MoveOrderer using the shared table
+    (self.tt) can be used as get_next_moves_fn.
+
+    The table is only valid for a single evaluation function.  The helper
+    processes are started on the first search and kept until close() is called.
+    """
+
+    def __init__(self, helpers=None, tt_bytes=DEFAULT_MAX_BYTES):
+        """
+        helpers -- the number of helper processes; one less than the number of CPUs by default
+        tt_bytes -- the (approximate) size of the shared transposition table
+        """
+        if helpers is None:
+            helpers = max(1, (os.cpu_count() or 1) - 1)
+
+        self.helpers = helpers
+        self.tt = SharedTranspositionTable(max_bytes=tt_bytes)
+        self._executor = None
+        self._pending = ()
+        self._stop = Value('b', 0)
+        self._seed = 0
+
+    def _get_executor(self):
+        """
+        Return the pool of helper processes, starting it if needed
+        """
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.helpers, initializer=_init_worker,
+                                                 initargs=(None, self._stop, None))
+        return self._executor
+
+    def close(self):
+        """
+        Stop the helper processes, and free the shared transposition table
+        """
+        self._stop.value = 1
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+        self.tt.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __call__(self, board, depth, eval_fn,
+                 get_next_moves_fn=get_all_next_moves,
+                 is_terminal_fn=is_terminal,
+                 cancel_token=None,
+                 first_move=None,
+                 verbose=True,
+                 inplace=False,
+                 stats=None):
+        """
+        Search the board to the specified depth, and return the best move.
+        The arguments have the same meaning as for alpha_beta_search; stats
+        only records the search in this process, not the helpers'.
+        """
+        executor = self._get_executor()
+
+        # Let the helpers of the previous search wind down, and pass on their errors
+        wait(self._pending)
+        for future in self._pending:
+            future.result()
+        self._stop.value = 0
+
+        deadline = cancel_token.deadline if cancel_token is not None else None
+        snapshot = board.snapshot() if isinstance(board, SearchBoard) else board
+        futures = []
+        for helper in range(self.helpers):
+            self._seed += 1
+            futures.append(executor.submit(lazy_smp_helper, snapshot, depth + helper % 2, eval_fn,
+                                           get_next_moves_fn, is_terminal_fn, self.tt, inplace,
+                                           self._seed, deadline))
+        self._pending = futures
+
+        try:
+            return alpha_beta_search(board, depth, eval_fn, get_next_moves_fn, is_terminal_fn, tt=self.tt,
+                                     cancel_token=cancel_token, first_move=first_move, verbose=verbose,
+                                     inplace=inplace, stats=stats)
+        finally:
+            self._stop.value = 1
@@ -0,0 +1,83 @@
+"""
+Lightweight profiling of the board and evaluation hot paths.
+
+Functions decorated with @profiled count their calls and the time spent in
+them, when profiling is enabled by setting the CONNECTFOUR_PROFILE
+environment variable (to anything but 0) before the program starts, eg.:
+
+    CONNECTFOUR_PROFILE=1 python main.py profile
+
+When profiling is disabled, @profiled returns the function itself, so it
+costs nothing at all.
+
+Times include the time spent in any functions called, including other
+profiled ones: the time of do_move includes that of is_win, for instance.
+"""
+import os
+import sys
+from functools import wraps
+from time import perf_counter_ns
+
+
+ENV_VAR = 'CONNECTFOUR_PROFILE'
+
+# Whether profiling is enabled; decided once, when the module is first imported
+ENABLED = os.environ.get(ENV_VAR, '0') not in ('', '0')
+
+# Counters, by function name: [number of calls, total time in nanoseconds]
+_counters = {}
+
+
+def profiled(fn):
+    """
+    Decorator that counts the calls to a function and the time spent in
+    it, if profiling is enabled; otherwise, returns the function unchanged
+    """
+    if not ENABLED:
+        return fn
+
+    counter = _counters.setdefault(fn.__qualname__, [0, 0])
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = perf_counter_ns()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            counter[0] += 1
+            counter[1] += perf_counter_ns() - start
+
+    return wrapper
+
+
+def reset():
+    """
+    Reset every counter to zero
+    """
+    for counter in _counters.values():
+        counter[0] = counter[1] = 0
+
+
+def get_report():
+    """
+    Return a dictionary mapping the name of every profiled function that was
+    called to its number of calls, total time and mean time per call (in nanoseconds)
+    """
+    return {name: {'calls': calls, 'total_ns': total_ns, 'mean_ns': total_ns // calls}
+            for name, (calls, total_ns) in _counters.items() if calls}
+
+
+def print_report(file=None):
+    """
+    Print the profiling counters, the most time-consuming functions first
+    """
+    file = file if file is not None else sys.stdout
+    if not ENABLED:
+        print("Profiling is disabled; set {}=1 to enable it".format(ENV_VAR), file=file)
+        return
+
+    report = get_report()
+    print("{:<42} {:>12} {:>12} {:>10}".format('function', 'calls', 'total ms', 'mean us'), file=file)
+    for name, counts in sorted(report.items(), key=lambda item: -item[1]['total_ns']):
+        print("{:<42} {:>12,} {:>12.1f} {:>10.2f}".format(name, counts['calls'], counts['total_ns'] / 1e6,
+                                                          counts['mean_ns'] / 1e3), file=file)
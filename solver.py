@@ -0,0 +1,297 @@
+"""
+An exact endgame solver.
+
+Once few empty cells are left, the game tree is small enough to search to the
+end, and heuristic evaluation is no longer needed: the solver proves whether
+the player to move wins, draws or loses, and how quickly.
+
+The solver works on raw bitboards (see bitboard.py): a negamax search with
+null windows, which only looks at moves that don't lose immediately, tries
+moves that create the most threats first, and remembers bounds in a
+transposition table keyed by the exact bitboard.position_key() (or, with
+a symmetric table, the canonical key that a position shares with its mirror image).
+
+Scores follow the usual convention for solved Connect Four positions: 0 for a
+draw, and for a win, the number of the winner's own moves left unplayed when
+they win (plus one), so that quicker wins score higher; losses are negative.
+"""
+from bitboard import (BOARD_HEIGHT, BOARD_MASK, BOARD_WIDTH, BOTTOM_MASK, COLUMN_BITS, COLUMN_MASKS,
+                      get_bitboards, mirror_bitboard, popcount, position_key)
+from moveordering import CENTER_FIRST_COLUMNS
+from transposition import LOWER_BOUND, UPPER_BOUND, TranspositionTable, scramble_key
+
+
+BOARD_CELLS = BOARD_WIDTH * BOARD_HEIGHT
+
+# Outcomes, for the player to move
+WIN = 1
+DRAW = 0
+LOSS = -1
+
+# How many nodes to search between two checks of the cancel_token
+CANCEL_CHECK_INTERVAL = 1024
+
+
+def possible_moves(mask):
+    """
+    Return the bitboard of the cells that a token can be dropped into
+    """
+    return (mask + BOTTOM_MASK) & BOARD_MASK
+
+
+def winning_cells(position, mask):
+    """
+    Return the bitboard of the empty cells that would complete a line of four
+    for the player whose tokens are 'position'
+    """
+    # Vertical: three tokens right below the cell
+    cells = (position << 1) & (position << 2) & (position << 3)
+
+    for shift in (COLUMN_BITS, COLUMN_BITS - 1, COLUMN_BITS + 1):
+        pair = (position << shift) & (position << 2 * shift)
+        cells |= pair & (position << 3 * shift)
+        cells |= pair & (position >> shift)
+        pair = (position >> shift) & (position >> 2 * shift)
+        cells |= pair & (position << shift)
+        cells |= pair & (position >> 3 * shift)
+
+    return cells & (BOARD_MASK ^ mask)
+
+
+def can_win_next(current, mask):
+    """
+    Return True if the player to move can win with their next move
+    """
+    return bool(winning_cells(current, mask) & possible_moves(mask))
+
+
+def non_losing_moves(current, mask):
+    """
+    Return the bitboard of the moves that don't let the opponent win right
+    away; 0 if every move does.  Assumes that the player to move can't win
+    with their next move.
+    """
+    possible = possible_moves(mask)
+    opponent_wins = winning_cells(current ^ mask, mask)
+    forced = possible & opponent_wins
+
+    if forced:
+        if forced & (forced - 1):
+            # The opponent has two winning moves: they can't both be blocked
+            return 0
+        possible = forced
+
+    # Don't play right below a cell where the opponent would win
+    return possible & ~(opponent_wins >> 1)
+
+
+def score_outcome(score):
+    """
+    Return WIN, DRAW or LOSS for a solved score
+    """
+    return (score > 0) - (score < 0)
+
+
+def plies_to_end(score, num_tokens):
+    """
+    Return the number of plies (counting the winning move) until the game is
+    won by one side, with perfect play from a position with 'num_tokens' tokens
+    and the specified (strong) solved score; None for a draw.
+    """
+    if score == 0:
+        return None
+
+    # The winner's last token is token number 'last', which has the parity
+    # of the winner's tokens
+    for last in (BOARD_CELLS + 2 - 2 * abs(score), BOARD_CELLS + 1 - 2 * abs(score)):
+        if (last - num_tokens) % 2 == (1 if score > 0 else 0):
+            return last - num_tokens
+
+
+class SolveResult(object):
+    """
+    The solution of a position: the best move, its score, the outcome (WIN,
+    DRAW or LOSS) for the player to move, and, after a strong solve, the
+    number of plies until the winning move (None for a draw, or after a weak solve)
+    """
+
+    def __init__(self, move, score, outcome, plies):
+        self.move = move
+        self.score = score
+        self.outcome = outcome
+        self.plies = plies
+
+    def __repr__(self):
+        return "SolveResult(move={}, score={}, outcome={}, plies={})".format(self.move, self.score, self.outcome,
+                                                                         self.plies)
+
+
+class EndgameSolver(object):
+    """
+    Solves Connect Four positions exactly.
+
+    A strong solve finds the exact score of a position; a weak solve only
+    finds out whether it is a win, a draw or a loss, which is much quicker.
+
+    The transposition table is kept from one solve to the next.
+    """
+
+    def __init__(self, tt=None):
+        """
+        tt -- the TranspositionTable to use; a new one by default.  Only
+              share it with other solvers, not with heuristic searches.
+              If it is symmetric, mirror images share their entries.
+        """
+        self.tt = tt if tt is not None else TranspositionTable()
+        self._symmetric = self.tt.symmetric
+        self.nodes = 0
+        self._cancel_token = None
+
+    def _negamax(self, current, mask, num_tokens, alpha, beta):
+        """
+        Return the score of the position if it is within (alpha, beta), or a
+        bound on it otherwise: at most alpha, or at least beta.
+        Assumes that the player to move can't win with their next move.
+        """
+        self.nodes += 1
+        if self._cancel_token is not None and self.nodes % CANCEL_CHECK_INTERVAL == 0:
+            self._cancel_token.check()
+
+        moves = non_losing_moves(current, mask)
+        if not moves:
+            return -((BOARD_CELLS - num_tokens) // 2)
+
+        if num_tokens >= BOARD_CELLS - 2:
+            return 0
+
+        # The opponent can't win with their next move, so the score is at least...
+        lowest = -((BOARD_CELLS - 2 - num_tokens) // 2)
+        if alpha < lowest:
+            alpha = lowest
+            if alpha >= beta:
+                return alpha
+
+        # ...and we can't win with this one, so it is at most
+        highest = (BOARD_CELLS - 1 - num_tokens) // 2
+
+        key = position_key(current, mask)
+        if self._symmetric:
+            key = min(key, mirror_bitboard(key))
+        key = scramble_key(key)
+        entry = self.tt.probe(key)
+        if entry is not None:
+            if entry.flag == UPPER_BOUND:
+                highest = min(highest, entry.value)
+            elif entry.flag == LOWER_BOUND:
+                lowest = max(lowest, entry.value)
+                if alpha < lowest:
+                    alpha = lowest
+                    if alpha >= beta:
+                        return alpha
+
+        if beta > highest:
+            beta = highest
+            if alpha >= beta:
+                return beta
+
+        # Moves that create the most threats first, center first among equals
+        candidates = []
+        for col in CENTER_FIRST_COLUMNS:
+            move = moves & COLUMN_MASKS[col]
+            if move:
+                candidates.append((popcount(winning_cells(current | move, mask)), move))
+        candidates.sort(key=lambda candidate: -candidate[0])
+
+        for _, move in candidates:
+            score = -self._negamax(current ^ mask, mask | move, num_tokens + 1, -beta, -alpha)
+            if score >= beta:
+                self.tt.store(key, BOARD_CELLS - num_tokens, score, LOWER_BOUND)
+                return score
+            if score > alpha:
+                alpha = score
+
+        self.tt.store(key, BOARD_CELLS - num_tokens, alpha, UPPER_BOUND)
+        return alpha
+
+    def _solve_bitboards(self, current, mask, weak):
+        """
+        Return the score of the position with the given bitboards; after a weak
+        solve, only its outcome: 1 for a win, 0 for a draw, -1 for a loss
+        """
+        num_tokens = popcount(mask)
+        if can_win_next(current, mask):
+            return WIN if weak else (BOARD_CELLS + 1 - num_tokens) // 2
+
+        lowest = -((BOARD_CELLS - num_tokens) // 2)
+        highest = (BOARD_CELLS + 1 - num_tokens) // 2
+        if weak:
+            lowest, highest = -1, 1
+
+        # Narrow the range down with null-window searches, trying scores
+        # near 0 first since they are the quickest to prove
+        while lowest < highest:
+            middle = lowest + (highest - lowest) // 2
+            if middle <= 0 and lowest // 2 < middle:
+                middle = lowest // 2
+            elif middle >= 0 and highest // 2 > middle:
+                middle = highest // 2
+
+            score = self._negamax(current, mask, num_tokens, middle, middle + 1)
+            if score <= middle:
+                highest = score
+            else:
+                lowest = score
+
+        return score_outcome(lowest) if weak else lowest
+
+    def solve(self, board, weak=False, cancel_token=None):
+        """
+        Return the score of the board for the player to move (see the module
+        docstring).  After a weak solve, the score is only 1, 0 or -1.
+        cancel_token is an optional util.CancellationToken; once it is
+        cancelled, the solver raises util.SearchCancelled.
+        """
+        self._cancel_token = cancel_token
+        try:
+            return self._solve_bitboards(*get_bitboards(board), weak=weak)
+        finally:
+            self._cancel_token = None
+
+    def best_move(self, board, weak=False, cancel_token=None):
+        """
+        Return the SolveResult of the board, whose game must not be over.
+        Among equally good moves, the most central one is chosen.
+        """
+        current, mask = get_bitboards(board)
+        num_tokens = popcount(mask)
+        possible = possible_moves(mask)
+        self._cancel_token = cancel_token
+
+        try:
+            best = None
+            for col in CENTER_FIRST_COLUMNS:
+                move = possible & COLUMN_MASKS[col]
+                if not move:
+                    continue
+
+                if winning_cells(current, mask) & move:
+                    # Nothing beats winning right away
+                    best = (col, WIN if weak else (BOARD_CELLS + 1 - num_tokens) // 2)
+                    break
+                elif mask | move == BOARD_MASK:
+                    score = 0
+                else:
+                    score = -self._solve_bitboards(current ^ mask, mask | move, weak)
+                if weak:
+                    score = score_outcome(score)
+
+                if best is None or score > best[1]:
+                    best = (col, score)
+        finally:
+            self._cancel_token = None
+
+        if best is None:
+            raise ValueError("There is no move to solve on a full board")
+
+        col, score = best
+        return SolveResult(col, score, score_outcome(score), None if weak else plies_to_end(score, num_tokens))
@@ -1,11 +1,76 @@
+import contextlib
+import io
+import json
 import logging
+import os
+import pickle
+import random
+import subprocess
 import sys
+import tempfile
+import threading
+import time
 import unittest
+from concurrent.futures import ProcessPoolExecutor
 
-from basicplayer import basic_player, minimax
-from connectfour import ConnectFourBoard, run_game
-from implementation import alpha_beta_search, better_evaluate, focused_evaluate, my_player
+import batcheval
+import bench
+import book
+import implementation
+import profiling
+import solver
+from batcheval import basic_evaluate_batch
+from basicplayer import basic_evaluate, basic_evaluate_by_cells, basic_player, get_all_next_moves, get_lazy_next_moves, materialize, minimax
+from bitboard import BitboardConnectFourBoard, SearchBoard, get_bitboards, mirror_bitboard, mirror_column, position_key
+from connectfour import ConnectFourBoard, ConnectFourRunner, ILLEGAL_MOVE_FORFEIT, TIMEOUT_RANDOM_MOVE, InvalidMoveException, compute_zobrist_key, run_game
+from implementation import alpha_beta_search, better_evaluate, focused_evaluate, focused_evaluate_batch, my_player
+from parallel import LazySMPSearch, RootParallelSearch, root_alpha
+from moveordering import CENTER_FIRST_COLUMNS, MoveOrderer, center_first_next_moves
+from transposition import SharedTranspositionTable, TranspositionTable, board_key, symmetric_board_key, EXACT, LOWER_BOUND
+import tournament
 from tree_searcher import make_tree, tree_as_string, tree_eval, tree_get_next_move, is_leaf
+from util import CancellationToken, KillableWorker, NEG_INFINITY, SearchCancelled, SearchStats, TimeLimitExceeded, is_quiet, quiet, TimeManager, clear_per_game_caches, memoize, run_search_function
+
+
+def _random_games(rng, games):
+    """
+    Return 'games' random games, each as the list of the columns played
+    from the empty board until the game was over
+    """
+    all_moves = []
+    for _ in range(games):
+        board = BitboardConnectFourBoard()
+        moves = []
+        while not board.is_game_over():
+            column = rng.choice([col for col in range(board.board_width) if board.get_height_of_column(col) >= 0])
+            board = board.do_move(column)
+            moves.append(column)
+        all_moves.append(moves)
+    return all_moves
+
+
+def _game_positions(moves, board_class=ConnectFourBoard):
+    """
+    Return the positions reached by playing the columns 'moves' from the empty board, in order
+    """
+    positions = []
+    board = board_class()
+    for column in moves:
+        board = board.do_move(column)
+        positions.append(board)
+    return positions
+
+
+BOARD_ARRAY = ((0, 0, 0, 0, 0, 0, 0),
+               (0, 0, 0, 0, 0, 0, 0),
+               (0, 0, 0, 0, 0, 0, 0),
+               (0, 2, 2, 1, 1, 2, 0),
+               (0, 2, 1, 2, 1, 2, 0),
+               (2, 1, 2, 1, 1, 1, 0),
+               )
+
+# 2 can win, but 1 can win a lot more easily
+BARELY_WINNING_BOARD = ConnectFourBoard(board_array=BOARD_ARRAY, current_player=2)
 
 
 class TestAlphaBetaSearch(unittest.TestCase):
@@ -21,6 +86,7 @@ class TestAlphaBetaSearch(unittest.TestCase):
                               is_leaf)
         try:
             self.assertEqual(v, expected)
+            self.assertEqual(alpha_beta_search(tree, 10, tree_eval, tree_get_next_move, is_leaf, pvs=True), expected)
         except Exception as e:
             self.log.error("%s:\n%s", tree_name, tree_as_string(tree))
             self.log.error("BEST MOVE: %s", format(v))
@@ -105,6 +171,20 @@ class TestAlphaBetaSearch(unittest.TestCase):
                     )
         self._check(tup_tree, "TREE_3", "B")
 
+    def test_pvs_and_aspiration_windows(self):
+        rng = random.Random(3)
+        for moves in _random_games(rng, 10):
+            board = bench.board_from_moves(moves[:rng.randrange(12)], BitboardConnectFourBoard)
+            if board.is_game_over():
+                continue
+
+            moves = []
+            for kwargs in ({}, {'pvs': True}, {'aspiration_window': 5}, {'pvs': True, 'aspiration_window': 5}):
+                tt = TranspositionTable()
+                moves.append([alpha_beta_search(board, depth, focused_evaluate, tt=tt, verbose=False, **kwargs)
+                              for depth in range(1, 5)])
+            self.assertEqual(moves[1:], moves[:1] * 3)
+
 
 class TestConnectFourStatic(unittest.TestCase):
     @classmethod
@@ -122,24 +202,13 @@ class TestConnectFourStatic(unittest.TestCase):
                                               ),
                                              current_player=1)
 
-        # 2 can win, but 1 can win a lot more easily
-        cls.BARELY_WINNING_BOARD = ConnectFourBoard(board_array=
-                                                    ((0, 0, 0, 0, 0, 0, 0),
-                                                     (0, 0, 0, 0, 0, 0, 0),
-                                                     (0, 0, 0, 0, 0, 0, 0),
-                                                     (0, 2, 2, 1, 1, 2, 0),
-                                                     (0, 2, 1, 2, 1, 2, 0),
-                                                     (2, 1, 2, 1, 1, 1, 0),
-                                                     ),
-                                                    current_player=2)
-
     def test_search_1(self):
         actual_score = minimax(self.WINNING_BOARD, 2, focused_evaluate)
         expected_score = 1
         self.assertEqual(actual_score, expected_score)
 
     def test_search_2(self):
-        actual_score = minimax(self.BARELY_WINNING_BOARD, 2, focused_evaluate)
+        actual_score = minimax(BARELY_WINNING_BOARD, 2, focused_evaluate)
         expected_score = 3
         self.assertEqual(actual_score, expected_score)
 
@@ -149,7 +218,7 @@ class TestConnectFourStatic(unittest.TestCase):
         self.assertEqual(actual_score, expected_score)
 
     def test_search_4(self):
-        actual_score = alpha_beta_search(self.BARELY_WINNING_BOARD, 2, focused_evaluate)
+        actual_score = alpha_beta_search(BARELY_WINNING_BOARD, 2, focused_evaluate)
         expected_score = 3
         self.assertEqual(actual_score, expected_score)
 
@@ -159,7 +228,7 @@ class TestConnectFourStatic(unittest.TestCase):
         self.assertEqual(actual_score, expected_score)
 
     def test_search_6(self):
-        actual_score = alpha_beta_search(self.BARELY_WINNING_BOARD, 2, better_evaluate)
+        actual_score = alpha_beta_search(BARELY_WINNING_BOARD, 2, better_evaluate)
         expected_score = 3
         self.assertEqual(actual_score, expected_score)
 
@@ -219,6 +288,963 @@ class TestConnectFourPlay(unittest.TestCase):
         return wins - losses >= 2
 
 
+class TestConnectFourBoard(unittest.TestCase):
+    def test_incremental_win_detection(self):
+        for moves in _random_games(random.Random(1), 20):
+            for board in _game_positions(moves):
+                # A freshly-built board scans the whole array
+                rescanned = ConnectFourBoard(board.get_board_array(), current_player=board.get_current_player_id())
+                self.assertEqual(board.is_win(), rescanned.is_win())
+
+            # Once won, a board stays won
+            self.assertEqual(board.clone().is_win(), board.is_win())
+
+    def test_zobrist_key(self):
+        for board in _game_positions(_random_games(random.Random(2), 1)[0]):
+            self.assertEqual(board.get_zobrist_key(),
+                             compute_zobrist_key(board.get_board_array(), board.get_current_player_id()))
+
+    def test_chain_cells(self):
+        board_array = [[0] * 7 for _ in range(6)]
+        board_array[5][0] = board_array[5][1] = board_array[4][1] = 1
+        board_array[5][2] = 2
+        for board_class in (ConnectFourBoard, BitboardConnectFourBoard):
+            board = board_class(board_array, current_player=2)
+            expected = {((5, 0),), ((5, 1),), ((4, 1),), ((5, 1), (4, 1)), ((5, 1), (5, 0)), ((4, 1), (5, 0))}
+            self.assertEqual(board.chain_cells(1), expected)
+            self.assertEqual(board.longest_chain(1), 2)
+            self.assertEqual(board.chain_cells(2), {((5, 2),)})
+            self.assertEqual(board.longest_chain(2), 1)
+
+            # Callers get their own set, which doesn't change the cached chains
+            board.chain_cells(1).clear()
+            self.assertEqual(board.chain_cells(1), expected)
+
+        self.assertEqual(ConnectFourBoard().chain_cells(1), set())
+        self.assertEqual(ConnectFourBoard().longest_chain(1), 0)
+
+    def test_side_to_move_is_hashed(self):
+        board_1 = ConnectFourBoard(BOARD_ARRAY, current_player=1)
+        board_2 = ConnectFourBoard(BOARD_ARRAY, current_player=2)
+        self.assertNotEqual(board_1, board_2)
+        self.assertNotEqual(hash(board_1), hash(board_2))
+        self.assertEqual(board_1, ConnectFourBoard(BOARD_ARRAY, current_player=1))
+        self.assertEqual(hash(board_1), hash(board_1.clone()))
+
+
+class TestBitboard(unittest.TestCase):
+    def _assert_same_board(self, bitboard, board):
+        self.assertEqual(bitboard.get_board_array(), board.get_board_array())
+        self.assertEqual(bitboard.get_current_player_id(), board.get_current_player_id())
+        self.assertEqual(bitboard.is_win(), board.is_win())
+        self.assertEqual(bitboard.is_tie(), board.is_tie())
+        self.assertEqual(bitboard.num_tokens_on_board(), board.num_tokens_on_board())
+        self.assertEqual(bitboard, board)
+        self.assertEqual(hash(bitboard), hash(board))
+        for col in range(board.board_width):
+            self.assertEqual(bitboard.get_height_of_column(col), board.get_height_of_column(col))
+            self.assertEqual(bitboard.get_top_elt_in_column(col), board.get_top_elt_in_column(col))
+
+    def test_random_games(self):
+        for moves in _random_games(random.Random(0), 20):
+            board, bitboard = ConnectFourBoard(), BitboardConnectFourBoard()
+            for column in moves:
+                for full_column in range(board.board_width):
+                    if board.get_height_of_column(full_column) < 0:
+                        self.assertRaises(InvalidMoveException, bitboard.do_move, full_column)
+                board, bitboard = board.do_move(column), bitboard.do_move(column)
+                self._assert_same_board(bitboard, board)
+
+    def test_from_board_array(self):
+        for player in (1, 2):
+            board = ConnectFourBoard(BOARD_ARRAY, current_player=player)
+            bitboard = BitboardConnectFourBoard(BOARD_ARRAY, current_player=player)
+            self._assert_same_board(bitboard, board)
+            self._assert_same_board(BitboardConnectFourBoard.from_board(board), board)
+            self.assertEqual(basic_evaluate(bitboard), basic_evaluate(board))
+            self.assertEqual(bitboard.longest_chain(player), board.longest_chain(player))
+
+    def test_search(self):
+        bitboard = BitboardConnectFourBoard(BOARD_ARRAY, current_player=2)
+        self.assertEqual(minimax(bitboard, 2, focused_evaluate), 3)
+        self.assertEqual(alpha_beta_search(bitboard, 2, focused_evaluate), 3)
+
+
+class TestTranspositionTable(unittest.TestCase):
+    def test_store_and_probe(self):
+        tt = TranspositionTable(max_entries=8)
+        tt.store(3, 2, 10, EXACT, 4)
+        entry = tt.probe(3)
+        self.assertEqual((entry.depth, entry.value, entry.flag, entry.best_move), (2, 10, EXACT, 4))
+        self.assertIsNone(tt.probe(11))
+        self.assertEqual(tt.stats()['hits'], 1)
+        self.assertEqual(tt.stats()['probes'], 2)
+
+    def test_replacement_policy(self):
+        tt = TranspositionTable(max_entries=8)
+        tt.store(3, 5, 10, EXACT)
+        # Same slot, shallower search: the deeper entry is kept...
+        tt.store(11, 2, 20, EXACT)
+        self.assertIsNone(tt.probe(11))
+        self.assertEqual(tt.probe(3).value, 10)
+        # ...unless it is left over from an earlier search
+        tt.new_search()
+        tt.store(11, 2, 20, EXACT)
+        self.assertEqual(tt.probe(11).value, 20)
+        self.assertEqual(len(tt), 1)
+
+    def test_memory_cap(self):
+        tt = TranspositionTable(max_bytes=100 * TranspositionTable.ENTRY_BYTES)
+        for key in range(1000):
+            tt.store(key, 1, key, EXACT)
+        self.assertEqual(len(tt), 100)
+
+    def test_search_with_table(self):
+        tt = TranspositionTable()
+        for depth in range(1, 5):
+            self.assertEqual(alpha_beta_search(BARELY_WINNING_BOARD, depth, focused_evaluate, tt=tt), 3)
+        self.assertGreater(tt.stats()['hits'], 0)
+        self.assertEqual(tt.get_best_move(board_key(BARELY_WINNING_BOARD)), 3)
+
+    def test_symmetric_table(self):
+        board = BARELY_WINNING_BOARD
+        mirror = ConnectFourBoard(board_array=[row[::-1] for row in board.get_board_array()], current_player=2)
+        self.assertEqual(symmetric_board_key(board), symmetric_board_key(mirror))
+        self.assertNotEqual(symmetric_board_key(board), symmetric_board_key(board.do_move(0)))
+
+        tt = TranspositionTable(symmetric=True)
+        key, mirrored = tt.key_for(board)
+        mirror_key, mirror_mirrored = tt.key_for(mirror)
+        self.assertEqual((key, mirrored), (mirror_key, not mirror_mirrored))
+
+        # The mirror image's best move is the mirror image of the move
+        tt.store(key, 3, 15, EXACT, 1, mirrored)
+        self.assertEqual(tt.get_best_move(key, mirrored), 1)
+        self.assertEqual(tt.get_best_move(mirror_key, mirror_mirrored), 5)
+        self.assertEqual(tt.probe(mirror_key).value, 15)
+
+    def test_search_with_symmetric_table(self):
+        board = ConnectFourBoard().do_move(3)
+        plain_tt, symmetric_tt = TranspositionTable(), TranspositionTable(symmetric=True)
+        for depth in range(1, 6):
+            self.assertEqual(alpha_beta_search(board, depth, focused_evaluate, tt=symmetric_tt,
+                                               get_next_moves_fn=MoveOrderer(tt=symmetric_tt, lazy=True),
+                                               inplace=True),
+                             alpha_beta_search(board, depth, focused_evaluate, tt=plain_tt))
+        # The position is symmetric, so half of its subtree are mirror images
+        self.assertLess(len(symmetric_tt), len(plain_tt))
+
+
+def _store_in_table(tt, key, value):
+    """
+    Store an entry in a shared table; run in a worker process
+    """
+    tt.store(key, 1, value, EXACT, 6)
+
+
+class TestSharedTranspositionTable(unittest.TestCase):
+    def setUp(self):
+        self.tt = SharedTranspositionTable(max_entries=8)
+
+    def tearDown(self):
+        self.tt.close()
+
+    def test_store_and_probe(self):
+        self.tt.store(3, 2, 10, LOWER_BOUND, 4)
+        entry = self.tt.probe(3)
+        self.assertEqual((entry.depth, entry.value, entry.flag, entry.best_move), (2, 10, LOWER_BOUND, 4))
+        self.assertIsNone(self.tt.probe(11))
+        self.tt.store(5, 1, -2.5, EXACT)
+        self.assertEqual((self.tt.probe(5).value, self.tt.probe(5).best_move), (-2.5, None))
+        self.assertEqual(len(self.tt), 2)
+        self.tt.clear()
+        self.assertEqual(len(self.tt), 0)
+
+    def test_replacement_policy(self):
+        self.tt.store(3, 5, 10, EXACT)
+        self.tt.store(11, 2, 20, EXACT)
+        self.assertIsNone(self.tt.probe(11))
+        self.tt.new_search()
+        self.tt.store(11, 2, 20, EXACT)
+        self.assertEqual(self.tt.probe(11).value, 20)
+
+    def test_shared_between_processes(self):
+        self.assertIs(pickle.loads(pickle.dumps(self.tt)), self.tt)
+        key = board_key(BARELY_WINNING_BOARD)
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            executor.submit(_store_in_table, self.tt, key, 42).result()
+        self.assertEqual(self.tt.probe(key).value, 42)
+        self.assertEqual(self.tt.get_best_move(key), 6)
+
+    def test_symmetric_flag_is_shared(self):
+        symmetric_tt = SharedTranspositionTable(max_entries=8, symmetric=True)
+        try:
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                self.assertTrue(executor.submit(getattr, symmetric_tt, 'symmetric').result())
+        finally:
+            symmetric_tt.close()
+
+
+class TestMemoize(unittest.TestCase):
+    def test_lru_eviction(self):
+        calls = []
+        square = memoize(lambda x: calls.append(x) or x * x, maxsize=2)
+        self.assertEqual([square(x) for x in (1, 2, 1, 3, 1, 2)], [1, 4, 1, 9, 1, 4])
+        # 2 was the least recently used value when 3 was added
+        self.assertEqual(calls, [1, 2, 3, 2])
+        self.assertEqual(square.stats(), {'hits': 2, 'misses': 4, 'evictions': 2, 'size': 2, 'maxsize': 2})
+
+    def test_per_game_clearing(self):
+        per_game = memoize(lambda x: x, per_game=True)
+        kept = memoize(lambda x: x)
+        per_game(1)
+        kept(1)
+        clear_per_game_caches()
+        self.assertEqual(per_game.stats()['size'], 0)
+        self.assertEqual(kept.stats()['size'], 1)
+
+    def test_pickled_by_name(self):
+        self.assertIs(pickle.loads(pickle.dumps(better_evaluate)), better_evaluate)
+
+
+class TestCancellation(unittest.TestCase):
+    def test_cancelled_search_raises(self):
+        token = CancellationToken()
+        token.cancel()
+        self.assertRaises(SearchCancelled, alpha_beta_search, BARELY_WINNING_BOARD, 4, focused_evaluate, cancel_token=token)
+        self.assertRaises(SearchCancelled, minimax, BARELY_WINNING_BOARD, 4, focused_evaluate, cancel_token=token)
+
+    def test_expired_deadline(self):
+        token = CancellationToken(deadline=time.time() - 1)
+        self.assertTrue(token.is_cancelled())
+        self.assertFalse(CancellationToken(deadline=time.time() + 60).is_cancelled())
+
+    def test_search_thread_stops_at_timeout(self):
+        threads_before = threading.active_count()
+        column = run_search_function(ConnectFourBoard(), search_fn=alpha_beta_search,
+                                     eval_fn=focused_evaluate, timeout=0.5)
+        self.assertIn(column, range(7))
+        # The abandoned search must notice the cancellation almost immediately
+        time.sleep(0.2)
+        self.assertEqual(threading.active_count(), threads_before)
+
+
+class TestTimeManager(unittest.TestCase):
+    def test_predicts_next_iteration(self):
+        tm = TimeManager(move_time=5)
+        self.assertTrue(tm.should_start_iteration(0, 5, []))
+        # Iterations growing 3x: the next one is predicted to take 2.7s
+        self.assertEqual(tm.branching_factor([0.1, 0.3, 0.9]), 3.0)
+        self.assertTrue(tm.should_start_iteration(1.3, 5, [0.1, 0.3, 0.9]))
+        self.assertFalse(tm.should_start_iteration(2.5, 5, [0.1, 0.3, 0.9]))
+
+    def test_game_clock(self):
+        tm = TimeManager(move_time=5, game_time=20)
+        # 38 empty cells: about 19 moves each to go
+        board = ConnectFourBoard().do_move(3).do_move(3).do_move(3).do_move(3)
+        self.assertAlmostEqual(tm.allocate(board), 20.0 / 19)
+        tm.end_move(15)
+        self.assertAlmostEqual(tm.allocate(), 5.0 / TimeManager.MIN_MOVES_TO_GO)
+        tm.new_game()
+        self.assertEqual(tm.remaining_time, 20)
+
+    def test_first_move(self):
+        board = BARELY_WINNING_BOARD
+        for first_move in range(7):
+            self.assertEqual(alpha_beta_search(board, 3, focused_evaluate, first_move=first_move), 3)
+
+    def test_search_stops_early(self):
+        start = time.time()
+        run_search_function(ConnectFourBoard(), search_fn=alpha_beta_search, eval_fn=focused_evaluate,
+                            timeout=5, time_manager=TimeManager(move_time=0.2))
+        self.assertLess(time.time() - start, 2)
+
+
+class TestSearchStats(unittest.TestCase):
+    def _counting_evaluate(self, board):
+        self.evaluations += 1
+        return focused_evaluate(board)
+
+    def test_alpha_beta_search(self):
+        self.evaluations = 0
+        stats = SearchStats()
+        tt = TranspositionTable()
+        for depth in range(1, 5):
+            self.assertEqual(alpha_beta_search(BARELY_WINNING_BOARD, depth, self._counting_evaluate, tt=tt, stats=stats,
+                                               verbose=False), 3)
+
+        self.assertEqual(stats.evaluations, self.evaluations)
+        self.assertGreater(stats.nodes, stats.evaluations)
+        self.assertGreater(stats.tt_hits, 0)
+        self.assertEqual([iteration['depth'] for iteration in stats.iterations], [1, 2, 3, 4])
+        self.assertEqual(stats.iterations[-1]['move'], 3)
+        self.assertEqual(sum(iteration['nodes'] for iteration in stats.iterations), stats.nodes)
+        self.assertTrue(all(0 < ply < 4 for ply in stats.cutoffs_by_ply))
+        self.assertEqual(stats.effective_branching_factor(),
+                         float(stats.iterations[-1]['nodes']) / stats.iterations[-2]['nodes'])
+
+        exported = json.loads(stats.to_json())
+        self.assertEqual(exported['nodes'], stats.nodes)
+        self.assertEqual(exported['max_depth'], 4)
+        self.assertEqual(sum(exported['cutoffs_by_ply'].values()), stats.cutoffs)
+
+    def test_minimax(self):
+        self.evaluations = 0
+        stats = SearchStats()
+        minimax(BARELY_WINNING_BOARD, 2, self._counting_evaluate, stats=stats, verbose=False)
+        # Every node of the full tree: the root, its children, and their children
+        expected_nodes = 1
+        for _, child in get_all_next_moves(BARELY_WINNING_BOARD):
+            expected_nodes += 1 + (0 if child.is_game_over() else len(list(get_all_next_moves(child))))
+        self.assertEqual(stats.nodes, expected_nodes)
+        self.assertEqual(stats.cutoffs, 0)
+        self.assertEqual(stats.effective_branching_factor(), stats.nodes ** 0.5)
+
+    def test_run_search_function(self):
+        stats = SearchStats()
+        with quiet():
+            run_search_function(BARELY_WINNING_BOARD, search_fn=alpha_beta_search, eval_fn=focused_evaluate, timeout=0.5,
+                                stats=stats)
+        depths = [iteration['depth'] for iteration in stats.iterations]
+        self.assertEqual(depths, list(range(1, len(depths) + 1)))
+        self.assertGreater(stats.nodes, 0)
+
+
+class TestBenchSuite(unittest.TestCase):
+    def test_corpus(self):
+        for name, (category, moves) in bench.CORPUS.items():
+            board = bench.board_from_moves(moves, BitboardConnectFourBoard)
+            self.assertFalse(board.is_game_over(), name)
+            current, mask = get_bitboards(board)
+            if name == 'win_in_one':
+                self.assertTrue(solver.can_win_next(current, mask))
+            elif name == 'must_block':
+                self.assertTrue(solver.winning_cells(current ^ mask, mask) & solver.possible_moves(mask))
+        self.assertEqual({category for category, _ in bench.CORPUS.values()},
+                         {'opening', 'midgame', 'tactical', 'endgame'})
+
+    def test_results(self):
+        settings = {'repeat': 2, 'minimax_depth': 2, 'depth': 3, 'seconds': 0.05}
+        results = json.loads(json.dumps(bench.run_suite_benchmarks(**settings)))
+        again = bench.run_suite_benchmarks(**settings)
+
+        self.assertEqual(set(results['alpha_beta']), set(bench.CORPUS))
+        self.assertEqual(results['alpha_beta']['win_in_one']['move'],
+                         solver.EndgameSolver().best_move(bench.board_from_moves(
+                             bench.CORPUS['win_in_one'][1])).move)
+        for search in ('minimax', 'alpha_beta'):
+            for name in bench.CORPUS:
+                for counter in ('move', 'nodes', 'evaluations'):
+                    self.assertEqual(results[search][name][counter], again[search][name][counter])
+                self.assertGreater(results[search][name]['nodes'], 0)
+        for name in bench.CORPUS:
+            self.assertGreaterEqual(results['fixed_time'][name]['depth'], 1)
+
+        changes = {path for path, _, _ in bench.compare_results(results, again)}
+        self.assertNotIn('alpha_beta.empty.nodes', changes)
+        self.assertIn('do_move.BitboardConnectFourBoard.moves_per_second', changes)
+
+
+class TestProfiling(unittest.TestCase):
+    def tearDown(self):
+        profiling._counters.pop(self._square.__qualname__, None)
+
+    def _square(self, x):
+        return x * x
+
+    def test_disabled(self):
+        enabled, profiling.ENABLED = profiling.ENABLED, False
+        try:
+            square = self._square
+            self.assertIs(profiling.profiled(square), square)
+        finally:
+            profiling.ENABLED = enabled
+
+    def test_enabled(self):
+        enabled, profiling.ENABLED = profiling.ENABLED, True
+        try:
+            square = profiling.profiled(self._square)
+            self.assertEqual([square(x) for x in range(3)], [0, 1, 4])
+            report = profiling.get_report()[self._square.__qualname__]
+            self.assertEqual(report['calls'], 3)
+            self.assertGreater(report['total_ns'], 0)
+
+            output = io.StringIO()
+            profiling.print_report(output)
+            self.assertIn(self._square.__qualname__, output.getvalue())
+
+            profiling.reset()
+            self.assertNotIn(self._square.__qualname__, profiling.get_report())
+        finally:
+            profiling.ENABLED = enabled
+
+
+class TestMoveOrdering(unittest.TestCase):
+    def test_generates_every_move_once(self):
+        board = ConnectFourBoard().do_move(3).do_move(3).do_move(3).do_move(3).do_move(3).do_move(3)
+        expected = sorted(get_all_next_moves(board))
+        self.assertEqual(sorted(center_first_next_moves(board)), expected)
+        self.assertEqual(sorted(MoveOrderer()(board)), expected)
+        self.assertNotIn(3, [move for move, _ in MoveOrderer()(board)])
+
+    def test_ordering(self):
+        tt = TranspositionTable()
+        orderer = MoveOrderer(tt=tt)
+        board = ConnectFourBoard()
+        self.assertEqual(orderer.order_columns(board), list(CENTER_FIRST_COLUMNS))
+        orderer.record_cutoff(board, 6, 3)
+        orderer.record_cutoff(board, 5, 2)
+        self.assertEqual(orderer.order_columns(board)[:2], [5, 6])
+        tt.store(board_key(board), 1, 0, EXACT, 0)
+        self.assertEqual(orderer.order_columns(board)[:3], [0, 5, 6])
+
+    def test_search_with_move_orderer(self):
+        tt = TranspositionTable()
+        orderer = MoveOrderer(tt=tt)
+        for depth in range(1, 5):
+            self.assertEqual(alpha_beta_search(BARELY_WINNING_BOARD, depth, focused_evaluate, tt=tt,
+                                               get_next_moves_fn=orderer), 3)
+
+
+class TestLazyChild(unittest.TestCase):
+    def test_lazy_child(self):
+        board = ConnectFourBoard().do_move(3).do_move(4)
+        for column, child in get_lazy_next_moves(board):
+            key = child.get_zobrist_key()
+            bitboards = child.get_bitboards()
+            built = materialize(child)
+            self.assertEqual(built, board.do_move(column))
+            self.assertEqual(key, built.get_zobrist_key())
+            self.assertEqual(bitboards, get_bitboards(built))
+            self.assertIs(materialize(child), built)
+            self.assertIs(materialize(built), built)
+
+    def test_lazy_search(self):
+        board = BARELY_WINNING_BOARD
+        results = []
+        for lazy in (False, True):
+            tt = TranspositionTable()
+            orderer = MoveOrderer(tt=tt, lazy=lazy)
+            moves = [alpha_beta_search(board, depth, focused_evaluate, tt=tt, get_next_moves_fn=orderer)
+                     for depth in range(1, 5)]
+            results.append((moves, tt.stats()['cutoffs']))
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(minimax(board, 2, focused_evaluate, get_next_moves_fn=get_lazy_next_moves), 3)
+
+
+class TestSearchBoard(unittest.TestCase):
+    def test_play_and_undo(self):
+        for moves in _random_games(random.Random(3), 10):
+            board = SearchBoard()
+            history = [board.snapshot()]
+            for column in moves:
+                expected = history[-1].do_move(column)
+                board.play(column)
+                history.append(board.snapshot())
+                TestBitboard._assert_same_board(self, board.snapshot(), expected)
+                self.assertEqual(board.get_zobrist_key(), expected.get_zobrist_key())
+                self.assertEqual(board.chain_cells(1), expected.chain_cells(1))
+            while board.get_move_stack():
+                board.undo()
+                history.pop()
+                TestBitboard._assert_same_board(self, board.snapshot(), history[-1])
+                self.assertEqual(board.longest_chain(2), history[-1].longest_chain(2))
+
+    def test_not_hashable(self):
+        self.assertRaises(TypeError, hash, SearchBoard())
+
+    def test_inplace_search(self):
+        board = BARELY_WINNING_BOARD
+        for inplace in (False, True):
+            search_board = SearchBoard.from_board(board)
+            evals = []
+            counting_eval = lambda b: evals.append(b.get_zobrist_key()) or focused_evaluate(b)
+            self.assertEqual(alpha_beta_search(search_board if inplace else board, 4, counting_eval,
+                                               get_next_moves_fn=get_lazy_next_moves), 3)
+            self.assertEqual(minimax(board, 2, focused_evaluate, get_next_moves_fn=get_lazy_next_moves,
+                                     inplace=inplace), 3)
+            # The search leaves the board as it found it
+            self.assertEqual(search_board.get_move_stack(), [])
+            if inplace:
+                self.assertEqual(evals, expected_evals)
+            expected_evals = evals
+
+        self.assertEqual(alpha_beta_search(board, 4, better_evaluate, inplace=True,
+                                           get_next_moves_fn=MoveOrderer(lazy=True)), 3)
+
+
+class TestBasicEvaluate(unittest.TestCase):
+    def test_same_scores_as_reference(self):
+        for moves in _random_games(random.Random(4), 50):
+            for board in _game_positions(moves):
+                for position in (board, BitboardConnectFourBoard.from_board(board), SearchBoard.from_board(board)):
+                    self.assertEqual(basic_evaluate(position), basic_evaluate_by_cells(board))
+
+    def test_fixed_positions(self):
+        for player in (1, 2):
+            board = ConnectFourBoard(BOARD_ARRAY, current_player=player)
+            self.assertEqual(basic_evaluate(board), basic_evaluate_by_cells(board))
+        self.assertEqual(basic_evaluate(ConnectFourBoard()), 0)
+
+
+class TestBatchEvaluate(unittest.TestCase):
+    def _positions(self):
+        return [board for moves in _random_games(random.Random(5), 10) for board in _game_positions(moves)]
+
+    def test_same_scores(self):
+        positions = self._positions()
+        self.assertEqual(basic_evaluate_batch(positions), [basic_evaluate(board) for board in positions])
+        self.assertEqual(focused_evaluate_batch(positions), [focused_evaluate(board) for board in positions])
+
+    @unittest.skipIf(batcheval.np is None, "NumPy is not installed")
+    def test_boards_to_array(self):
+        board = BARELY_WINNING_BOARD
+        array = batcheval.boards_to_array([board, BitboardConnectFourBoard.from_board(board)])
+        self.assertEqual(array.shape, (2, 6, 7))
+        self.assertEqual(array.dtype, batcheval.np.int8)
+        expected = [[{0: 0, 2: 1, 1: -1}[cell] for cell in row] for row in BOARD_ARRAY]
+        self.assertEqual(array[0].tolist(), expected)
+        self.assertEqual(array[1].tolist(), expected)
+
+    def test_batch_search(self):
+        for board in (BARELY_WINNING_BOARD, ConnectFourBoard().do_move(3).do_move(2)):
+            for depth in range(1, 5):
+                self.assertEqual(alpha_beta_search(board, depth, focused_evaluate, eval_batch_fn=focused_evaluate_batch),
+                                 alpha_beta_search(board, depth, focused_evaluate))
+        self.assertEqual(alpha_beta_search(BARELY_WINNING_BOARD, 3, focused_evaluate,
+                                           eval_batch_fn=focused_evaluate_batch, inplace=True,
+                                           get_next_moves_fn=get_lazy_next_moves), 3)
+
+
+class TestRootParallelSearch(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.search = RootParallelSearch(workers=2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.search.close()
+
+    def test_root_alpha(self):
+        self.assertEqual(root_alpha(3, 10.0, 1), 10.0)
+        # A later move only rules out strictly worse values
+        self.assertLess(root_alpha(1, 10.0, 3), 10.0)
+        self.assertGreater(root_alpha(1, 10.0, 3), 9.99)
+        self.assertEqual(root_alpha(0, NEG_INFINITY, -1), NEG_INFINITY)
+
+    def test_same_move_as_serial_search(self):
+        boards = [ConnectFourBoard(), BARELY_WINNING_BOARD,
+                  ConnectFourBoard(board_array=BOARD_ARRAY, current_player=1)]
+        for board in boards:
+            for depth in range(1, 5):
+                self.assertEqual(self.search(board, depth, focused_evaluate, verbose=False),
+                                 alpha_beta_search(board, depth, focused_evaluate, verbose=False))
+                self.assertEqual(self.search(board, depth, focused_evaluate, get_next_moves_fn=center_first_next_moves,
+                                             first_move=5, verbose=False),
+                                 alpha_beta_search(board, depth, focused_evaluate, get_next_moves_fn=center_first_next_moves,
+                                                   first_move=5, verbose=False))
+
+    def test_game_trees(self):
+        tree = make_tree(("A", None,
+                          ("B", None, ("C", 1), ("D", 4)),
+                          ("E", None, ("F", 4), ("G", 2)),
+                          ("H", None, ("I", 4), ("J", 3))))
+        self.assertEqual(self.search(tree, 10, tree_eval, tree_get_next_move, is_leaf, verbose=False), "H")
+
+    def test_cancelled_search_raises(self):
+        token = CancellationToken(deadline=time.time() - 1)
+        self.assertRaises(SearchCancelled, self.search, ConnectFourBoard(), 6, focused_evaluate, cancel_token=token)
+        # The pool is still usable afterwards
+        self.assertEqual(self.search(ConnectFourBoard(), 1, focused_evaluate, verbose=False), 3)
+
+
+class TestLazySMPSearch(unittest.TestCase):
+    def test_search(self):
+        board = BARELY_WINNING_BOARD
+        with LazySMPSearch(helpers=2, tt_bytes=2**20) as search:
+            orderer = MoveOrderer(tt=search.tt, lazy=True)
+            for depth in range(1, 5):
+                self.assertEqual(search(board, depth, focused_evaluate, get_next_moves_fn=orderer, inplace=True,
+                                        verbose=False), 3)
+            self.assertEqual(search.tt.get_best_move(board_key(board)), 3)
+            self.assertEqual(run_search_function(board, search_fn=search, eval_fn=focused_evaluate, timeout=1), 3)
+
+
+def _illegal_player(board):
+    """
+    A player that always tries the same column, full or not
+    """
+    return 0
+
+
+class TestConnectFourRunner(unittest.TestCase):
+    def test_headless_game(self):
+        boards = []
+        quiet_during_moves = []
+
+        def player(board):
+            boards.append(board)
+            quiet_during_moves.append(is_quiet())
+            return alpha_beta_search(board, 2, focused_evaluate)
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            record = ConnectFourRunner(player, player, trusted_callbacks=True).play_game()
+
+        self.assertEqual(output.getvalue(), "")
+        self.assertTrue(all(quiet_during_moves))
+        self.assertFalse(is_quiet())
+        self.assertIn(record.winner, (0, 1, 2))
+        self.assertEqual(len(record.moves), len(record.move_times))
+        self.assertEqual(record.final_board.num_tokens_on_board(), len(record.moves))
+        # Trusted callbacks get the game's own boards
+        self.assertIs(boards[0], record.initial_board)
+        board = record.initial_board
+        for column, given in zip(record.moves, boards):
+            self.assertEqual(given, board)
+            board = board.do_move(column)
+        self.assertEqual(json.loads(json.dumps(record.to_dict()))['moves'], record.moves)
+
+    def test_illegal_moves(self):
+        board = ConnectFourBoard()
+        for _ in range(board.board_height):
+            board = board.do_move(0)
+        attempts = []
+
+        def player(board):
+            # Try the full column once, then play the leftmost legal column
+            attempts.append(board)
+            if len(attempts) == 1:
+                return 0
+            return min(col for col in range(board.board_width) if board.get_height_of_column(col) >= 0)
+
+        record = ConnectFourRunner(player, player, board=board).play_game()
+        self.assertEqual(record.illegal_moves, 1)
+        self.assertEqual(record.moves[0], 1)
+        self.assertIsNot(attempts[0], board)
+
+    def test_player_2_to_move(self):
+        calls = []
+
+        def player(id):
+            def callback(board):
+                calls.append((id, board.get_current_player_id()))
+                return min(col for col in range(board.board_width) if board.get_height_of_column(col) >= 0)
+            return callback
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            winner = ConnectFourRunner(player(1), player(2), board=ConnectFourBoard().do_move(3)).run_game(verbose=False)
+
+        # Each callback plays its own tokens, starting with player 2's
+        self.assertEqual(calls[0], (2, 2))
+        self.assertTrue(all(id == player_id for id, player_id in calls))
+        self.assertEqual(output.getvalue().splitlines()[0], "Player 2 (O) puts a token in column 0")
+        self.assertIn(winner, (1, 2))
+
+    def test_last_cell(self):
+        def last_column(board):
+            return min(col for col in range(board.board_width) if board.get_height_of_column(col) >= 0)
+
+        # Player 2 wins with the last token; the other game ends in a real tie
+        won = _game_positions([int(col) for col in '52351124625333526301160613465140052064420'])[-1]
+        tied = _game_positions([int(col) for col in '36131364553431104304662610552451560022422'])[-1]
+
+        record = ConnectFourRunner(last_column, last_column, board=won).play_game()
+        self.assertEqual(record.winner, 2)
+        self.assertTrue(record.final_board.is_tie())
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            winner = ConnectFourRunner(last_column, last_column, board=tied).run_game(verbose=False)
+        self.assertEqual(winner, 0)
+        self.assertIn("It's a tie!", output.getvalue())
+        self.assertNotIn("Win for", output.getvalue())
+
+    def test_time_limit(self):
+        def slow_player(board):
+            time.sleep(30)
+            return 3
+
+        def first_legal_column(board):
+            return min(col for col in range(board.board_width) if board.get_height_of_column(col) >= 0)
+
+        start = time.time()
+        record = ConnectFourRunner(slow_player, first_legal_column, time_limit=0.2, enforce_time_limit=True).play_game()
+        self.assertEqual((record.winner, record.forfeit, record.timeouts, record.moves), (2, 1, 1, []))
+
+        record = ConnectFourRunner(slow_player, first_legal_column, time_limit=0.2, enforce_time_limit=True,
+                                   timeout_policy=first_legal_column).play_game()
+        self.assertIsNone(record.forfeit)
+        self.assertTrue(record.final_board.is_game_over())
+        self.assertEqual(record.moves[:4], [0, 0, 0, 0])
+        self.assertEqual(record.timeouts, (len(record.moves) + 1) // 2)
+        self.assertTrue(all(elapsed < 1 for elapsed in record.move_times))
+
+        record = ConnectFourRunner(first_legal_column, slow_player, time_limit=0.2, enforce_time_limit=True,
+                                   timeout_policy=TIMEOUT_RANDOM_MOVE).play_game()
+        self.assertEqual(record.timeouts, len(record.moves) // 2)
+        self.assertLess(time.time() - start, 10)
+
+    def test_illegal_move_forfeit(self):
+        board = ConnectFourBoard()
+        for _ in range(board.board_height):
+            board = board.do_move(0)
+        record = ConnectFourRunner(lambda board: 0, basic_player, board=board,
+                                   illegal_move_policy=ILLEGAL_MOVE_FORFEIT).play_game()
+        self.assertEqual((record.winner, record.forfeit, record.illegal_moves), (2, 1, 1))
+
+
+def _start_child_and_wait(path):
+    """
+    Start a child process, write its pid to 'path', and wait for a long time
+    """
+    child = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)'])
+    with open(path, 'w') as f:
+        f.write(str(child.pid))
+    time.sleep(60)
+
+
+def _is_running(pid):
+    """
+    Return True if the process is running; zombies that nobody reaped don't count
+    """
+    try:
+        with open('/proc/{}/stat'.format(pid)) as f:
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except FileNotFoundError:
+        return False
+
+
+class TestKillableWorker(unittest.TestCase):
+    def test_calls(self):
+        worker = KillableWorker(lambda x, y: x // y)
+        try:
+            self.assertEqual(worker.call(7, 2, timeout=5), 3)
+            self.assertRaises(ZeroDivisionError, worker.call, 1, 0, timeout=5)
+            self.assertEqual(worker.call(9, 3), 3)
+        finally:
+            worker.close()
+
+    def test_timeout(self):
+        worker = KillableWorker(lambda seconds: time.sleep(seconds) or seconds)
+        try:
+            self.assertRaises(TimeLimitExceeded, worker.call, 30, timeout=0.1)
+            # A new process takes over
+            self.assertEqual(worker.call(0, timeout=5), 0)
+        finally:
+            worker.close()
+
+    @unittest.skipUnless(os.path.exists('/proc/self/stat'), "needs /proc")
+    def test_kill_child_processes(self):
+        worker = KillableWorker(_start_child_and_wait)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'pid')
+            try:
+                self.assertRaises(TimeLimitExceeded, worker.call, path, timeout=2)
+            finally:
+                worker.close()
+
+            with open(path) as f:
+                pid = int(f.read())
+
+        deadline = time.time() + 5
+        while _is_running(pid) and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertFalse(_is_running(pid))
+
+
+class TestOpeningBook(unittest.TestCase):
+    def _mirror(self, board):
+        return ConnectFourBoard(board_array=[row[::-1] for row in board.get_board_array()],
+                                current_player=board.get_current_player_id())
+
+    def test_position_keys(self):
+        positions = book.book_positions(4)
+        keys = set(position_key(*get_bitboards(board)) for board in positions.values())
+        self.assertEqual(len(keys), len(positions))
+
+        board = BARELY_WINNING_BOARD
+        current, mask = get_bitboards(board)
+        self.assertEqual(mirror_bitboard(mirror_bitboard(current)), current)
+        self.assertEqual(get_bitboards(self._mirror(board)), (mirror_bitboard(current), mirror_bitboard(mask)))
+        key, mirrored = book.board_book_key(board)
+        self.assertEqual(book.board_book_key(self._mirror(board)), (key, not mirrored))
+
+    def test_write_and_probe(self):
+        board = ConnectFourBoard().do_move(1).do_move(2)
+        key, mirrored = book.board_book_key(board)
+        # The entry's move is for the canonical orientation
+        entries = {key: (mirror_column(5) if mirrored else 5, -12), 1: (3, 0)}
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'test.book')
+            book.write_book(entries, path)
+            self.assertEqual(os.path.getsize(path), book.HEADER.size + 2 * book.ENTRY.size)
+            opening_book = book.OpeningBook(path)
+            try:
+                self.assertEqual(len(opening_book), 2)
+                self.assertEqual(opening_book.probe(board), (5, -12))
+                self.assertEqual(opening_book.get_move(self._mirror(board)), 1)
+                self.assertIsNone(opening_book.get_move(board.do_move(3)))
+            finally:
+                opening_book.close()
+
+            with open(path, 'r+b') as f:
+                f.write(b'XXXX')
+            self.assertRaises(book.BookFormatError, book.OpeningBook, path)
+
+    @unittest.skipUnless(os.path.exists(book.DEFAULT_BOOK_PATH), "no opening book")
+    def test_default_book(self):
+        for board in book.book_positions(2).values():
+            move = book.book_move(board)
+            self.assertIsNotNone(move)
+            self.assertGreaterEqual(board.get_height_of_column(move), 0)
+
+
+class TestEndgameSolver(unittest.TestCase):
+    def _random_board(self, rng, tokens):
+        # A random position with 'tokens' tokens, taken from a game that went on longer
+        while True:
+            moves = _random_games(rng, 1)[0]
+            if len(moves) > tokens:
+                return bench.board_from_moves(moves[:tokens], BitboardConnectFourBoard)
+
+    def _brute_force_score(self, board):
+        num_tokens = board.num_tokens_on_board()
+        best = None
+        for col in range(board.board_width):
+            if board.get_height_of_column(col) < 0:
+                continue
+            new_board = board.do_move(col)
+            if new_board.is_win():
+                score = (solver.BOARD_CELLS + 1 - num_tokens) // 2
+            elif new_board.is_game_over():
+                score = 0
+            else:
+                score = -self._brute_force_score(new_board)
+            if best is None or score > best:
+                best = score
+        return best
+
+    def test_matches_brute_force(self):
+        rng = random.Random(5)
+        endgame_solver = solver.EndgameSolver()
+        symmetric_solver = solver.EndgameSolver(TranspositionTable(symmetric=True))
+        for _ in range(10):
+            board = self._random_board(rng, 33)
+            score = self._brute_force_score(board)
+            self.assertEqual(endgame_solver.solve(board), score)
+            self.assertEqual(endgame_solver.solve(board, weak=True), solver.score_outcome(score))
+            self.assertEqual(symmetric_solver.solve(board), score)
+
+            result = endgame_solver.best_move(board)
+            self.assertEqual(result.score, score)
+            self.assertEqual(result.outcome, solver.score_outcome(score))
+
+            # Playing the solver's moves ends the game after the predicted number of plies
+            plies = 0
+            while not board.is_game_over():
+                board = board.do_move(endgame_solver.best_move(board).move)
+                plies += 1
+            if score:
+                self.assertEqual(plies, result.plies)
+            else:
+                self.assertIsNone(result.plies)
+                self.assertTrue(board.is_tie())
+
+    def test_immediate_win_and_loss(self):
+        board = BitboardConnectFourBoard()
+        for col in [2, 2, 3, 3, 4]:
+            board = board.do_move(col)
+        # Player 1 threatens to win in both columns 1 and 5
+        result = solver.EndgameSolver().best_move(board)
+        self.assertEqual((result.outcome, result.plies), (solver.LOSS, 2))
+        self.assertEqual(result.score, -((solver.BOARD_CELLS - 5) // 2))
+
+        board = board.do_move(6)
+        result = solver.EndgameSolver().best_move(board)
+        self.assertEqual((result.move, result.outcome, result.plies), (1, solver.WIN, 1))
+        self.assertEqual(result.score, (solver.BOARD_CELLS + 1 - 6) // 2)
+
+        weak_result = solver.EndgameSolver().best_move(board, weak=True)
+        self.assertEqual((weak_result.move, weak_result.score, weak_result.plies), (1, solver.WIN, None))
+
+    def test_cancellation(self):
+        cancel_token = CancellationToken()
+        cancel_token.cancel()
+        board = BitboardConnectFourBoard().do_move(3).do_move(3)
+        self.assertRaises(SearchCancelled, solver.EndgameSolver().solve, board, cancel_token=cancel_token)
+
+    def test_player_threshold(self):
+        self.assertIsNone(implementation.endgame_solver_move(ConnectFourBoard()))
+
+        board = self._random_board(random.Random(2), 42 - implementation.ENDGAME_EMPTY_CELLS)
+        with quiet():
+            move = implementation.endgame_solver_move(board)
+        self.assertEqual(move, solver.EndgameSolver().best_move(board).move)
+
+    def test_player_move_time(self):
+        # The solver's time comes out of my_player's search timeout
+        def slow_solver_move(board):
+            time.sleep(0.2)
+            return None
+
+        timeouts = []
+
+        def search(board, search_fn, eval_fn, timeout):
+            timeouts.append(timeout)
+            return 3
+
+        saved = implementation.opening_book_move, implementation.endgame_solver_move, implementation.run_search_function
+        implementation.opening_book_move = lambda board: None
+        implementation.endgame_solver_move, implementation.run_search_function = slow_solver_move, search
+        try:
+            self.assertEqual(implementation.my_player(ConnectFourBoard()), 3)
+        finally:
+            implementation.opening_book_move, implementation.endgame_solver_move, implementation.run_search_function = saved
+        self.assertLessEqual(timeouts[0], implementation.MY_PLAYER_MOVE_TIME - 0.2)
+
+
+class TestTournament(unittest.TestCase):
+    def test_openings(self):
+        rng = random.Random(1)
+        for _ in range(50):
+            board = ConnectFourBoard()
+            for column in tournament.random_opening(rng, 6):
+                board = board.do_move(column)
+            self.assertEqual(board.num_tokens_on_board(), 6)
+            self.assertFalse(board.is_game_over())
+
+    def test_colours_swapped(self):
+        tasks = tournament.schedule_games(['random', 'basic', 'quick'], 4, seed=3)
+        self.assertEqual(len(tasks), 3 * 4)
+        for (p1, p2, opening, seed), (q1, q2, swapped_opening, swapped_seed) in zip(tasks[::2], tasks[1::2]):
+            self.assertEqual((p1, p2, opening, seed), (q2, q1, swapped_opening, swapped_seed))
+
+    def test_statistics(self):
+        self.assertEqual(tournament.score_interval(0, 0, 0), (None, None, None))
+        score, low, high = tournament.score_interval(6, 2, 2)
+        self.assertEqual(score, 0.7)
+        self.assertTrue(low < score < high)
+        self.assertEqual(tournament.score_interval(5, 0, 0)[2], 1.0)
+        self.assertAlmostEqual(tournament.elo_difference(0.75), 190.85, places=2)
+        self.assertEqual(tournament.elo_difference(0.5), 0)
+        self.assertIsNone(tournament.elo_difference(1.0))
+
+    def test_forfeit(self):
+        result = tournament.play_game('random', 'tests:_illegal_player', opening=[0, 0, 0, 0, 0, 0])
+        self.assertEqual((result['winner'], result['forfeit']), (1, 2))
+
+    def test_run_tournament(self):
+        results = tournament.run_tournament(['random', 'tests:_illegal_player'], games=4, workers=2)
+        self.assertEqual(len(results), 4)
+        summary, = tournament.summarize(results)
+        self.assertEqual(summary['games'], 4)
+        self.assertEqual(summary['wins'] + summary['losses'] + summary['draws'], 4)
+        self.assertEqual(set(summary['mean_move_time']), {'random', 'tests:_illegal_player'})
+
+
 if __name__ == "__main__":
     logging.basicConfig(stream=sys.stderr)
     logging.getLogger("tests").setLevel(logging.DEBUG)
@@ -0,0 +1,295 @@
+"""
+A tournament harness, to compare players over many games.
+
+Every pair of players plays a series of games, in a pool of worker processes.
+Each game starts from a randomly generated opening, and every opening is
+played twice, with the players swapping colours, so that neither player is
+favoured by the openings.  The results are summarized as win rates and Elo
+differences, with confidence intervals.
+
+Run from the command line, eg.:
+
+    python tournament.py basic alphabeta --games 200 --time-limit 10 --json results.json --csv games.csv
+
+Players are given by name (see PLAYERS), or as 'module:function' for any
+other player callback.
+"""
+import argparse
+import csv
+import itertools
+import json
+import math
+import random
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from importlib import import_module
+
+from connectfour import ConnectFourBoard, ConnectFourRunner, ILLEGAL_MOVE_FORFEIT, TIMEOUT_FORFEIT
+
+
+# Players that can be named on the command line, as 'module:function'
+PLAYERS = {
+    'random': 'tournament:random_player',
+    'basic': 'basicplayer:basic_player',
+    'quick': 'implementation:quick_to_win_player',
+    'alphabeta': 'implementation:alpha_beta_player',
+    'iterative': 'implementation:ab_iterative_player',
+    'my_player': 'implementation:my_player',
+}
+
+# z-score of the confidence intervals (95%)
+CONFIDENCE_Z = 1.96
+
+
+def random_player(board):
+    """
+    A player that drops its token into a random column
+    """
+    return random.choice([col for col in range(board.board_width) if board.get_height_of_column(col) >= 0])
+
+
+def load_player(spec):
+    """
+    Return the player callback named by 'spec': a name from PLAYERS, or 'module:function'
+    """
+    module_name, _, function_name = PLAYERS.get(spec, spec).partition(':')
+    if not function_name:
+        raise ValueError("Unknown player: {} (use one of {}, or 'module:function')".format(
+            spec, ', '.join(sorted(PLAYERS))))
+
+    return getattr(import_module(module_name), function_name)
+
+
+def random_opening(rng, plies):
+    """
+    Return a list of 'plies' random columns to play from the empty board.
+    The opening never ends the game, nor leaves a win in one move on the board.
+    """
+    while True:
+        board = ConnectFourBoard()
+        moves = []
+        for _ in range(plies):
+            legal = [col for col in range(board.board_width)
+                     if board.get_height_of_column(col) >= 0 and not board.do_move(col).is_game_over()]
+            if not legal:
+                break
+            column = rng.choice(legal)
+            board = board.do_move(column)
+            moves.append(column)
+
+        # Don't hand the next player a win on a plate
+        if len(moves) == plies and not any(board.do_move(col).is_win() for col in range(board.board_width)
+                                           if board.get_height_of_column(col) >= 0):
+            return moves
+
+
+def play_game(player1, player2, opening=(), seed=None, time_limit=None):
+    """
+    Play one game between two players, given as names or 'module:function'
+    specs, from the position reached by playing the 'opening' columns.
+    The game is silent (see util.quiet()).
+
+    A player that attempts an illegal move loses the game.  If time_limit is
+    specified, so does a player that takes longer than that to move.
+    Return a dictionary describing the game: the players, the opening, the
+    moves played, the time each move took, and the winner (1, 2, or 0 for a tie).
+    """
+    board = ConnectFourBoard()
+    for column in opening:
+        board = board.do_move(column)
+
+    if seed is not None:
+        random.seed(seed)
+
+    runner = ConnectFourRunner(load_player(player1), load_player(player2), board=board,
+                               time_limit=time_limit, trusted_callbacks=True,
+                               enforce_time_limit=time_limit is not None, timeout_policy=TIMEOUT_FORFEIT,
+                               illegal_move_policy=ILLEGAL_MOVE_FORFEIT)
+    record = runner.play_game()
+
+    return {'player1': player1,
+            'player2': player2,
+            'opening': list(opening),
+            'moves': record.moves,
+            'move_times': record.move_times,
+            'winner': record.winner,
+            'forfeit': record.forfeit,
+            'timeouts': record.timeouts}
+
+
+def _play_game_task(task, time_limit=None):
+    """
+    Play a game described by a (player1, player2, opening, seed) tuple; run in a worker process
+    """
+    return play_game(*task, time_limit=time_limit)
+
+
+def schedule_games(players, games, opening_plies=4, seed=0):
+    """
+    Return the (player1, player2, opening, seed) games to play between every
+    pair of players: about 'games' games per pair, each opening played twice
+    with the players swapping colours.
+    """
+    rng = random.Random(seed)
+    tasks = []
+
+    for first, second in itertools.combinations(players, 2):
+        for _ in range((games + 1) // 2):
+            opening = random_opening(rng, opening_plies)
+            game_seed = rng.getrandbits(32)
+            tasks.append((first, second, opening, game_seed))
+            tasks.append((second, first, opening, game_seed))
+
+    return tasks
+
+
+def score_interval(wins, losses, draws, z=CONFIDENCE_Z):
+    """
+    Return (score, low, high): the mean score of a series of games (1 per
+    win, 0.5 per draw), and its Wilson confidence interval.  Counting draws
+    as half a win makes the interval slightly wider than it needs to be.
+    """
+    games = wins + losses + draws
+    if not games:
+        return None, None, None
+
+    score = (wins + 0.5 * draws) / games
+    spread = z * z / games
+    center = (score + spread / 2) / (1 + spread)
+    margin = z * math.sqrt(score * (1 - score) / games + spread / (4 * games)) / (1 + spread)
+    # Rounded, so that the bounds of a perfect score are exactly 0 or 1
+    return score, max(0.0, round(center - margin, 12)), min(1.0, round(center + margin, 12))
+
+
+def elo_difference(score):
+    """
+    Return the Elo rating difference that corresponds to the specified mean
+    score, or None if it is unbounded (a score of 0 or 1)
+    """
+    if score is None or score <= 0 or score >= 1:
+        return None
+
+    return -400 * math.log10(1 / score - 1)
+
+
+def summarize(results):
+    """
+    Return a list of summaries, one per pair of players, of the specified game results
+    """
+    pairs = {}
+    for result in results:
+        pair = tuple(sorted((result['player1'], result['player2'])))
+        pairs.setdefault(pair, []).append(result)
+
+    summaries = []
+    for (first, second), games in sorted(pairs.items()):
+        wins = losses = draws = 0
+        times = {first: [], second: []}
+        for game in games:
+            winner = {1: game['player1'], 2: game['player2']}.get(game['winner'])
+            if winner == first:
+                wins += 1
+            elif winner == second:
+                losses += 1
+            else:
+                draws += 1
+
+            # Moves alternate, starting with whoever is to move after the opening
+            to_move = {0: game['player1'], 1: game['player2']}
+            for ply, move_time in enumerate(game['move_times']):
+                times[to_move[(len(game['opening']) + ply) % 2]].append(move_time)
+
+        score, low, high = score_interval(wins, losses, draws)
+        summaries.append({'player': first,
+                          'opponent': second,
+                          'games': len(games),
+                          'wins': wins,
+                          'losses': losses,
+                          'draws': draws,
+                          'score': score,
+                          'score_ci': [low, high],
+                          'elo': elo_difference(score),
+                          'elo_ci': [elo_difference(low), elo_difference(high)],
+                          'mean_move_time': {name: sum(t) / len(t) if t else None for name, t in times.items()},
+                          'max_move_time': {name: max(t) if t else None for name, t in times.items()}})
+
+    return summaries
+
+
+def run_tournament(players, games=100, opening_plies=4, seed=0, workers=None, time_limit=None):
+    """
+    Play about 'games' games between every pair of the specified players, in
+    a pool of 'workers' processes (the number of CPUs by default), with an
+    optional time limit per move (in seconds).
+    Return the list of game results (see play_game()).
+    """
+    tasks = schedule_games(players, games, opening_plies, seed)
+    play = partial(_play_game_task, time_limit=time_limit)
+
+    if workers == 1:
+        return [play(task) for task in tasks]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(play, tasks))
+
+
+def write_csv(results, path):
+    """
+    Write one row per game to a CSV file
+    """
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['player1', 'player2', 'opening', 'moves', 'winner', 'forfeit', 'timeouts',
+                         'total_time', 'max_move_time'])
+        for result in results:
+            writer.writerow([result['player1'], result['player2'],
+                             ''.join(str(col) for col in result['opening']),
+                             ''.join(str(col) for col in result['moves']),
+                             result['winner'], result['forfeit'] or '', result['timeouts'],
+                             '{:.4f}'.format(sum(result['move_times'])),
+                             '{:.4f}'.format(max(result['move_times'] or [0]))])
+
+
+def print_summary(summaries):
+    print("{:<12} {:<12} {:>6} {:>5} {:>5} {:>5} {:>7} {:>17} {:>8}".format(
+        'player', 'opponent', 'games', 'wins', 'loss', 'draw', 'score', 'score 95% CI', 'elo'))
+    for s in summaries:
+        print("{:<12} {:<12} {:>6} {:>5} {:>5} {:>5} {:>7.3f} {:>8.3f}-{:<8.3f} {:>8}".format(
+            s['player'], s['opponent'], s['games'], s['wins'], s['losses'], s['draws'], s['score'],
+            s['score_ci'][0], s['score_ci'][1], 'inf' if s['elo'] is None else '{:+.0f}'.format(s['elo'])))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Play a tournament between Connect Four players")
+    parser.add_argument('players', nargs='+',
+                        help="Players, from: {} (or 'module:function')".format(', '.join(sorted(PLAYERS))))
+    parser.add_argument('--games', type=int, default=100, help='Number of games per pair of players')
+    parser.add_argument('--opening-plies', type=int, default=4, help='Number of random moves in each opening')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for the openings')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Number of worker processes (the number of CPUs by default)')
+    parser.add_argument('--time-limit', type=float, default=None,
+                        help='Time limit per move, in seconds; a player that exceeds it loses the game')
+    parser.add_argument('--json', help='Write the summary to this JSON file')
+    parser.add_argument('--csv', help='Write one line per game to this CSV file')
+
+    args = parser.parse_args()
+
+    if len(set(args.players)) < len(args.players) or len(args.players) < 2:
+        parser.error("a tournament needs at least two different players")
+    for spec in args.players:
+        try:
+            load_player(spec)
+        except (ValueError, ImportError, AttributeError) as e:
+            parser.error(str(e))
+
+    results = run_tournament(args.players, args.games, args.opening_plies, args.seed, args.workers, args.time_limit)
+    summaries = summarize(results)
+    print_summary(summaries)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'players': args.players, 'games_per_pair': args.games, 'opening_plies': args.opening_plies,
+                       'seed': args.seed, 'time_limit': args.time_limit, 'pairs': summaries}, f, indent=2)
+    if args.csv:
+        write_csv(results, args.csv)
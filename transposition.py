@@ -0,0 +1,410 @@
+"""
+A bounded transposition table for the game-tree searches.
+
+Identical positions are reached through many different move orders in
+Connect Four; a transposition table remembers what a previous search
+learned about a position so that it doesn't have to be searched again.
+"""
+import struct
+from multiprocessing.shared_memory import SharedMemory
+
+from bitboard import canonical_board_key, mirror_column
+
+# Bound types for stored values
+EXACT = 0
+LOWER_BOUND = 1   # the real value is at least the stored value
+UPPER_BOUND = 2   # the real value is at most the stored value
+
+# Default memory cap for a table
+DEFAULT_MAX_BYTES = 32 * 2**20
+
+# An odd 64-bit constant (2**64 divided by the golden ratio), to scramble keys with
+_KEY_MULTIPLIER = 0x9E3779B97F4A7C15
+
+
+def board_key(board):
+    """
+    Return the transposition table key of a board: its Zobrist key, which
+    depends on the tokens on the board and on the player to move.
+    """
+    return board.get_zobrist_key()
+
+
+def scramble_key(key):
+    """
+    Return a 64-bit key scrambled so that similar keys end up in different
+    table slots.  Different keys remain different.
+
+    Position keys (see bitboard.position_key()) differ in a few bits from one
+    position to the next, and would crowd into the same slots otherwise.
+    """
+    return (key * _KEY_MULTIPLIER) & 0xFFFFFFFFFFFFFFFF
+
+
+def symmetric_board_key(board):
+    """
+    Return a key that is the same for a board and its mirror image (see
+    bitboard.canonical_position_key()), eg. to cache an evaluation function
+    that scores mirror images alike with util.memoize(key_fn=...)
+    """
+    return canonical_board_key(board)[0]
+
+
+class TTEntry(object):
+    """
+    One transposition table entry.  Treat as read-only.
+    """
+    __slots__ = ('key', 'depth', 'value', 'flag', 'best_move', 'generation')
+
+    def __init__(self, key, depth, value, flag, best_move, generation):
+        self.key = key
+        self.depth = depth
+        self.value = value
+        self.flag = flag
+        self.best_move = best_move
+        self.generation = generation
+
+
+class TranspositionTable(object):
+    """
+    A fixed-size, hash-indexed transposition table.
+
+    Each position maps to a single slot.  When two positions compete for a slot,
+    the new entry replaces the old one if the old one is from an earlier search
+    (see new_search()), or if the new one was searched at least as deep.
+
+    A table is only valid for a single evaluation function; don't share one
+    between searches that score leaves differently.
+
+    A symmetric table stores a position and its mirror image in the same entry,
+    with best moves translated accordingly, so that it holds twice as many
+    positions and hits twice as often.  Its evaluation function must score
+    mirror images alike.  Look boards up with the key and mirrored flag from
+    key_for(), and pass the flag on to store() and get_best_move().
+    """
+
+    # Approximate memory footprint of one stored entry, including its slot
+    ENTRY_BYTES = 160
+
+    def __init__(self, max_entries=None, max_bytes=DEFAULT_MAX_BYTES, symmetric=False):
+        """
+        Create a new, empty table.
+
+        max_entries -- the number of slots in the table; if not specified,
+                       it is derived from max_bytes
+        max_bytes -- the (approximate) memory cap for the table
+        symmetric -- whether to store mirror images in the same entries
+        """
+        if max_entries is None:
+            max_entries = max_bytes // self.ENTRY_BYTES
+
+        if max_entries < 1:
+            raise ValueError("A transposition table needs at least one slot")
+
+        self._size = max_entries
+        self.symmetric = symmetric
+        self._slots = [None] * max_entries
+        self._generation = 0
+        self.reset_stats()
+
+    def key_for(self, board):
+        """
+        Return (key, mirrored): the key to look the board up with, and whether
+        the table's entry for it is its mirror image's
+        """
+        if self.symmetric:
+            key, mirrored = canonical_board_key(board)
+            return scramble_key(key), mirrored
+
+        return board_key(board), False
+
+    def reset_stats(self):
+        """
+        Reset the table's statistics counters
+        """
+        self.probes = 0
+        self.hits = 0
+        self.cutoffs = 0
+        self.stores = 0
+        self.replacements = 0
+
+    def new_search(self):
+        """
+        Mark the start of a new search.  Entries from earlier searches are kept
+        and can still be probed, but are the first to be replaced.
+        """
+        self._generation += 1
+
+    def clear(self):
+        """
+        Remove every entry from the table
+        """
+        self._slots = [None] * self._size
+
+    def probe(self, key):
+        """
+        Return the TTEntry stored for the specified key, or None if there is none
+        """
+        self.probes += 1
+        entry = self._slots[key % self._size]
+
+        if entry is not None and entry.key == key:
+            self.hits += 1
+            return entry
+
+        return None
+
+    def store(self, key, depth, value, flag, best_move=None, mirrored=False):
+        """
+        Store the result of searching a position to the specified depth.
+
+        flag is one of EXACT, LOWER_BOUND or UPPER_BOUND.
+        best_move is the move that produced the value, if known.
+        mirrored is the flag returned by key_for() with the key.
+        """
+        if mirrored and best_move is not None:
+            best_move = mirror_column(best_move)
+        index = key % self._size
+        old = self._slots[index]
+
+        if old is not None and old.key != key:
+            if old.generation == self._generation and old.depth > depth:
+                return
+            self.replacements += 1
+
+        self.stores += 1
+        self._slots[index] = TTEntry(key, depth, value, flag, best_move, self._generation)
+
+    def get_best_move(self, key, mirrored=False):
+        """
+        Return the best move stored for the specified key, or None if it is unknown.
+        mirrored is the flag returned by key_for() with the key.
+        """
+        entry = self._slots[key % self._size]
+
+        if entry is not None and entry.key == key and entry.best_move is not None:
+            return mirror_column(entry.best_move) if mirrored else entry.best_move
+
+        return None
+
+    def __len__(self):
+        """
+        Return the number of occupied slots
+        """
+        return sum(1 for entry in self._slots if entry is not None)
+
+    def stats(self):
+        """
+        Return a dictionary of the table's statistics counters
+        """
+        return {'size': self._size,
+                'probes': self.probes,
+                'hits': self.hits,
+                'hit_rate': float(self.hits) / self.probes if self.probes else 0.0,
+                'cutoffs': self.cutoffs,
+                'stores': self.stores,
+                'replacements': self.replacements}
+
+
+# Shared tables attached in this process, by name
+_shared_tables = {}
+
+_DOUBLE = struct.Struct('<d')
+_UINT64 = struct.Struct('<Q')
+
+
+def _double_bits(value):
+    """
+    Return the bits of a float, as an integer
+    """
+    return _UINT64.unpack(_DOUBLE.pack(value))[0]
+
+
+def _attach_shared_table(name, max_entries, symmetric=False):
+    """
+    Return this process's SharedTranspositionTable for the named shared memory block
+    """
+    table = _shared_tables.get(name)
+    if table is None:
+        table = SharedTranspositionTable(max_entries, name=name, symmetric=symmetric)
+    return table
+
+
+class SharedTranspositionTable(object):
+    """
+    A transposition table in shared memory, for searches running in several
+    processes at once.  It has the same interface as TranspositionTable.
+
+    Pickling the table (eg. to send it to a worker process) only sends the
+    name of its shared memory block; the worker attaches to the same memory.
+    The statistics counters are kept separately by each process.
+
+    Writes take no lock.  Each slot stores the key XORed with the rest of the
+    entry, so an entry that was read while another process was writing it
+    simply doesn't match its key, and is treated as missing.  Keys must be
+    64-bit integers, and best moves small non-negative integers (columns).
+    """
+
+    # A slot: the key XORed with the other two words, the value, and the rest of the entry
+    SLOT = struct.Struct('<QdQ')
+    # The header: the generation of the current search
+    HEADER = struct.Struct('<Q')
+    ENTRY_BYTES = SLOT.size
+
+    def __init__(self, max_entries=None, max_bytes=DEFAULT_MAX_BYTES, name=None, symmetric=False):
+        """
+        Create a new, empty table, or attach to an existing one.
+
+        max_entries -- the number of slots in the table; if not specified,
+                       it is derived from max_bytes
+        max_bytes -- the (approximate) memory cap for the table
+        name -- the name of the shared memory block of an existing table
+        symmetric -- whether to store mirror images in the same entries
+        """
+        if max_entries is None:
+            max_entries = max_bytes // self.ENTRY_BYTES
+
+        if max_entries < 1:
+            raise ValueError("A transposition table needs at least one slot")
+
+        self._size = max_entries
+        self.symmetric = symmetric
+        self._owner = name is None
+        self._shm = SharedMemory(name=name, create=self._owner,
+                                 size=self.HEADER.size + max_entries * self.SLOT.size)
+        self._buf = self._shm.buf
+        _shared_tables[self._shm.name] = self
+        self.reset_stats()
+
+    def __reduce__(self):
+        return (_attach_shared_table, (self._shm.name, self._size, self.symmetric))
+
+    def close(self):
+        """
+        Detach from the shared memory; the process that created the table also frees it
+        """
+        _shared_tables.pop(self._shm.name, None)
+        self._buf = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+    def key_for(self, board):
+        """
+        Return (key, mirrored): the key to look the board up with, and whether
+        the table's entry for it is its mirror image's
+        """
+        if self.symmetric:
+            key, mirrored = canonical_board_key(board)
+            return scramble_key(key), mirrored
+
+        return board_key(board), False
+
+    def reset_stats(self):
+        """
+        Reset this process's statistics counters
+        """
+        self.probes = 0
+        self.hits = 0
+        self.cutoffs = 0
+        self.stores = 0
+        self.replacements = 0
+
+    def _get_generation(self):
+        return self.HEADER.unpack_from(self._buf, 0)[0]
+
+    def new_search(self):
+        """
+        Mark the start of a new search, for every process using the table
+        """
+        self.HEADER.pack_into(self._buf, 0, (self._get_generation() + 1) & 0xFFFF)
+
+    def clear(self):
+        """
+        Remove every entry from the table
+        """
+        self._buf[self.HEADER.size:] = bytes(self._size * self.SLOT.size)
+
+    def _read(self, key):
+        """
+        Return the TTEntry in the slot of the specified key, whatever key it belongs to,
+        or None if the slot is empty or was being written
+        """
+        check, value, info = self.SLOT.unpack_from(self._buf, self.HEADER.size + (key % self._size) * self.SLOT.size)
+        if not info & 1:
+            return None
+
+        value_bits = _double_bits(value)
+        if value.is_integer():
+            value = int(value)
+        best_move = (info >> 24) & 0xFFFF
+        return TTEntry(check ^ value_bits ^ info, (info >> 8) & 0xFFFF, value, (info >> 1) & 3,
+                       best_move - 1 if best_move else None, info >> 40)
+
+    def probe(self, key):
+        """
+        Return the TTEntry stored for the specified key, or None if there is none
+        """
+        self.probes += 1
+        entry = self._read(key)
+
+        if entry is not None and entry.key == key:
+            self.hits += 1
+            return entry
+
+        return None
+
+    def store(self, key, depth, value, flag, best_move=None, mirrored=False):
+        """
+        Store the result of searching a position to the specified depth.
+
+        flag is one of EXACT, LOWER_BOUND or UPPER_BOUND.
+        best_move is the move that produced the value, if known.
+        mirrored is the flag returned by key_for() with the key.
+        """
+        if mirrored and best_move is not None:
+            best_move = mirror_column(best_move)
+        generation = self._get_generation()
+        old = self._read(key)
+
+        if old is not None and old.key != key:
+            if old.generation == generation and old.depth > depth:
+                return
+            self.replacements += 1
+
+        self.stores += 1
+        # Bit 0: slot in use; bits 1-2: flag; 8-23: depth; 24-39: best move + 1; 40-55: generation
+        info = (1 | (flag << 1) | (min(depth, 0xFFFF) << 8) | ((0 if best_move is None else best_move + 1) << 24)
+                | (generation << 40))
+        self.SLOT.pack_into(self._buf, self.HEADER.size + (key % self._size) * self.SLOT.size,
+                            key ^ _double_bits(value) ^ info, value, info)
+
+    def get_best_move(self, key, mirrored=False):
+        """
+        Return the best move stored for the specified key, or None if it is unknown.
+        mirrored is the flag returned by key_for() with the key.
+        """
+        entry = self._read(key)
+
+        if entry is not None and entry.key == key and entry.best_move is not None:
+            return mirror_column(entry.best_move) if mirrored else entry.best_move
+
+        return None
+
+    def __len__(self):
+        """
+        Return the number of occupied slots
+        """
+        return sum(1 for index in range(self._size) if self._read(index) is not None)
+
+    def stats(self):
+        """
+        Return a dictionary of this process's statistics counters
+        """
+        return {'size': self._size,
+                'probes': self.probes,
+                'hits': self.hits,
+                'hit_rate': float(self.hits) / self.probes if self.probes else 0.0,
+                'cutoffs': self.cutoffs,
+                'stores': self.stores,
+                'replacements': self.replacements}
@@ -1,19 +1,462 @@
-from threading import Thread
-from time import time
+import json
+import os
+import signal
+from collections import OrderedDict
+from contextlib import contextmanager, redirect_stdout
+from functools import update_wrapper
+from inspect import Parameter, signature
+from multiprocessing import Pipe, Process, resource_tracker
+from threading import RLock, Thread
+from time import perf_counter, time
+from weakref import WeakSet
 
 
 INFINITY = float("inf")
 NEG_INFINITY = float("-inf")
 
 
+# Number of active quiet() blocks
+_quiet_depth = 0
+
+
+@contextmanager
+def quiet():
+    """
+    Context manager that silences the game: searches don't print their
+    decisions (they don't even format them) while it is active, and anything
+    else written to stdout is discarded.
+
+    It applies to every thread, so that searches running in the background
+    (see run_search_function) are silenced too.
+    """
+    global _quiet_depth
+    _quiet_depth += 1
+    try:
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            yield
+    finally:
+        _quiet_depth -= 1
+
+
+def is_quiet():
+    """
+    Return True if output is silenced (see quiet())
+    """
+    return _quiet_depth > 0
+
+
+class SearchCancelled(Exception):
+    """
+    Raised from inside a search function when its CancellationToken is cancelled
+    """
+    pass
+
+
+class CancellationToken(object):
+    """
+    Tells a running search when to give up: either when cancel() has been
+    called, or once its deadline (a time() value, if any) has passed.
+
+    Search functions accept a token as their 'cancel_token' argument, and
+    call check() at every node they visit.
+    """
+
+    def __init__(self, deadline=None):
+        self.deadline = deadline
+        self._cancelled = False
+
+    def cancel(self):
+        """
+        Ask the search to stop as soon as possible
+        """
+        self._cancelled = True
+
+    def is_cancelled(self):
+        """
+        Return True if the search should stop
+        """
+        if not self._cancelled and self.deadline is not None and time() >= self.deadline:
+            self._cancelled = True
+
+        return self._cancelled
+
+    def check(self):
+        """
+        Raise SearchCancelled if the search should stop
+        """
+        if self.is_cancelled():
+            raise SearchCancelled()
+
+
+class TimeLimitExceeded(Exception):
+    """
+    Raised by KillableWorker.call() when the function doesn't return in time
+    """
+    pass
+
+
+def _serve_calls(fn, conn, parent_conn):
+    """
+    Call 'fn' with every tuple of arguments received on 'conn', and send back
+    (True, result), or (False, exception) if it raised one.  Run in a KillableWorker's process.
+    """
+    # A process group of its own, so that killing the worker also kills any
+    # process that 'fn' started (the parent sets it too, in case it kills us first)
+    os.setpgid(0, 0)
+
+    # Only the parent may keep its end of the pipe open, so that closing it ends this loop
+    parent_conn.close()
+
+    while True:
+        try:
+            args = conn.recv()
+        except EOFError:
+            break
+
+        try:
+            result = (True, fn(*args))
+        except Exception as e:
+            result = (False, e)
+
+        try:
+            conn.send(result)
+        except Exception as e:
+            # The result or the exception can't be pickled
+            conn.send((False, RuntimeError(repr(e))))
+
+
+class KillableWorker(object):
+    """
+    Calls a function in a separate process, so that a call that runs past its
+    deadline can be killed, however busy the function is.
+
+    The process is started on the first call and kept for the next ones, so
+    the function can keep state (eg. caches) from call to call, until a call
+    times out: the process is then killed, along with any process the
+    function started, and a new one is started for the next call.  The
+    function and its arguments are sent to the process, so they must be
+    picklable, unless processes are started by forking.
+    """
+
+    def __init__(self, fn):
+        self.fn = fn
+        self._process = None
+        self._conn = None
+
+    def _start(self):
+        # Shared memory that the function creates is then tracked by this
+        # process's resource tracker, which outlives the worker's process group,
+        # and unlinks whatever a killed worker left behind
+        resource_tracker.ensure_running()
+
+        self._conn, child_conn = Pipe()
+        # Not a daemon, so that the function can start processes of its own
+        self._process = Process(target=_serve_calls, args=(self.fn, child_conn, self._conn))
+        self._process.start()
+        child_conn.close()
+        try:
+            os.setpgid(self._process.pid, self._process.pid)
+        except OSError:
+            # The worker has already set it (or died)
+            pass
+
+    def call(self, *args, timeout=None):
+        """
+        Return fn(*args), computed in the worker process.  Raise
+        TimeLimitExceeded (after killing the process) if it takes more than
+        'timeout' seconds, or any exception raised by fn.
+        """
+        if self._process is None:
+            self._start()
+
+        self._conn.send(args)
+        if not self._conn.poll(timeout):
+            self.kill()
+            raise TimeLimitExceeded()
+
+        try:
+            ok, value = self._conn.recv()
+        except EOFError:
+            self.kill()
+            raise RuntimeError("The worker process died")
+
+        if not ok:
+            raise value
+        return value
+
+    def kill(self):
+        """
+        Kill the worker process right away, with every process it started
+        """
+        if self._process is not None:
+            try:
+                os.killpg(self._process.pid, signal.SIGKILL)
+            except OSError:
+                # The process group is already gone
+                self._process.kill()
+            self._process.join()
+            self._conn.close()
+            self._process = None
+
+    def close(self):
+        """
+        Stop the worker process, once it is done with its current call
+        """
+        if self._process is not None:
+            self._conn.close()
+            self._process.join(1)
+            if self._process.is_alive():
+                self.kill()
+            self._process = None
+
+
+def accepts_kwarg(fn, name):
+    """
+    Return True if the function 'fn' can be called with the keyword argument 'name'
+    """
+    try:
+        params = signature(fn).parameters
+    except (TypeError, ValueError):
+        return False
+
+    return name in params or any(p.kind == Parameter.VAR_KEYWORD for p in params.values())
+
+
+class TimeManager(object):
+    """
+    Decides how much time to spend on a move, and whether an iterative
+    deepening search has time left to start another iteration.
+
+    Each iteration of a search costs about 'effective branching factor'
+    times as much as the previous one.  The factor is measured from the
+    previous iterations, and a new iteration is only started if it is
+    predicted to finish within the move's time budget.
+
+    If game_time is specified, the time manager also keeps a game clock:
+    each move gets an even share of the remaining time over the moves that
+    are likely to be left in the game, and end_move() charges the time used.
+    The clock belongs to whoever creates the time manager: neither the
+    players nor ConnectFourRunner keep one, so pass the same TimeManager to
+    run_search_function for every move of a game, and call new_game() at
+    the start of every game.
+    """
+
+    # Branching factor assumed before two iterations have been timed
+    DEFAULT_BRANCHING_FACTOR = 4.0
+    # Measured branching factors are clamped to this range, since the first
+    # (very short) iterations give noisy timings
+    MIN_BRANCHING_FACTOR = 1.5
+    MAX_BRANCHING_FACTOR = 7.0
+    # Never plan for fewer moves than this when sharing out the game clock
+    MIN_MOVES_TO_GO = 4
+
+    def __init__(self, move_time=5, game_time=None):
+        """
+        move_time -- the most time (in seconds) to spend on any one move
+        game_time -- (optional) the total time (in seconds) available for the whole game
+        """
+        self.move_time = move_time
+        self.game_time = game_time
+        self.new_game()
+
+    def new_game(self):
+        """
+        Reset the game clock
+        """
+        self.remaining_time = self.game_time
+
+    def allocate(self, board=None):
+        """
+        Return the time budget (in seconds) for the next move on the specified board
+        """
+        if self.remaining_time is None:
+            return self.move_time
+
+        moves_to_go = self.MIN_MOVES_TO_GO
+        if board is not None:
+            empty_cells = board.board_width * board.board_height - board.num_tokens_on_board()
+            moves_to_go = max(moves_to_go, (empty_cells + 1) // 2)
+
+        return max(0, min(self.move_time, self.remaining_time / moves_to_go))
+
+    def end_move(self, elapsed):
+        """
+        Charge 'elapsed' seconds of thinking time to the game clock
+        """
+        if self.remaining_time is not None:
+            self.remaining_time = max(0, self.remaining_time - elapsed)
+
+    def branching_factor(self, iteration_times):
+        """
+        Return the effective branching factor observed over the iterations
+        with the specified durations
+        """
+        if len(iteration_times) < 2 or iteration_times[-2] <= 0:
+            return self.DEFAULT_BRANCHING_FACTOR
+
+        factor = iteration_times[-1] / iteration_times[-2]
+        return min(self.MAX_BRANCHING_FACTOR, max(self.MIN_BRANCHING_FACTOR, factor))
+
+    def should_start_iteration(self, elapsed, budget, iteration_times):
+        """
+        Return True if an iteration is expected to finish within the budget,
+        given the time already elapsed and the durations of the previous iterations
+        """
+        if not iteration_times:
+            return elapsed < budget
+
+        predicted = iteration_times[-1] * self.branching_factor(iteration_times)
+        return elapsed + predicted < budget
+
+
+class SearchStats(object):
+    """
+    Records what a search did: nodes visited, static evaluations, cutoffs
+    (by ply from the root), transposition table hits, and the nodes and time
+    of every depth of an iterative deepening search.
+
+    Search functions accept a SearchStats as their 'stats' argument, and
+    update its counters as they go; run_search_function passes one on to its
+    search_fn.  One SearchStats may record several searches, eg. every depth
+    of an iterative deepening search, or every move of a game.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """
+        Reset every counter
+        """
+        self.nodes = 0
+        self.evaluations = 0
+        self.cutoffs_by_ply = {}
+        self.tt_hits = 0
+        self.tt_cutoffs = 0
+        self.iterations = []
+        self.depth = 0
+        self._iteration_start = None
+
+    def record_cutoff(self, depth):
+        """
+        Count a cutoff at a node with 'depth' plies left to search
+        """
+        ply = self.depth - depth
+        self.cutoffs_by_ply[ply] = self.cutoffs_by_ply.get(ply, 0) + 1
+
+    @property
+    def cutoffs(self):
+        return sum(self.cutoffs_by_ply.values())
+
+    def start_iteration(self, depth):
+        """
+        Mark the start of a search to the specified depth
+        """
+        self.depth = depth
+        self._iteration_start = (perf_counter(), self.nodes, self.evaluations, self.cutoffs, self.tt_hits)
+
+    def end_iteration(self, move=None, value=None):
+        """
+        Mark the end of the search started by start_iteration(), which chose
+        'move', with the specified value
+        """
+        start, nodes, evaluations, cutoffs, tt_hits = self._iteration_start
+        seconds = perf_counter() - start
+        nodes = self.nodes - nodes
+        previous = self.iterations[-1] if self.iterations else None
+
+        self.iterations.append({
+            'depth': self.depth,
+            'move': move,
+            'value': value,
+            'nodes': nodes,
+            'evaluations': self.evaluations - evaluations,
+            'cutoffs': self.cutoffs - cutoffs,
+            'tt_hits': self.tt_hits - tt_hits,
+            'seconds': seconds,
+            'nodes_per_second': nodes / seconds if seconds > 0 else None,
+            # How many times as many nodes as the previous depth this depth took
+            'branching_factor': (float(nodes) / previous['nodes']
+                                 if previous and previous['depth'] == self.depth - 1 and previous['nodes'] else None),
+        })
+
+    def effective_branching_factor(self):
+        """
+        Return the effective branching factor of the deepest search: the ratio
+        of its nodes to the previous depth's, or the depth-th root of its
+        nodes if it wasn't preceded by the previous depth; None if no search
+        was recorded
+        """
+        if not self.iterations:
+            return None
+
+        last = self.iterations[-1]
+        if last['branching_factor'] is not None:
+            return last['branching_factor']
+
+        return last['nodes'] ** (1.0 / last['depth']) if last['depth'] > 0 else None
+
+    def to_dict(self):
+        """
+        Return the statistics as a dictionary of JSON-serializable values
+        """
+        seconds = sum(iteration['seconds'] for iteration in self.iterations)
+        return {'nodes': self.nodes,
+                'evaluations': self.evaluations,
+                'cutoffs': self.cutoffs,
+                'cutoffs_by_ply': {str(ply): count for ply, count in sorted(self.cutoffs_by_ply.items())},
+                'tt_hits': self.tt_hits,
+                'tt_cutoffs': self.tt_cutoffs,
+                'max_depth': max([iteration['depth'] for iteration in self.iterations] or [0]),
+                'seconds': seconds,
+                'nodes_per_second': sum(it['nodes'] for it in self.iterations) / seconds if seconds > 0 else None,
+                'effective_branching_factor': self.effective_branching_factor(),
+                'iterations': list(self.iterations)}
+
+    def to_json(self, **kwargs):
+        """
+        Return the statistics as a JSON string; kwargs are passed on to json.dumps
+        """
+        return json.dumps(self.to_dict(), **kwargs)
+
+
+def max_useful_depth(board):
+    """
+    Return the number of moves left before the board is full,
+    or None if that can't be worked out for this kind of board
+    """
+    try:
+        return board.board_width * board.board_height - board.num_tokens_on_board()
+    except AttributeError:
+        return None
+
+
 class ContinuousThread(Thread):
     """
     A thread that runs a function continuously,
     with an incrementing 'depth' kwarg, until
     a specified timeout has been exceeded
+
+    A TimeManager decides whether each new depth is likely to finish in time.
+
+    If the function accepts a 'cancel_token' kwarg, it is given a
+    CancellationToken that expires at the timeout, so that an unfinished
+    search is abandoned instead of running on in the background.
+
+    If the function accepts a 'first_move' kwarg, it is given the answer of
+    the previous depth, so that it can search that move first.  Only the
+    root move is passed on: the rest of the previous depth's principal
+    variation is only reused by searches that order their moves with a
+    transposition table (eg. alpha_beta_search with a tt and a
+    moveordering.MoveOrderer using it), which then search the table's best
+    move first at every node.
+
+    If stats (a SearchStats) is specified and the function accepts a 'stats'
+    kwarg, it is given the stats to record its searches in.
     """
 
-    def __init__(self, timeout=5, target=None, group=None, name=None, args=(), kwargs=None):
+    def __init__(self, timeout=5, target=None, group=None, name=None, args=(), kwargs=None,
+                 time_manager=None, stats=None):
         """
         Store the various values that we use from the constructor args,
         then let the superclass's constructor do its thing
@@ -21,10 +464,17 @@ class ContinuousThread(Thread):
         if kwargs is None:
             kwargs = {}
 
+        if time_manager is None:
+            time_manager = TimeManager(move_time=timeout)
+
         self._timeout = timeout
         self._target = target
         self._args = args
         self._kwargs = kwargs
+        self._time_manager = time_manager
+        self.stats = stats
+        self.cancel_token = CancellationToken()
+        self.iteration_times = []
         Thread.__init__(self, args=args, kwargs=kwargs, group=group, target=target, name=name)
 
     def run(self):
@@ -33,17 +483,49 @@ class ContinuousThread(Thread):
         """
         depth = 1
 
-        timeout = self._timeout**(1/2.0)  # Times grow exponentially, and we don't want to
-                                          # start a new depth search when we won't have
-                                          # enough time to finish it
+        start_time = time()
+        board = self._kwargs.get('board')
+        budget = min(self._timeout, self._time_manager.allocate(board))
+        max_depth = max_useful_depth(board)
 
-        end_time = time() + timeout
-        
-        while time() < end_time:
+        if accepts_kwarg(self._target, 'cancel_token'):
+            self.cancel_token.deadline = start_time + self._timeout
+            self._kwargs['cancel_token'] = self.cancel_token
+
+        use_first_move = accepts_kwarg(self._target, 'first_move')
+
+        if self.stats is not None and accepts_kwarg(self._target, 'stats'):
+            self._kwargs['stats'] = self.stats
+
+        while (not self.cancel_token.is_cancelled()
+               and self._time_manager.should_start_iteration(time() - start_time, budget, self.iteration_times)):
             self._kwargs['depth'] = depth
-            self._most_recent_val = self._target(*self._args, **self._kwargs)
+            iteration_start = time()
+            try:
+                self._most_recent_val = self._target(*self._args, **self._kwargs)
+            except SearchCancelled:
+                # The deepest search didn't finish; keep the previous depth's answer
+                break
+            self.iteration_times.append(time() - iteration_start)
+
+            if use_first_move:
+                # Search the current best move first at the next depth
+                self._kwargs['first_move'] = self._most_recent_val
+
+            if max_depth is not None and depth >= max_depth:
+                # Searching any deeper can't see anything new
+                break
             depth += 1
 
+        self._time_manager.end_move(time() - start_time)
+
+    def cancel(self):
+        """
+        Stop the search: no new depth is started, and a search function that
+        accepts a 'cancel_token' abandons the depth it is working on
+        """
+        self.cancel_token.cancel()
+
     def get_most_recent_val(self):
         """
         Return the most-recent return value of the thread function
@@ -51,39 +533,70 @@ class ContinuousThread(Thread):
         try:
             return self._most_recent_val
         except AttributeError:
-            print("Error: You ran the search function for so short a time that it couldn't even come up "
-                  "with any answer at all!  Returning a random column choice...")
+            if not is_quiet():
+                print("Error: You ran the search function for so short a time that it couldn't even come up "
+                      "with any answer at all!  Returning a random column choice...")
             import random
             return random.randint(0, 6)
 
 
-def run_search_function(board, search_fn, eval_fn, timeout=5):
+def run_search_function(board, search_fn, eval_fn, timeout=5, time_manager=None, stats=None):
     """
     Run the specified search function "search_fn" to increasing depths
     until "time" has expired; then return the most recent available return value
 
+    "time_manager" is an optional TimeManager, which decides when to stop
+    starting new depths.  "timeout" is always a hard limit.
+
+    "stats" is an optional SearchStats, for search functions that take a
+    'stats' argument to record what they did in.  The search that was still
+    running at the timeout may update it for a moment after this returns.
+
     "search_fn" must take the following arguments:
     board -- the ConnectFourBoard to search
     depth -- the depth to estimate to
     eval_fn -- the evaluation function to use to rank nodes
 
+    "search_fn" may also take the following argument:
+    cancel_token -- a CancellationToken to poll (see CancellationToken.check());
+                    the search is cancelled once "timeout" has expired
+    first_move -- the answer of the previous, shallower search, which is
+                  likely to be a good move to search first
+    stats -- the SearchStats given as "stats"
+
     "eval_fn" must take the following arguments:
     board -- the ConnectFourBoard to rank
     """
 
     eval_t = ContinuousThread(timeout=timeout, target=search_fn, kwargs={'board': board,
-                                                                         'eval_fn': eval_fn})
+                                                                         'eval_fn': eval_fn},
+                              time_manager=time_manager, stats=stats)
 
-    eval_t.setDaemon(True)
+    eval_t.daemon = True
     eval_t.start()
     
     eval_t.join(timeout)
 
-    # Note that the thread may not actually be done eating CPU cycles yet;
-    # Python doesn't allow threads to be killed meaningfully...
+    # Python doesn't allow threads to be killed meaningfully, so ask the
+    # search to stop; search functions that poll their cancel_token will.
+    eval_t.cancel()
+
     return int(eval_t.get_most_recent_val())
 
 
+# Memoized functions whose caches are cleared at the start of every game
+_per_game_memoized = WeakSet()
+
+
+def clear_per_game_caches():
+    """
+    Clear the cache of every function memoized with per_game=True.
+    ConnectFourRunner calls this at the start of every game.
+    """
+    for memoized in list(_per_game_memoized):
+        memoized.clear()
+
+
 class memoize(object):
     """
     'Memoize' decorator.
@@ -95,16 +608,84 @@ class memoize(object):
     @memoize
     def my_fn(stuff):
         # Do stuff
+
+    or, to bound the cache to the 10000 most recently used values:
+    my_fn = memoize(my_fn, maxsize=10000)
+
+    If per_game is True, the cache is also cleared at the start of every game
+    (see clear_per_game_caches()).
+
+    By default, values are cached by the function's arguments.  key_fn, if
+    specified, is called with the same arguments as the function and returns
+    the key to cache by instead (eg. for arguments that can't be hashed).
+
+    The cache may be shared between threads.  Its hit, miss and eviction
+    counters are available from stats().
     """
-    def __init__(self, fn):
+    def __init__(self, fn, maxsize=None, per_game=False, key_fn=None):
         self.fn = fn
-        self.memocache = {}
+        self.maxsize = maxsize
+        self.key_fn = key_fn
+        self.memocache = OrderedDict()
+        self._lock = RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        update_wrapper(self, fn)
+
+        if per_game:
+            _per_game_memoized.add(self)
 
     def __call__(self, *args, **kwargs):
-        memokey = (args, tuple(sorted(kwargs.items())))
-        if memokey in self.memocache:
-            return self.memocache[memokey]
+        if self.key_fn is not None:
+            memokey = self.key_fn(*args, **kwargs)
         else:
-            val = self.fn(*args, **kwargs)
+            memokey = (args, tuple(sorted(kwargs.items())))
+
+        with self._lock:
+            if memokey in self.memocache:
+                self.hits += 1
+                if self.maxsize is not None:
+                    self.memocache.move_to_end(memokey)
+                return self.memocache[memokey]
+
+            self.misses += 1
+
+        # Don't hold the lock while computing the value, so that
+        # other threads can use the cache in the meantime
+        val = self.fn(*args, **kwargs)
+
+        with self._lock:
             self.memocache[memokey] = val
-            return val
+            if self.maxsize is not None:
+                self.memocache.move_to_end(memokey)
+                while len(self.memocache) > self.maxsize:
+                    self.memocache.popitem(last=False)
+                    self.evictions += 1
+
+        return val
+
+    def __reduce__(self):
+        """
+        Pickle a memoized function by name, like a plain function, so that it
+        can be sent to worker processes.  Each process keeps its own cache.
+        """
+        return self.__qualname__
+
+    def clear(self):
+        """
+        Empty the cache.  The statistics counters are kept.
+        """
+        with self._lock:
+            self.memocache.clear()
+
+    def stats(self):
+        """
+        Return a dictionary of the cache's statistics counters
+        """
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'size': len(self.memocache),
+                    'maxsize': self.maxsize}